@@ -0,0 +1,375 @@
+"""
+Per-stage benchmark of the full pipeline over the bundled photos:
+
+    decode -> board inference -> square detections -> order_squares (lattice fit
+    + labels) -> piece inference -> piece detections -> assign_pieces -> FEN
+    -> annotate/encode
+
+Every combination of --batch-sizes and --threads is run over all images
+(testimage/, king_queen/ and new_img.jpg by default), each in a fresh process
+that loads its own models, so every run's peak RSS is its own. The results
+are written as JSON:
+    python bench_pipeline.py run --batch-sizes 1 4 8 --threads 1 2 --out bench.json
+
+Check a change against a stored baseline (exit code 1 on regressions):
+    python bench_pipeline.py compare bench_baseline.json bench.json --tolerance 0.1
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+
+import cv2
+import numpy as np
+
+from config import load_config
+from ingest import decode_buffer, DECODE_MIN_SIDE
+from model_registry import CALIBRATION_DIRS, list_images, load_model
+from piece_square import assign_pieces_to_squares, get_fen_from_board_state
+from postprocess import piece_detections, square_detections
+from responses import render_annotated
+from testing import label_detections_with_fit
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SOURCES = list(CALIBRATION_DIRS) + [os.path.join(HERE, "new_img.jpg")]
+
+STAGES = ('decode', 'board_inference', 'square_detections', 'order_squares', 'piece_inference',
+          'piece_detections', 'assign_pieces', 'fen', 'annotate')
+
+# Metrics compared against a baseline, and whether higher is better
+COMPARED = {'throughput_ips': True, 'peak_rss_mb': False, 'tracemalloc_peak_mb': False}
+
+
+class StageTimer:
+    """Collects (milliseconds, items) per stage; safe to share between worker threads."""
+
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+        self._lock = threading.Lock()
+
+    def time(self, stage, items=1):
+        return _Span(self, stage, items)
+
+    def add(self, stage, ms, items):
+        with self._lock:
+            self.samples[stage].append((ms, items))
+
+    def summary(self):
+        stats = {}
+        for stage, samples in self.samples.items():
+            if not samples:
+                continue
+            ms = np.array([m for m, _ in samples])
+            items = sum(n for _, n in samples)
+            stats[stage] = {
+                'calls': len(samples),
+                'items': items,
+                'total_ms': float(ms.sum()),
+                'per_image_ms': float(ms.sum() / max(items, 1)),
+                'p50_ms': float(np.percentile(ms, 50)),
+                'p95_ms': float(np.percentile(ms, 95)),
+            }
+        return stats
+
+
+class _Span:
+    def __init__(self, timer, stage, items):
+        self.timer, self.stage, self.items = timer, stage, items
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.stage, (time.perf_counter() - self.start) * 1000, self.items)
+        return False
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process so far, or None where the
+    resource module is missing (ru_maxrss is KiB on Linux, bytes on macOS).
+    Only meaningful per run because every run has a process of its own.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def collect_sources(paths):
+    """Image files from a mix of directories and files, read into memory as encoded bytes."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(list_images([path]))
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            print(f"Skipping missing {path}")
+    encoded = []
+    for path in files:
+        with open(path, 'rb') as f:
+            # parent/file, so names stay unique across testimage/ and king_queen/
+            name = os.path.join(os.path.basename(os.path.dirname(path)), os.path.basename(path))
+            encoded.append((name.replace(os.sep, '/'), f.read()))
+    return encoded
+
+
+def run_batch(board_model, piece_model, batch, timer, min_side=DECODE_MIN_SIDE, annotate=True):
+    """
+    Runs one batch of encoded images through every stage.
+
+    Returns:
+        List of (name, fen or None)
+    """
+    with timer.time('decode', len(batch)):
+        decoded = [(name, decode_buffer(data, min_side).image) for name, data in batch]
+    names = [name for name, image in decoded if image is not None]
+    images = [image for _, image in decoded if image is not None]
+    fens = [(name, None) for name, image in decoded if image is None]
+    if not images:
+        return fens
+
+    with timer.time('board_inference', len(images)):
+        board_results = board_model(images, verbose=False)
+    with timer.time('piece_inference', len(images)):
+        piece_results = piece_model(images, verbose=False)
+
+    for name, image, board_result, piece_result in zip(names, images, board_results, piece_results):
+        with timer.time('square_detections'):
+            detections = square_detections(board_result, board_model.names, "square", top_k=64)
+        try:
+            with timer.time('order_squares'):
+                square_data, _ = label_detections_with_fit(detections)
+        except (ValueError, IndexError):
+            fens.append((name, None))
+            continue
+        with timer.time('piece_detections'):
+            piece_data = piece_detections(piece_result, piece_model.names, 0.5)
+        with timer.time('assign_pieces'):
+            board_state = assign_pieces_to_squares(square_data, piece_data)
+        with timer.time('fen'):
+            fen = get_fen_from_board_state(board_state)
+        if annotate:
+            with timer.time('annotate'):
+                render_annotated(image, square_data, piece_data)
+        fens.append((name, fen))
+    return fens
+
+
+def run_config(board_model, piece_model, encoded, batch_size, threads, min_side, annotate, trace_memory):
+    """Benchmarks one (batch size, thread count) combination over every image."""
+    timer = StageTimer()
+    batches = [encoded[i:i + batch_size] for i in range(0, len(encoded), batch_size)]
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = [r for batch_results in pool.map(
+            lambda batch: run_batch(board_model, piece_model, batch, timer, min_side, annotate), batches)
+            for r in batch_results]
+    wall = time.perf_counter() - start
+
+    run = {
+        'batch_size': batch_size,
+        'threads': threads,
+        'images': len(encoded),
+        'failed': sum(1 for _, fen in results if fen is None),
+        'wall_s': wall,
+        'throughput_ips': len(encoded) / wall if wall else 0.0,
+        'stages': timer.summary(),
+        'peak_rss_mb': peak_rss_mb(),
+        'fens': dict(results),
+    }
+    if trace_memory:
+        run['tracemalloc_peak_mb'] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+    return run
+
+
+def load_models(args):
+    """Applies the thread settings and loads both models; returns (board_model, piece_model, load seconds)."""
+    config = load_config()
+    if args.cv2_threads is not None:
+        cv2.setNumThreads(args.cv2_threads)
+    if args.torch_threads is not None:
+        import torch
+        torch.set_num_threads(args.torch_threads)
+
+    start = time.perf_counter()
+    board_model = load_model(args.board_model or config['board_model_path'],
+                             args.backend or config['model_backend'], args.int8)
+    piece_model = load_model(args.piece_model or config['piece_model_path'],
+                             args.backend or config['model_backend'], args.int8)
+    return board_model, piece_model, time.perf_counter() - start
+
+
+def run_isolated(args, encoded, batch_size, threads):
+    """
+    Loads the models and benchmarks one combination; runs in a process of its
+    own, so ru_maxrss doesn't carry over the peak of an earlier combination.
+
+    Returns:
+        (run dict, model load seconds)
+    """
+    board_model, piece_model, load_s = load_models(args)
+
+    # Warm up on one image so lazy initialisation doesn't land in the run
+    run_batch(board_model, piece_model, encoded[:1], StageTimer(), args.min_side, not args.no_annotate)
+    run = run_config(board_model, piece_model, encoded, batch_size, threads,
+                     args.min_side, not args.no_annotate, args.memory)
+    return run, load_s
+
+
+def run_benchmark(args):
+    config = load_config()
+    board_path = args.board_model or config['board_model_path']
+    piece_path = args.piece_model or config['piece_model_path']
+    backend = args.backend or config['model_backend']
+
+    encoded = collect_sources(args.images)
+    if not encoded:
+        raise SystemExit("No images to benchmark")
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'backend': backend,
+            'int8': args.int8,
+            'board_model': board_path,
+            'piece_model': piece_path,
+            'model_load_s': None,
+            'images': len(encoded),
+            'decode_min_side': args.min_side,
+            'annotate': not args.no_annotate,
+            'tracemalloc': args.memory,
+        },
+        'runs': [],
+    }
+    for batch_size in args.batch_sizes:
+        for threads in args.threads:
+            # A fresh (spawned, not forked) process per combination
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                run, load_s = pool.submit(run_isolated, args, encoded, batch_size, threads).result()
+            if report['meta']['model_load_s'] is None:
+                report['meta']['model_load_s'] = load_s
+            report['runs'].append(run)
+            rss = f"{run['peak_rss_mb']:7.1f} MB" if run['peak_rss_mb'] is not None else "n/a"
+            print(f"batch {batch_size:2d}  threads {threads:2d}  {run['throughput_ips']:7.2f} img/s  "
+                  f"rss {rss}  failed {run['failed']}")
+            for stage, stats in run['stages'].items():
+                print(f"    {stage:18s} {stats['per_image_ms']:8.2f} ms/img  p95 {stats['p95_ms']:8.2f} ms")
+    return report
+
+
+def compare_reports(baseline, current, tolerance=0.1):
+    """
+    Flags metrics of matching (batch size, threads) runs that got worse than
+    the baseline by more than tolerance (a fraction), including per-stage
+    per-image time and FEN changes.
+
+    Returns:
+        List of regression descriptions (empty if none)
+    """
+    regressions = []
+    base_runs = {(r['batch_size'], r['threads']): r for r in baseline['runs']}
+    for run in current['runs']:
+        key = (run['batch_size'], run['threads'])
+        base = base_runs.get(key)
+        if base is None:
+            continue
+        label = f"batch {key[0]} threads {key[1]}"
+
+        for metric, higher_is_better in COMPARED.items():
+            old, new = base.get(metric), run.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append(f"{label}: {metric} {old:.2f} -> {new:.2f} ({change:+.0%})")
+
+        for stage, stats in run['stages'].items():
+            old = base['stages'].get(stage, {}).get('per_image_ms')
+            if old and (stats['per_image_ms'] - old) / old > tolerance:
+                regressions.append(f"{label}: {stage} {old:.2f} -> {stats['per_image_ms']:.2f} ms/img "
+                                   f"({(stats['per_image_ms'] - old) / old:+.0%})")
+
+        changed = [name for name, fen in run.get('fens', {}).items()
+                   if name in base.get('fens', {}) and base['fens'][name] != fen]
+        if changed:
+            regressions.append(f"{label}: FEN changed for {', '.join(sorted(changed))}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="benchmark the pipeline and write JSON")
+    run.add_argument("--images", nargs="+", default=DEFAULT_SOURCES, help="image files or directories")
+    run.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 4, 8])
+    run.add_argument("--threads", nargs="+", type=int, default=[1])
+    run.add_argument("--cv2-threads", type=int, default=None, help="cv2.setNumThreads")
+    run.add_argument("--torch-threads", type=int, default=None, help="torch.set_num_threads")
+    run.add_argument("--board-model", default=None)
+    run.add_argument("--piece-model", default=None)
+    run.add_argument("--backend", default=None, help="torch, onnx or openvino (default: server config)")
+    run.add_argument("--int8", action="store_true")
+    run.add_argument("--min-side", type=int, default=DECODE_MIN_SIDE,
+                     help="reduced-decode long side; 0 decodes at full size")
+    run.add_argument("--no-annotate", action="store_true", help="skip the annotate/encode stage")
+    run.add_argument("--memory", action="store_true",
+                     help="also track the tracemalloc peak (slows every stage down)")
+    run.add_argument("--out", default="bench_pipeline.json")
+    run.add_argument("--baseline", default=None, help="compare against this report when done")
+    run.add_argument("--tolerance", type=float, default=0.1)
+
+    compare = sub.add_parser("compare", help="flag regressions of a report against a baseline")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        report = run_benchmark(args)
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.out}")
+        if not args.baseline:
+            return
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            report = json.load(f)
+
+    regressions = compare_reports(baseline, report, args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    if regressions:
+        sys.exit(1)
+    print(f"No regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
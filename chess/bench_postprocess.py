@@ -0,0 +1,116 @@
+"""
+Micro-benchmark: per-box Python loop vs. postprocess.py array ops.
+
+Runs on synthetic boxes, so no model weights are needed:
+    python bench_postprocess.py --boxes 120 --repeat 2000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from postprocess import square_detections, piece_detections
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+NAMES = {0: "board", 1: "square"}
+PIECE_NAMES = dict(enumerate([
+    'BlackBishop', 'BlackKing', 'BlackKnight', 'BlackPawn', 'BlackQueen', 'BlackRook',
+    'WhiteBishop', 'WhiteKing', 'WhiteKnight', 'WhitePawn', 'WhiteQueen', 'WhiteRook']))
+
+
+class FakeBoxes:
+    """Mimics ultralytics Boxes: array attributes, iterates as one-row Boxes."""
+
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy, self.conf, self.cls = xyxy, conf, cls
+
+    def __len__(self):
+        return len(self.conf)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield FakeBoxes(self.xyxy[i:i + 1], self.conf[i:i + 1], self.cls[i:i + 1])
+
+
+class FakeResult:
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+
+def make_result(n_boxes, n_classes, seed=0):
+    rng = np.random.default_rng(seed)
+    x1y1 = rng.uniform(0, 3000, size=(n_boxes, 2))
+    wh = rng.uniform(20, 200, size=(n_boxes, 2))
+    xyxy = np.hstack([x1y1, x1y1 + wh]).astype(np.float32)
+    conf = rng.uniform(0.1, 1.0, size=n_boxes).astype(np.float32)
+    cls = rng.integers(0, n_classes, size=n_boxes).astype(np.float32)
+    if torch is not None:
+        xyxy, conf, cls = torch.from_numpy(xyxy), torch.from_numpy(conf), torch.from_numpy(cls)
+    return FakeResult(FakeBoxes(xyxy, conf, cls))
+
+
+def loop_squares(result, names, target_class="square", expected_squares=64):
+    """The loop previously in testing.detect_squares."""
+    detections = []
+    for box in result.boxes:
+        conf = float(box.conf[0])
+        cls_id = int(box.cls[0])
+        class_name = names[cls_id]
+        if class_name == target_class:
+            x1, y1, x2, y2 = box.xyxy[0].tolist()
+            center = (int((x1 + x2) // 2), int((y1 + y2) // 2))
+            detections.append((conf, center, class_name))
+    detections.sort(reverse=True, key=lambda x: x[0])
+    return detections[:expected_squares]
+
+
+def loop_pieces(result, names, conf_threshold=0.5):
+    """The loop previously in server.piece_detect."""
+    piece_data = []
+    for box in result.boxes:
+        conf = float(box.conf[0])
+        cls_id = int(box.cls[0])
+        if conf > conf_threshold:
+            x1, y1, x2, y2 = box.xyxy[0].tolist()
+            center_x = int((x1 + x2) // 2)
+            center_y = int(y2 - (y2 - y1) // 4)
+            piece_data.append(((center_x, center_y), names[cls_id]))
+    return piece_data
+
+
+def time_call(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6  # microseconds per call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--boxes", type=int, default=120, help="boxes per frame")
+    parser.add_argument("--repeat", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"Boxes as {'torch tensors' if torch is not None else 'numpy arrays'}, {args.boxes} boxes/frame")
+
+    squares = make_result(args.boxes, len(NAMES))
+    pieces = make_result(args.boxes, len(PIECE_NAMES), seed=1)
+    cases = [
+        ("squares", lambda: loop_squares(squares, NAMES),
+                    lambda: square_detections(squares, NAMES, "square", top_k=64)),
+        ("pieces", lambda: loop_pieces(pieces, PIECE_NAMES),
+                   lambda: piece_detections(pieces, PIECE_NAMES, 0.5)),
+    ]
+    for label, loop_fn, vec_fn in cases:
+        loop_us = time_call(loop_fn, args.repeat)
+        vec_us = time_call(vec_fn, args.repeat)
+        print(f"{label:8s} loop {loop_us:9.1f} us   vectorized {vec_us:9.1f} us   "
+              f"speedup {loop_us / vec_us:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import numpy as np
+
+FILES = 'ABCDEFGH'
+RANKS = '12345678'
+
+# Square index = rank_idx * 8 + file_idx, so A1 = 0, B1 = 1, ..., H8 = 63
+SQUARE_NAMES = tuple(f"{file}{rank}" for rank in RANKS for file in FILES)
+SQUARE_INDEX = {name: idx for idx, name in enumerate(SQUARE_NAMES)}
+
+# Piece codes: 0 is an empty square, 13 a piece type we have no FEN letter for
+EMPTY = 0
+UNKNOWN = 13
+PIECE_TYPES = (
+    None,
+    'WhitePawn', 'WhiteRook', 'WhiteKnight', 'WhiteBishop', 'WhiteQueen', 'WhiteKing',
+    'BlackPawn', 'BlackRook', 'BlackKnight', 'BlackBishop', 'BlackQueen', 'BlackKing',
+    'Unknown',
+)
+FEN_CHARS = ' PRNBQKprnbqk?'
+PIECE_CODES = {piece_type: code for code, piece_type in enumerate(PIECE_TYPES) if piece_type}
+FEN_CODES = {char: code for code, char in enumerate(FEN_CHARS) if code != EMPTY}
+
+DEFAULT_FEN_SUFFIX = "w KQkq - 0 1"
+
+
+class BoardState:
+    """
+    Piece placement for the 64 squares, stored as one byte per square.
+
+    Iterating yields (square_name, piece_type) pairs from A1 to H8, so code that
+    consumed the old list-of-tuples board state keeps working. Squares can be
+    read and written by name ('E4') or index (0-63). The hash follows the
+    contents, so don't mutate a state while it is used as a dict key.
+    """
+    __slots__ = ("_codes",)
+
+    def __init__(self, codes=None):
+        if codes is None:
+            self._codes = np.zeros(64, dtype=np.uint8)
+        else:
+            self._codes = np.array(codes, dtype=np.uint8).reshape(64)
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """Builds a state from (square_name, piece_type) pairs; None means empty."""
+        state = cls()
+        for square_name, piece_type in pairs:
+            state[square_name] = piece_type
+        return state
+
+    @classmethod
+    def from_fen(cls, fen):
+        """Parses the piece placement field of a FEN string."""
+        placement = fen.strip().split(' ')[0]
+        ranks = placement.split('/')
+        if len(ranks) != 8:
+            raise ValueError(f"FEN must have 8 ranks, got {len(ranks)}")
+
+        codes = np.zeros(64, dtype=np.uint8)
+        for rank_idx, rank_str in enumerate(ranks):
+            base = (7 - rank_idx) * 8  # FEN starts at rank 8
+            file_idx = 0
+            for char in rank_str:
+                if char.isdigit():
+                    file_idx += int(char)
+                    continue
+                if char not in FEN_CODES:
+                    raise ValueError(f"Unknown piece '{char}' in FEN")
+                if file_idx >= 8:
+                    raise ValueError(f"Rank {8 - rank_idx} describes more than 8 files")
+                codes[base + file_idx] = FEN_CODES[char]
+                file_idx += 1
+            if file_idx != 8:
+                raise ValueError(f"Rank {8 - rank_idx} describes {file_idx} files, expected 8")
+        return cls(codes)
+
+    @property
+    def codes(self):
+        """Read-only view of the 64 piece codes."""
+        view = self._codes.view()
+        view.flags.writeable = False
+        return view
+
+    def placement(self):
+        """The piece placement field of the FEN (rank 8 first)."""
+        rows = []
+        codes = self._codes.tolist()
+        for rank_idx in range(7, -1, -1):
+            row = ''
+            empty_count = 0
+            for code in codes[rank_idx * 8:rank_idx * 8 + 8]:
+                if code == EMPTY:
+                    empty_count += 1
+                    continue
+                if empty_count:
+                    row += str(empty_count)
+                    empty_count = 0
+                row += FEN_CHARS[code]
+            if empty_count:
+                row += str(empty_count)
+            rows.append(row)
+        return '/'.join(rows)
+
+    def to_fen(self, suffix=DEFAULT_FEN_SUFFIX):
+        """Full FEN string; side to move, castling etc. are taken from suffix."""
+        return f"{self.placement()} {suffix}"
+
+    def to_list(self):
+        """[(square_name, piece_type), ...] from A1 to H8, for JSON responses."""
+        return list(self)
+
+    def diff(self, other):
+        """
+        Squares whose contents differ from another state.
+
+        Returns:
+            List of (square_name, piece_type_here, piece_type_in_other)
+        """
+        changed = np.flatnonzero(self._codes != other._codes)
+        return [(SQUARE_NAMES[idx], PIECE_TYPES[self._codes[idx]], PIECE_TYPES[other._codes[idx]])
+                for idx in changed.tolist()]
+
+    def copy(self):
+        return BoardState(self._codes)
+
+    def piece_count(self):
+        return int(np.count_nonzero(self._codes))
+
+    def _index(self, square):
+        if isinstance(square, str):
+            return SQUARE_INDEX[square.upper()]
+        return int(square)
+
+    def __getitem__(self, square):
+        return PIECE_TYPES[self._codes[self._index(square)]]
+
+    def __setitem__(self, square, piece_type):
+        if piece_type is None:
+            code = EMPTY
+        else:
+            code = PIECE_CODES.get(piece_type, UNKNOWN)
+        self._codes[self._index(square)] = code
+
+    def __iter__(self):
+        return zip(SQUARE_NAMES, (PIECE_TYPES[code] for code in self._codes.tolist()))
+
+    def __len__(self):
+        return 64
+
+    def __eq__(self, other):
+        if not isinstance(other, BoardState):
+            return NotImplemented
+        return np.array_equal(self._codes, other._codes)
+
+    def __hash__(self):
+        return hash(self._codes.tobytes())
+
+    def __repr__(self):
+        return f"BoardState('{self.placement()}')"
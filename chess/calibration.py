@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from square_lookup import SquareLookup
+
+
+class Calibration:
+    """
+    Board calibration for one client/board/session.
+
+    Holds the labelled square grid produced by get_squares() and, when one was
+    computed, the homography between the image and the ideal 8x8 lattice.
+    """
+    __slots__ = ("session_id", "squares", "homography", "image_size", "created_at",
+                 "board_image", "board_state", "lock", "_lookup")
+
+    def __init__(self, session_id, squares, homography=None, image_size=None):
+        self.session_id = session_id
+        self.squares = list(squares)       # [(square_name, (x, y)), ...]
+        self.homography = homography       # 3x3 numpy array or None
+        self.image_size = image_size       # (width, height) of the calibration image
+        self.created_at = time.time()
+
+        # Last position seen for this board (see incremental.py)
+        self.board_image = None            # rectified top-down view
+        self.board_state = None            # BoardState
+        self.lock = threading.Lock()
+        self._lookup = None
+
+    @property
+    def lookup(self):
+        """SquareLookup for this grid, built on first use and reused for every frame."""
+        if self._lookup is None:
+            self._lookup = SquareLookup(self.squares, self.homography)
+        return self._lookup
+
+    def homography_for(self, scale=1.0):
+        """
+        Image -> lattice homography for a copy of the image decoded at
+        1 / scale of the calibration resolution (see ingest.py).
+        """
+        if self.homography is None or scale == 1.0:
+            return self.homography
+        return self.homography @ np.diag([scale, scale, 1.0])
+
+    def squares_to_json(self):
+        """Returns the square grid in the same format the /detect endpoint returns."""
+        return [
+            {"square": square_name, "center": {"x": int(center[0]), "y": int(center[1])}}
+            for square_name, center in self.squares
+        ]
+
+
+class CalibrationStore:
+    """
+    Thread-safe LRU + TTL cache of Calibration objects keyed by session id.
+
+    Args:
+        max_entries: Maximum number of calibrations kept; least recently used go first
+        ttl: Seconds a calibration stays valid after it was last stored
+    """
+
+    def __init__(self, max_entries=128, ttl=30 * 60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # session_id -> (expires_at, Calibration)
+        self._lock = threading.Lock()
+
+    def put(self, session_id, squares, homography=None, image_size=None):
+        """Stores (or replaces) the calibration for a session and returns it."""
+        calibration = Calibration(session_id, squares, homography, image_size)
+        with self._lock:
+            self._entries.pop(session_id, None)
+            self._entries[session_id] = (time.monotonic() + self.ttl, calibration)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return calibration
+
+    def get(self, session_id):
+        """Returns the calibration for a session, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            expires_at, calibration = entry
+            if expires_at < time.monotonic():
+                del self._entries[session_id]
+                return None
+            self._entries.move_to_end(session_id)
+            return calibration
+
+    def discard(self, session_id):
+        """Removes the calibration for a session, if any."""
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def purge_expired(self):
+        """Drops every expired calibration and returns how many were removed."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [sid for sid, (expires_at, _) in self._entries.items() if expires_at < now]
+            for session_id in expired:
+                del self._entries[session_id]
+        return len(expired)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
@@ -0,0 +1,105 @@
+"""
+Server configuration.
+
+Values come from DEFAULTS, then an optional JSON file, then environment
+variables, later ones winning. The file is the one named by CHESS_CONFIG, or
+server_config.json next to this module if it exists. Every key can be set
+from the environment as CHESS_<KEY>, e.g.
+
+    CHESS_BOARD_MODEL_PATH=/models/board.pt CHESS_HEADLESS=1 python server.py
+"""
+import json
+import os
+
+from model_registry import BOARD_MODEL_PATH, PIECE_MODEL_PATH
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CONFIG_FILE = os.path.join(HERE, "server_config.json")
+ENV_PREFIX = "CHESS_"
+
+DEFAULTS = {
+    # Models
+    'board_model_path': BOARD_MODEL_PATH,
+    'piece_model_path': PIECE_MODEL_PATH,
+    'square_classifier_path': r"E:\CHESS_OTB\chess\runs\classify\train\weights\best.pt",
+    'model_backend': "torch",       # torch, onnx or openvino (see model_registry.py)
+    'model_int8': False,
+    'device': "",                   # torch device, e.g. "cpu" or "cuda:0"; empty lets ultralytics pick
+    'preload': "background",        # background, eager or lazy (load on first request)
+    'warmup': True,                 # run one synthetic inference after loading
+
+    # Inference
+    'piece_conf_threshold': 0.5,
+    'piece_imgsz': 640,             # piece model input size
+    'piece_roi': True,              # run the piece model on the calibrated board region, not the whole frame
+    'piece_tile_scale': 2.0,        # tile a board region larger than this many times piece_imgsz
+    'batch_window_ms': 10,
+    'max_batch': 8,
+    'inference_workers': 4,
+
+    # Pipeline stages (see pipeline.py)
+    'decode_workers': 4,
+    'encode_workers': 2,
+    'stage_queue_size': 32,         # items waiting per stage or model before callers block; 0 for no limit
+    'torch_threads': 0,             # intra-op threads per model call; 0 keeps the library default
+    'opencv_threads': 0,            # threads per OpenCV call; 0 keeps the library default
+
+    # Near-duplicate frame cache (see frame_cache.py)
+    'frame_cache_entries': 256,     # 0 turns the cache off
+    'frame_cache_ttl': 60,          # seconds
+    'frame_cache_max_change': 6.0,  # mean gray-level change in any one board square still counted as a hit
+
+    # Server
+    'host': "0.0.0.0",
+    'port': 5000,
+    'debug': False,
+    'headless': False,              # never import tkinter / open the board window
+    'timing_header': False,         # Server-Timing header on every response (else only with X-Timing: 1)
+    'workers': 0,                   # serve.py worker processes; 0 for one per two cores
+}
+
+PRELOAD_MODES = ('background', 'eager', 'lazy')
+
+
+def _coerce(value, default):
+    """Converts an environment string to the type of the default value."""
+    if isinstance(default, bool):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    return value
+
+
+def load_config(path=None, environ=None):
+    """
+    Builds the configuration dict.
+
+    Args:
+        path: JSON file to read; defaults to $CHESS_CONFIG or server_config.json
+        environ: Mapping to read CHESS_* overrides from (os.environ by default)
+
+    Raises:
+        ValueError: For unknown keys in the file or a bad preload mode
+    """
+    environ = os.environ if environ is None else environ
+    config = dict(DEFAULTS)
+
+    path = path or environ.get(ENV_PREFIX + "CONFIG") or DEFAULT_CONFIG_FILE
+    if os.path.exists(path):
+        with open(path) as f:
+            overrides = json.load(f)
+        unknown = set(overrides) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown config keys in {path}: {', '.join(sorted(unknown))}")
+        config.update(overrides)
+
+    for key, default in DEFAULTS.items():
+        value = environ.get(ENV_PREFIX + key.upper())
+        if value is not None:
+            config[key] = _coerce(value, default)
+
+    if config['preload'] not in PRELOAD_MODES:
+        raise ValueError(f"preload must be one of {', '.join(PRELOAD_MODES)}")
+    return config
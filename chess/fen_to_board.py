@@ -1,10 +1,20 @@
+import queue
 import tkinter as tk
 from tkinter import font, messagebox
+import numpy as np
+from board_state import BoardState, FEN_CHARS
+
+# How often the Tk loop picks up FENs queued from other threads (~30 fps)
+POLL_MS = 33
 
 class ChessboardApp:
     """
     A Tkinter application that displays a chessboard and updates the position
     based on a FEN (Forsyth-Edwards Notation) string provided by the user.
+
+    Other threads (the Flask handlers, a live feed) hand positions over with
+    submit_fen(); the Tk loop drains that queue every POLL_MS and only draws
+    the latest FEN of a burst, so updates never pile up as Tk callbacks.
     """
     def __init__(self, root):
         self.root = root
@@ -46,8 +56,13 @@ class ChessboardApp:
         
         # --- Initial Board Setup ---
         self.draw_board_squares()
+        self.create_piece_items()
         self.load_fen(self.start_fen)
 
+        # --- Updates from other threads ---
+        self.pending_fens = queue.Queue()
+        self.root.after(POLL_MS, self.drain_pending_fens)
+
     def _setup_fen_controls(self):
         """Creates and packs the FEN input and display widgets."""
         fen_frame = tk.Frame(self.main_frame, bg="#4a4643", relief=tk.RIDGE, borderwidth=2)
@@ -89,47 +104,65 @@ class ChessboardApp:
                 color = self.colors[(row + col) % 2]
                 self.canvas.create_rectangle(x1, y1, x2, y2, fill=color, outline="")
 
+    def create_piece_items(self):
+        """Creates one (initially empty) text item per square, indexed like BoardState (0 = A1)."""
+        self.piece_items = []
+        for idx in range(64):
+            rank_idx, file_idx = 7 - idx // 8, idx % 8  # FEN rank 8 is the top row
+            x = file_idx * self.square_size + self.square_size / 2
+            y = rank_idx * self.square_size + self.square_size / 2
+            self.piece_items.append(
+                self.canvas.create_text(x, y, text="", font=self.piece_font, tags="piece")
+            )
+        self.shown_codes = np.zeros(64, dtype=np.uint8)
+
+    def render_fen(self, fen):
+        """
+        Shows a new position, touching only the squares whose piece changed.
+
+        Raises:
+            ValueError: If the FEN is malformed
+        """
+        codes = BoardState.from_fen(fen).codes
+        for idx in np.flatnonzero(codes != self.shown_codes).tolist():
+            char = FEN_CHARS[codes[idx]]
+            if char == ' ':
+                self.canvas.itemconfigure(self.piece_items[idx], text="")
+            else:
+                self.canvas.itemconfigure(self.piece_items[idx], text=self.piece_map.get(char, '?'),
+                                          fill="white" if char.isupper() else "black")
+        self.shown_codes = codes.copy()
+
     def load_fen(self, fen):
         """
-        Clears the board and renders a new position based on a FEN string.
-        This is the core logic for updating the view.
+        Renders a new position based on a FEN string, reporting bad input in a dialog.
+        Must be called from the Tk thread; use submit_fen() from anywhere else.
         """
-        # Clear only the pieces, not the board squares
-        self.canvas.delete("piece")
-        
         try:
-            # 1. Parse the piece placement part of the FEN
-            piece_placement = fen.split(' ')[0]
-            ranks = piece_placement.split('/')
-            
-            # 2. Iterate over each rank (row)
-            for rank_idx, rank_str in enumerate(ranks):
-                file_idx = 0 # Represents the column
-                # 3. Iterate over each character in the rank string
-                for char in rank_str:
-                    if char.isdigit():
-                        # If it's a number, skip that many columns
-                        file_idx += int(char)
-                    else:
-                        # If it's a piece, place it on the board
-                        if 0 <= rank_idx < 8 and 0 <= file_idx < 8:
-                            x = file_idx * self.square_size + self.square_size / 2
-                            y = rank_idx * self.square_size + self.square_size / 2
-                            
-                            piece_symbol = self.piece_map.get(char, '?')
-                            color = "white" if char.isupper() else "black"
-                            
-                            # Create the text item with a "piece" tag for easy deletion
-                            self.canvas.create_text(
-                                x, y, text=piece_symbol, 
-                                font=self.piece_font,
-                                tags="piece", 
-                                fill=color
-                            )
-                        file_idx += 1
+            self.render_fen(fen)
         except Exception as e:
             messagebox.showerror("FEN Error", f"Invalid or malformed FEN string.\n\nDetails: {e}")
 
+    def submit_fen(self, fen):
+        """Queues a FEN for display. Safe to call from any thread."""
+        self.pending_fens.put(fen)
+
+    def drain_pending_fens(self):
+        """Tk timer: shows the most recent queued FEN and drops the older ones."""
+        latest = None
+        try:
+            while True:
+                latest = self.pending_fens.get_nowait()
+        except queue.Empty:
+            pass
+
+        if latest is not None:
+            try:
+                self.render_fen(latest)
+            except ValueError as e:
+                print(f"Ignoring malformed FEN {latest!r}: {e}")
+        self.root.after(POLL_MS, self.drain_pending_fens)
+
     def apply_fen_from_input(self):
         """Command for the button to apply the FEN from the input box."""
         fen = self.fen_input_var.get().strip()
@@ -0,0 +1,123 @@
+"""
+Near-duplicate frame cache: remembers the result for a recent photo and hands
+it back when the same session resubmits (almost) the same picture.
+
+Frames are compared square by square on the session's calibrated board, not
+as whole pictures: a hash of the full frame barely changes when one pawn
+moves, which would hand back the previous FEN after a real move. The board is
+warped to a small top-down view (incremental.rectify_board) and a cached
+result only counts if no square differs from it by more than max_change gray
+levels -- the test /position-update uses to spot a move, with a tighter
+threshold.
+
+Entries are scoped to an endpoint/session and only count while the session
+still has the calibration they were computed against, so recalibrating
+always forces a fresh pass. Without a fitted grid there is nothing to compare
+square by square, and the frame isn't cached.
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+from incremental import rectify_board, square_change_scores
+
+SQUARE_PX = 8         # pixels per square in the board signature
+MAX_CHANGE = 6.0      # mean gray-level change in any one square still treated as the same frame
+
+
+def board_signature(image, homography, square_px=SQUARE_PX):
+    """Small top-down gray view of the board, (8 * square_px) pixels square."""
+    return rectify_board(image, homography, square_px)
+
+
+def signature_change(a, b, square_px=SQUARE_PX):
+    """Largest per-square change between two board signatures, in gray levels."""
+    return float(square_change_scores(a, b, square_px).max())
+
+
+class CachedResult:
+    """What a handler needs to answer again without running a model."""
+    __slots__ = ("payload", "square_data", "piece_data", "calibration")
+
+    def __init__(self, payload, square_data, piece_data, calibration):
+        self.payload = payload            # JSON response fields, without the picture
+        self.square_data = square_data
+        self.piece_data = piece_data
+        self.calibration = calibration    # Calibration the result was computed with
+
+
+class FrameCache:
+    """
+    Thread-safe LRU + TTL cache of results keyed by scope and board signature.
+
+    Args:
+        max_entries: Maximum number of results kept; least recently used go first
+        ttl: Seconds a result stays valid
+        max_change: Largest per-square change (gray levels) that still matches
+    """
+
+    def __init__(self, max_entries=256, ttl=60, max_change=MAX_CHANGE, square_px=SQUARE_PX):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_change = max_change
+        self.square_px = square_px
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # id -> (expires_at, scope, size, signature, CachedResult)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def signature(self, image, calibration, scale=1.0):
+        """
+        Board signature of a frame under a calibration, or None when the
+        calibration has no fitted grid.
+
+        Args:
+            scale: Calibration pixels per image pixel (see ingest.py)
+        """
+        homography = calibration.homography_for(scale) if calibration is not None else None
+        if homography is None:
+            return None
+        return board_signature(image, homography, self.square_px)
+
+    def get(self, scope, signature, size, calibration):
+        """
+        Returns the closest cached result within max_change for this scope,
+        computed at the same image size against the given calibration, or None.
+
+        Args:
+            scope: Hashable naming the endpoint/session/options the result is for
+            signature: signature() of the decoded frame under calibration
+            size: Anything identifying the image dimensions; must match exactly
+            calibration: The session's current Calibration
+        """
+        now = time.monotonic()
+        with self._lock:
+            best_id, best_change = None, None
+            for entry_id, (expires_at, entry_scope, entry_size, entry_signature, result) in list(self._entries.items()):
+                if expires_at < now:
+                    del self._entries[entry_id]
+                    continue
+                if entry_scope != scope or entry_size != size or result.calibration is not calibration:
+                    continue
+                change = signature_change(entry_signature, signature, self.square_px)
+                if change <= self.max_change and (best_change is None or change < best_change):
+                    best_id, best_change = entry_id, change
+
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best_id)
+            return self._entries[best_id][4]
+
+    def put(self, scope, signature, size, result):
+        with self._lock:
+            self._entries[next(self._ids)] = (time.monotonic() + self.ttl, scope, size, signature, result)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
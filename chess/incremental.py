@@ -0,0 +1,201 @@
+import cv2
+import numpy as np
+
+from postprocess import boxes_to_arrays, filter_boxes, piece_anchors
+from piece_square import assign_pieces_to_squares
+
+SQUARE_PX = 48            # side of one square in the rectified board image
+CHANGE_THRESHOLD = 12.0   # mean gray-level difference that marks a square as changed
+MAX_CHANGED = 8           # more than this and we assume the camera or lighting moved
+
+# classify_squares crop around a square, in squares: tall pieces stick up into
+# the square above; below and to the sides the crop cuts through the neighbours
+CROP_ABOVE = 1.5
+CROP_BELOW = 1.0
+CROP_SIDE = 0.75
+EDGE_PX = 2               # a box this close to a cut crop edge was truncated by the crop
+
+
+def rectify_board(image, homography, square_px=SQUARE_PX, rows=8, cols=8):
+    """
+    Warps the board to a top-down view where lattice square (col, row)
+    occupies [col * square_px, (col + 1) * square_px) horizontally and the
+    same for rows.
+    """
+    to_pixels = np.array([[square_px, 0, square_px / 2],
+                          [0, square_px, square_px / 2],
+                          [0, 0, 1]], dtype=np.float64)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    board = cv2.warpPerspective(gray, to_pixels @ homography, (cols * square_px, rows * square_px))
+    return cv2.GaussianBlur(board, (5, 5), 0)
+
+
+def square_change_scores(prev_board, board, square_px=SQUARE_PX, inner=0.6):
+    """
+    Mean absolute difference inside the central part of every square, with the
+    board-wide median subtracted so a global lighting change doesn't count.
+
+    Returns:
+        (rows, cols) float array
+    """
+    rows, cols = board.shape[0] // square_px, board.shape[1] // square_px
+    diff = cv2.absdiff(prev_board, board).astype(np.float32)
+    diff = diff.reshape(rows, square_px, cols, square_px)
+
+    pad = int(square_px * (1 - inner) / 2)
+    scores = diff[:, pad:square_px - pad, :, pad:square_px - pad].mean(axis=(1, 3))
+    return scores - np.median(scores)
+
+
+def square_name_grid(squares, rows=8, cols=8):
+    """
+    Square names laid out by lattice (row, col). get_squares lists squares row
+    by row in lattice order, so this is just a reshape.
+    """
+    return np.array([name for name, _ in squares], dtype=object).reshape(rows, cols)
+
+
+def classify_squares(piece_model, image, homography, cells, conf_threshold=0.5):
+    """
+    Re-runs the piece model on small crops around the given lattice cells only,
+    in one batched call.
+
+    Args:
+        cells: List of (row, col) lattice cells
+    Returns:
+        List of piece types (None for empty), one per cell
+    """
+    inverse = np.linalg.inv(homography)
+    height, width = image.shape[:2]
+
+    crops, boxes = [], []
+    for row, col in cells:
+        corners = np.float32([[col - CROP_SIDE, row - CROP_ABOVE], [col + CROP_SIDE, row - CROP_ABOVE],
+                              [col + CROP_SIDE, row + CROP_BELOW], [col - CROP_SIDE, row + CROP_BELOW]])
+        corners = cv2.perspectiveTransform(corners.reshape(-1, 1, 2), inverse).reshape(-1, 2)
+        x1, y1 = np.floor(corners.min(axis=0)).astype(int).clip(0, [width - 1, height - 1])
+        x2, y2 = np.ceil(corners.max(axis=0)).astype(int).clip(1, [width, height])
+        crops.append(image[y1:y2, x1:x2])
+        boxes.append((x1, y1, x2, y2))
+
+    results = piece_model(crops, verbose=False)
+
+    piece_types = []
+    for (row, col), (x1, y1, x2, y2), result in zip(cells, boxes, results):
+        xyxy, conf, cls = filter_boxes(*boxes_to_arrays(result.boxes), conf_threshold=conf_threshold)
+
+        # A neighbouring piece cut by the crop's bottom or side edges comes back
+        # as a shortened box whose anchor can land on this square; only edges
+        # that are the image border leave a piece whole
+        cut = np.zeros(len(xyxy), dtype=bool)
+        if x1 > 0:
+            cut |= xyxy[:, 0] <= EDGE_PX
+        if x2 < width:
+            cut |= xyxy[:, 2] >= (x2 - x1) - EDGE_PX
+        if y2 < height:
+            cut |= xyxy[:, 3] >= (y2 - y1) - EDGE_PX
+
+        best_type, best_conf = None, conf_threshold
+        anchors = piece_anchors(xyxy) + (x1, y1)
+        for (x, y), score, cls_id, truncated in zip(anchors.tolist(), conf.tolist(), cls.tolist(), cut):
+            # Keep whole detections whose anchor lands on this very square
+            u, v = cv2.perspectiveTransform(np.float32([[[x, y]]]), homography)[0, 0]
+            if not truncated and int(np.rint(u)) == col and int(np.rint(v)) == row and score > best_conf:
+                best_type, best_conf = piece_model.names[cls_id], score
+        piece_types.append(best_type)
+    return piece_types
+
+
+def infer_move(prev_state, board_state):
+    """
+    Infers the move between two positions in UCI notation (e.g. 'e2e4',
+    'e1g1' for castling, 'e7e8q' for a promotion).
+
+    Returns:
+        The move string, or None if the change doesn't look like a single move
+    """
+    changes = board_state.diff(prev_state)  # (square, now, before)
+    vacated = [(sq, before) for sq, now, before in changes if now is None and before is not None]
+    filled = [(sq, now, before) for sq, now, before in changes if now is not None]
+
+    if len(changes) == 4:
+        # Castling: the king's move is the one to report
+        kings = [sq for sq, now, _ in filled if now and now.endswith('King')]
+        kings_from = [sq for sq, before in vacated if before.endswith('King')]
+        if len(kings) == 1 and len(kings_from) == 1:
+            return (kings_from[0] + kings[0]).lower()
+        return None
+
+    if len(vacated) == 1 and len(filled) == 1:
+        (from_sq, moved), (to_sq, placed, _) = vacated[0], filled[0]
+        move = (from_sq + to_sq).lower()
+        if moved.endswith('Pawn') and not placed.endswith('Pawn'):
+            move += {'Queen': 'q', 'Rook': 'r', 'Bishop': 'b', 'Knight': 'n'}.get(placed[5:], '')
+        return move
+
+    if len(changes) == 3 and len(filled) == 1 and len(vacated) == 2:
+        # En passant: the capturing pawn leaves one square, the captured pawn another
+        to_sq, placed, _ = filled[0]
+        movers = [sq for sq, before in vacated if before == placed]
+        if len(movers) == 1:
+            return (movers[0] + to_sq).lower()
+    return None
+
+
+def update_position(piece_model, image, calibration, detect_all,
+                    threshold=CHANGE_THRESHOLD, max_changed=MAX_CHANGED, conf_threshold=0.5, scale=1.0):
+    """
+    Updates the position stored on a calibration from a new frame, re-running
+    piece classification only on squares whose pixels changed.
+
+    Args:
+        piece_model: YOLO piece model
+        image: New BGR frame of the calibrated board
+        calibration: Calibration with a homography; its board_image and
+            board_state are read and replaced
+        detect_all: Callable(image) -> piece_data, used for a full pass when
+            there is no previous position or too much of the board changed
+        scale: Calibration pixels per pixel of image, when the frame was
+            decoded at reduced size
+
+    Returns:
+        Dict with board_state, fen_string, move, changed_squares and full_pass
+    """
+    if calibration.homography is None:
+        raise ValueError("Incremental updates need a calibration with a homography")
+
+    homography = calibration.homography_for(scale)
+    with calibration.lock:
+        board = rectify_board(image, homography)
+        names = square_name_grid(calibration.squares)
+        prev_state = calibration.board_state
+
+        changed = []
+        if prev_state is not None and calibration.board_image is not None:
+            scores = square_change_scores(calibration.board_image, board)
+            changed = [tuple(cell) for cell in np.argwhere(scores > threshold)]
+
+        full_pass = prev_state is None or len(changed) > max_changed
+        if full_pass:
+            board_state = assign_pieces_to_squares(calibration.squares, detect_all(image), calibration.lookup)
+            changed_squares = [sq for sq, _, _ in board_state.diff(prev_state)] if prev_state is not None else []
+        else:
+            board_state = prev_state.copy()
+            if changed:
+                piece_types = classify_squares(piece_model, image, homography,
+                                               changed, conf_threshold)
+                for (row, col), piece_type in zip(changed, piece_types):
+                    board_state[names[row, col]] = piece_type
+            changed_squares = [names[row, col] for row, col in changed]
+
+        move = infer_move(prev_state, board_state) if prev_state is not None else None
+        calibration.board_image = board
+        calibration.board_state = board_state
+
+    return {
+        'board_state': board_state,
+        'fen_string': board_state.to_fen(),
+        'move': move,
+        'changed_squares': changed_squares,
+        'full_pass': full_pass,
+    }
@@ -0,0 +1,166 @@
+"""
+Shared upload ingestion for the server.
+
+Decodes straight from the upload's own buffer (no BytesIO round trip) and,
+since YOLO letterboxes everything to 640 anyway, lets OpenCV decode large
+JPEGs at 1/2, 1/4 or 1/8 size (IMREAD_REDUCED_*), which skips most of the
+IDCT work and the full-size pixel buffer. The scale factor is kept so every
+coordinate handed back to clients stays in original-image pixels.
+"""
+import io
+import mmap
+import struct
+import time
+
+import cv2
+import numpy as np
+
+# Shortest allowed long side after reduced decoding (2x the model input size)
+DECODE_MIN_SIDE = 1280
+
+REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                 (4, cv2.IMREAD_REDUCED_COLOR_4),
+                 (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+# JPEG start-of-frame markers (baseline, progressive, ...) that carry the image size
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class DecodedImage:
+    """
+    A decoded upload plus what it took to get it.
+
+    Attributes:
+        image: BGR array at the decoded size, or None if decoding failed
+        scale: Original pixels per decoded pixel (1.0 when decoded at full size)
+        original_size: (width, height) of the encoded image
+        num_bytes: Size of the encoded upload
+        decode_ms: Time spent decoding
+    """
+    __slots__ = ("image", "scale", "original_size", "num_bytes", "decode_ms")
+
+    def __init__(self, image, scale, original_size, num_bytes, decode_ms):
+        self.image = image
+        self.scale = scale
+        self.original_size = original_size
+        self.num_bytes = num_bytes
+        self.decode_ms = decode_ms
+
+
+def upload_buffer(file):
+    """
+    Returns a buffer over an uploaded file's bytes without copying when possible.
+
+    Werkzeug keeps small uploads in a BytesIO (exposed with getbuffer) and
+    spools large ones to a temporary file (memory-mapped here).
+    """
+    stream = file.stream
+    stream = getattr(stream, '_file', stream)  # SpooledTemporaryFile wraps the real file
+    if isinstance(stream, io.BytesIO):
+        return stream.getbuffer()
+    try:
+        return mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        stream.seek(0)
+        return stream.read()
+
+
+def image_size_from_header(data):
+    """
+    Reads (width, height) from a JPEG or PNG header without decoding.
+
+    Returns:
+        (width, height), or None for other formats or a truncated header
+    """
+    view = memoryview(data)
+    if len(view) >= 24 and bytes(view[:8]) == b'\x89PNG\r\n\x1a\n':
+        width, height = struct.unpack('>II', view[16:24])
+        return width, height
+
+    if len(view) < 4 or bytes(view[:2]) != b'\xff\xd8':
+        return None
+    pos = 2
+    while pos + 9 <= len(view):
+        if view[pos] != 0xFF:
+            return None
+        marker = view[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:  # markers without a length
+            pos += 2
+            continue
+        length = struct.unpack('>H', view[pos + 2:pos + 4])[0]
+        if marker in _SOF_MARKERS:
+            height, width = struct.unpack('>HH', view[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + length
+    return None
+
+
+def reduction_for(size, min_side=DECODE_MIN_SIDE):
+    """Largest IMREAD_REDUCED factor that keeps the long side at or above min_side."""
+    if size is None or not min_side:
+        return 1, cv2.IMREAD_COLOR
+    long_side = max(size)
+    for factor, flag in REDUCED_FLAGS:
+        if long_side / factor >= min_side:
+            return factor, flag
+    return 1, cv2.IMREAD_COLOR
+
+
+def decode_buffer(data, min_side=DECODE_MIN_SIDE):
+    """
+    Decodes encoded image bytes, reduced in size when the image is large.
+
+    Args:
+        data: bytes, memoryview or mmap with the encoded image
+        min_side: Long side to keep at least; None or 0 decodes at full size
+
+    Returns:
+        DecodedImage
+    """
+    start = time.perf_counter()
+    num_bytes = len(data)
+    size = image_size_from_header(data)
+    _, flag = reduction_for(size, min_side)
+
+    image = None
+    if num_bytes:
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+
+    scale = 1.0
+    if image is not None:
+        height, width = image.shape[:2]
+        if size is None:
+            size = (width, height)
+        elif (size[0] > size[1]) != (width > height) and size[0] != size[1]:
+            size = (size[1], size[0])  # EXIF rotation was applied while decoding
+        scale = size[0] / width
+    return DecodedImage(image, scale, size, num_bytes, (time.perf_counter() - start) * 1000)
+
+
+def decode_upload(file, min_side=DECODE_MIN_SIDE):
+    """Decodes a Flask/werkzeug FileStorage; see decode_buffer."""
+    return decode_buffer(upload_buffer(file), min_side)
+
+
+def squares_to_original(square_data, scale):
+    """Maps [(square_name, (x, y))] from decoded to original pixels."""
+    if scale == 1.0:
+        return list(square_data)
+    return [(name, (int(round(x * scale)), int(round(y * scale)))) for name, (x, y) in square_data]
+
+
+def pieces_to_original(piece_data, scale):
+    """Maps [((x, y), piece_type[, conf])] from decoded to original pixels."""
+    if scale == 1.0:
+        return list(piece_data)
+    return [((int(round(x * scale)), int(round(y * scale))), *rest) for (x, y), *rest in piece_data]
+
+
+def homography_to_original(homography, scale):
+    """Turns a decoded-image -> lattice homography into an original-image -> lattice one."""
+    if homography is None or scale == 1.0:
+        return homography
+    return homography @ np.diag([1.0 / scale, 1.0 / scale, 1.0])
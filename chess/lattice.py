@@ -0,0 +1,308 @@
+import cv2
+import numpy as np
+
+PEEL_CANDIDATES = 3         # hull points tried per peeling round: the ones the current fit explains worst
+DIAGONAL_TOLERANCE = 15.0   # degrees from 45 within which a board stands on its corner in the image
+
+
+class LatticeFit:
+    """
+    Result of fitting detected square centers to an ideal rows x cols lattice.
+
+    Lattice coordinates put the center of the square in column c, row r at
+    (c, r); row 0 is the top of the image, column 0 the left, which matches the
+    row/column order order_squares_to_chessboard has always produced.
+
+    Attributes:
+        homography: 3x3 array mapping image pixels to lattice coordinates
+        centers: (rows, cols, 2) float array of image-space square centers; a
+            detected center is used where there is one, otherwise the center is
+            inferred from the homography
+        detected: (rows, cols) bool array, True where a detection was matched
+        residual: mean distance of matched detections from their lattice
+            point, in squares (0.0 is a perfect grid)
+        inliers: number of detections matched to a lattice square
+        outliers: number of detections rejected as spurious
+    """
+    __slots__ = ("homography", "centers", "detected", "residual", "inliers", "outliers")
+
+    def __init__(self, homography, centers, detected, residual, inliers, outliers):
+        self.homography = homography
+        self.centers = centers
+        self.detected = detected
+        self.residual = residual
+        self.inliers = inliers
+        self.outliers = outliers
+
+    @property
+    def inverse(self):
+        """3x3 array mapping lattice coordinates back to image pixels."""
+        return np.linalg.inv(self.homography)
+
+    def board_rows(self):
+        """The centers as a list of rows, like order_squares_to_chessboard returns."""
+        return [row for row in np.rint(self.centers).astype(int)]
+
+    def image_to_lattice(self, points):
+        """Maps (N, 2) image points to lattice coordinates."""
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 1, 2)
+        return cv2.perspectiveTransform(points, self.homography).reshape(-1, 2)
+
+    def lattice_to_image(self, points):
+        """Maps (N, 2) lattice coordinates to image points."""
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 1, 2)
+        return cv2.perspectiveTransform(points, self.inverse).reshape(-1, 2)
+
+
+def _order_corners(quad):
+    """Orders four points top-left, top-right, bottom-right, bottom-left."""
+    center = quad.mean(axis=0)
+    angles = np.arctan2(quad[:, 1] - center[1], quad[:, 0] - center[0])
+    quad = quad[np.argsort(angles)]  # clockwise on screen (y points down)
+    start = np.argmin(quad.sum(axis=1))
+    return np.roll(quad, -start, axis=0)
+
+
+def _initial_corners(points):
+    """Outer corner squares of the detections: the hull reduced to a quad."""
+    hull = cv2.convexHull(points.astype(np.float32)).reshape(-1, 2)
+    if len(hull) >= 4:
+        perimeter = cv2.arcLength(hull, True)
+        for eps in np.linspace(0.01, 0.15, 15):
+            quad = cv2.approxPolyDP(hull, eps * perimeter, True).reshape(-1, 2)
+            if len(quad) == 4:
+                return _order_corners(quad.astype(np.float32))
+
+    # Fall back to the extreme points along the two diagonals
+    s, d = points.sum(axis=1), points[:, 0] - points[:, 1]
+    return points[[np.argmin(s), np.argmax(d), np.argmax(s), np.argmin(d)]].astype(np.float32)
+
+
+def _bounding_corners(points):
+    """Corners of the smallest rotated rectangle around the detections, for boards missing corner squares."""
+    return _order_corners(cv2.boxPoints(cv2.minAreaRect(points.astype(np.float32))).astype(np.float32))
+
+
+def _lattice_steps(q):
+    """
+    Median spacing between neighbouring points along each lattice axis,
+    measured separately per axis, so a seed that stretched the board more in
+    one direction (a missing edge row) still gets both spacings right.
+    """
+    delta = np.abs(q[:, None, :] - q[None, :, :])
+    dist = np.linalg.norm(delta, axis=2)
+    np.fill_diagonal(dist, np.inf)
+
+    steps = []
+    for axis in (0, 1):
+        nearest = np.where(delta[..., axis] > delta[..., 1 - axis], dist, np.inf).min(axis=1)
+        nearest = nearest[np.isfinite(nearest)]
+        steps.append(float(np.median(nearest)) if len(nearest) else None)
+    su, sv = steps
+    su = su or sv or 1.0
+    sv = sv or su
+    return su, sv
+
+
+def _best_window(cells, rows, cols):
+    """Offset of the rows x cols window holding the most lattice points."""
+    # Only look near the median cell so a stray far-away point can't blow up the search
+    center = np.median(cells, axis=0)
+    lo = np.floor(center) - np.array([2 * cols, 2 * rows])
+    hi = np.floor(center) + np.array([2 * cols, 2 * rows])
+    local = cells[np.all((cells >= lo) & (cells <= hi), axis=1)] - lo
+    if len(local) == 0:
+        return np.floor(center).astype(int) - np.array([cols // 2, rows // 2])
+
+    width, height = (hi - lo + 1).astype(int)
+    counts = np.zeros((height + 1, width + 1), dtype=np.int32)
+    np.add.at(counts, (local[:, 1].astype(int) + 1, local[:, 0].astype(int) + 1), 1)
+    integral = counts.cumsum(axis=0).cumsum(axis=1)
+
+    # Points inside every window [u0, u0 + cols) x [v0, v0 + rows) at once
+    window = (integral[rows:, cols:] - integral[:-rows, cols:]
+              - integral[rows:, :-cols] + integral[:-rows, :-cols])
+    # On ties take the last window, so missing edge rows/columns are assumed to
+    # be at the bottom/right, as the old sort-by-Y ordering did
+    flat = window.size - 1 - np.argmax(window.ravel()[::-1])
+    v0, u0 = np.unravel_index(flat, window.shape)
+    return np.array([u0, v0]) + lo.astype(int)
+
+
+def _drop_isolated(points, factor=1.6):
+    """
+    Removes points much further from their nearest neighbour than that
+    neighbour is from its own, or than the typical spacing; real squares sit
+    at the local grid spacing.
+    """
+    if len(points) < 5:
+        return points
+    dist = np.linalg.norm(points[:, None, :] - points[None, :, :], axis=2)
+    np.fill_diagonal(dist, np.inf)
+    neighbour = dist.argmin(axis=1)
+    nearest = dist[np.arange(len(points)), neighbour]
+    keep = (nearest <= factor * nearest[neighbour]) & (nearest <= 2.5 * np.median(nearest))
+    return points[keep] if keep.sum() >= 4 else points
+
+
+def fit_lattice(centers, rows=8, cols=8, ransac_threshold=0.3, iterations=4):
+    """
+    Fits detected square centers to an ideal rows x cols lattice with a
+    RANSAC homography, so perspective, tilt, missing squares and spurious
+    detections don't scramble the labelling.
+
+    Args:
+        centers: (N, 2) array-like of detected square centers, in any order
+        ransac_threshold: Max distance, in squares, for a detection to count
+            as lying on the lattice
+        iterations: Number of assign-and-refit rounds
+
+    Returns:
+        LatticeFit
+
+    Raises:
+        ValueError: If there are too few points to fit a lattice
+    """
+    points = np.asarray(centers, dtype=np.float32).reshape(-1, 2)
+    if len(points) < 4:
+        raise ValueError(f"Need at least 4 square centers to fit a lattice, got {len(points)}")
+
+    # A spurious detection just outside the board drags a hull corner with it.
+    # Greedily peel hull points while that lets more detections fit the lattice.
+    candidates = _drop_isolated(points)
+    best = None
+    for corners in (_initial_corners(candidates), _bounding_corners(candidates)):
+        fit = _fit_from_corners(points, corners, rows, cols, ransac_threshold, iterations)
+        if fit is not None and (best is None or _score(fit) > _score(best)):
+            best = fit
+        if best is not None and (best.outliers == 0 or best.inliers == rows * cols):
+            break
+    improved = True
+    while improved and len(candidates) > 4:
+        improved = False
+        if best is not None and (best.outliers == 0 or best.inliers == rows * cols):
+            break  # nothing left to peel: every detection or every square is accounted for
+
+        # Re-seed from the detections the current fit accepts
+        if best is not None:
+            inliers = _matched(best, points, ransac_threshold)
+            if 4 <= len(inliers) < len(candidates):
+                fit = _fit_from_corners(points, _initial_corners(inliers), rows, cols,
+                                        ransac_threshold, iterations)
+                if fit is not None and _score(fit) > _score(best):
+                    best, candidates, improved = fit, inliers, True
+                    continue
+
+        for vertex in _peel_order(best, candidates)[:PEEL_CANDIDATES]:
+            trial = np.delete(candidates, vertex, axis=0)
+            fit = _fit_from_corners(points, _initial_corners(trial), rows, cols,
+                                    ransac_threshold, iterations)
+            if fit is None:
+                continue
+            if best is None or _score(fit) > _score(best):
+                best, best_candidates, improved = fit, trial, True
+        if improved:
+            candidates = best_candidates
+
+    if best is None:
+        raise ValueError("Too few square centers agree on a lattice")
+    if _edge_ambiguous(best):
+        raise ValueError("A whole edge row or column is missing on a board seen corner-on; "
+                         "its squares can't be labelled reliably")
+    return best
+
+
+def _peel_order(fit, candidates):
+    """Hull vertices of the candidates, those furthest off the fitted board first."""
+    hull = cv2.convexHull(candidates, returnPoints=False).reshape(-1)
+    if fit is None:
+        return hull
+    q = fit.image_to_lattice(candidates[hull])
+    rows, cols = fit.detected.shape
+    outside = np.maximum(np.maximum(-q, q - [cols - 1, rows - 1]), 0).sum(axis=1)
+    error = np.linalg.norm(q - np.rint(q), axis=1) + outside
+    return hull[np.argsort(-error, kind="stable")]
+
+
+def _edge_ambiguous(fit):
+    """
+    True when a whole outer row or column went undetected on a board turned
+    about 45 degrees in the image. Which edge is missing is then a guess:
+    _best_window assumes bottom/right, which only holds for upright boards.
+    """
+    detected = fit.detected
+    if detected[0].any() and detected[-1].any() and detected[:, 0].any() and detected[:, -1].any():
+        return False
+    rows, cols = detected.shape
+    center = ((cols - 1) / 2, (rows - 1) / 2)
+    (x0, y0), (x1, y1) = fit.lattice_to_image([center, (center[0] + 1, center[1])])
+    angle = np.degrees(np.arctan2(y1 - y0, x1 - x0)) % 90
+    return abs(angle - 45) < DIAGONAL_TOLERANCE
+
+
+def _matched(fit, points, ransac_threshold):
+    """Detections that land within ransac_threshold of a square on the board."""
+    q = fit.image_to_lattice(points)
+    cells = np.rint(q)
+    rows, cols = fit.detected.shape
+    on_board = ((cells[:, 0] >= 0) & (cells[:, 0] < cols) &
+                (cells[:, 1] >= 0) & (cells[:, 1] < rows))
+    return points[on_board & (np.linalg.norm(q - cells, axis=1) < ransac_threshold)]
+
+
+def _score(fit):
+    """More matched squares wins; a tighter fit breaks ties."""
+    return (fit.inliers, -fit.residual)
+
+
+def _fit_from_corners(points, corners, rows, cols, ransac_threshold, iterations):
+    """Assign-and-refit loop seeded with the four outer corner squares; None if it fails."""
+    ideal_corners = np.float32([[0, 0], [cols - 1, 0], [cols - 1, rows - 1], [0, rows - 1]])
+    homography = cv2.getPerspectiveTransform(corners, ideal_corners)
+
+    src = points.reshape(-1, 1, 2)
+    for _ in range(iterations):
+        # Snap every detection to its nearest lattice point, then refit
+        q = cv2.perspectiveTransform(src, homography).reshape(-1, 2)
+        su, sv = _lattice_steps(q)
+        cells = np.rint(q / np.float32([su, sv]))
+        cells -= _best_window(cells, rows, cols)
+
+        refit, _ = cv2.findHomography(points, cells.astype(np.float32), cv2.RANSAC, ransac_threshold)
+        if refit is None:
+            return None
+        homography = refit
+
+    # Final assignment with the converged homography
+    q = cv2.perspectiveTransform(src, homography).reshape(-1, 2)
+    cells = np.rint(q).astype(int)
+    error = np.linalg.norm(q - cells, axis=1)
+    on_board = ((cells[:, 0] >= 0) & (cells[:, 0] < cols) &
+                (cells[:, 1] >= 0) & (cells[:, 1] < rows))
+    inlier = on_board & (error < ransac_threshold)
+    if inlier.sum() < 4:
+        return None
+
+    # Least-squares polish on the inliers only
+    polished, _ = cv2.findHomography(points[inlier], cells[inlier].astype(np.float32), 0)
+    if polished is not None:
+        homography = polished
+        q = cv2.perspectiveTransform(src, homography).reshape(-1, 2)
+        error = np.linalg.norm(q - cells, axis=1)
+
+    # Inferred centers for every square, replaced by the closest detection where there is one
+    grid_u, grid_v = np.meshgrid(np.arange(cols), np.arange(rows))
+    lattice_points = np.stack([grid_u, grid_v], axis=-1).astype(np.float32).reshape(-1, 1, 2)
+    grid = cv2.perspectiveTransform(lattice_points, np.linalg.inv(homography)).reshape(rows, cols, 2)
+    detected = np.zeros((rows, cols), dtype=bool)
+    best_error = np.full((rows, cols), np.inf)
+    for idx in np.flatnonzero(inlier):
+        u, v = cells[idx]
+        if error[idx] < best_error[v, u]:
+            best_error[v, u] = error[idx]
+            grid[v, u] = points[idx]
+            detected[v, u] = True
+
+    residual = float(best_error[detected].mean()) if detected.any() else float("inf")
+    return LatticeFit(homography, grid, detected, residual,
+                      inliers=int(detected.sum()), outliers=int(len(points) - detected.sum()))
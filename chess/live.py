@@ -0,0 +1,202 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from testing import get_board, print_chessboard_labels
+
+# Configuration
+BOARD_MODEL_PATH = r"E:\CHESS_OTB\chess\boardfinder.v3i.yolov11\runs\detect\train\weights\best.pt"
+PIECE_MODEL_PATH = r"E:\CHESS_OTB\otbv5_finetune2\weights\best.pt"
+
+LK_PARAMS = dict(winSize=(21, 21), maxLevel=3,
+                 criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01))
+
+
+class BoardTracker:
+    """
+    Keeps the square grid locked onto a board across video frames.
+
+    The board model runs once; after that the 81 grid corners are followed with
+    pyramidal Lucas-Kanade optical flow and the board homography is re-estimated
+    from them every frame. The board model only runs again when tracking gets
+    unreliable or the camera jumps.
+
+    Args:
+        board_model: YOLO board/square model
+        max_error: Max forward-backward flow error (pixels) for a corner to count as
+            tracked; corners above it are dropped, and too few left triggers re-detection
+        min_tracked: Min fraction of corners that must be tracked
+        max_motion: Median corner motion (pixels/frame) treated as the camera moving
+        clock_side: Passed through to the square labelling
+    """
+
+    def __init__(self, board_model, max_error=2.0, min_tracked=0.6, max_motion=40.0,
+                 clock_side="right_w"):
+        self.board_model = board_model
+        self.max_error = max_error
+        self.min_tracked = min_tracked
+        self.max_motion = max_motion
+        self.clock_side = clock_side
+
+        self.square_data = None
+        self.homography = None     # image -> lattice, like LatticeFit.homography
+        self.tracking_error = None
+        self.detections = 0        # how often the board model has run
+        self._prev_gray = None
+        self._corners = None       # (81, 1, 2) float32 image points
+        self._lattice_corners = None
+        self._shape = None
+
+    def reset(self):
+        """Forces a board detection on the next frame."""
+        self.homography = None
+        self._corners = None
+
+    def update(self, frame):
+        """
+        Returns (square_data, redetected) for a new frame. square_data is the
+        labelled list get_squares returns, or None if no board was found.
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+        redetected = False
+        if self._corners is None or not self._track(gray):
+            self._detect(frame, gray)
+            redetected = True
+
+        self._prev_gray = gray
+        return self.square_data, redetected
+
+    def _detect(self, frame, gray):
+        self.detections += 1
+        self.tracking_error = None
+        try:
+            square_data, fit = get_board(self.board_model, frame, clock_side=self.clock_side)
+        except (ValueError, IndexError) as e:
+            print(f"Board detection failed: {e}")
+            self.square_data, self.homography, self._corners = None, None, None
+            return
+
+        self.square_data = square_data
+        if fit is None:
+            # Sort-by-Y fallback has no homography to track; detect again next frame
+            self.homography, self._corners = None, None
+            return
+
+        rows, cols = fit.detected.shape
+        u, v = np.meshgrid(np.arange(cols + 1) - 0.5, np.arange(rows + 1) - 0.5)
+        self._lattice_corners = np.stack([u, v], axis=-1).reshape(-1, 2).astype(np.float32)
+        corners = fit.lattice_to_image(self._lattice_corners)
+        self._corners = cv2.cornerSubPix(
+            gray, corners.reshape(-1, 1, 2).copy(), (5, 5), (-1, -1),
+            (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+        self.homography = fit.homography
+        self._shape = (rows, cols)
+
+    def _track(self, gray):
+        """Follows the grid corners into the new frame; False if re-detection is needed."""
+        tracked, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, self._corners, None, **LK_PARAMS)
+        back, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self._prev_gray, tracked, None, **LK_PARAMS)
+
+        fb_error = np.linalg.norm((back - self._corners).reshape(-1, 2), axis=1)
+        good = (status.reshape(-1) == 1) & (back_status.reshape(-1) == 1) & (fb_error < self.max_error)
+        if good.mean() < self.min_tracked:
+            return False
+
+        motion = np.linalg.norm((tracked - self._corners).reshape(-1, 2)[good], axis=1)
+        if np.median(motion) > self.max_motion:
+            return False
+
+        homography, inliers = cv2.findHomography(
+            tracked.reshape(-1, 2)[good], self._lattice_corners[good], cv2.RANSAC, 0.1)
+        if homography is None or inliers.sum() < 4:
+            return False
+
+        self.tracking_error = float(np.median(fb_error[good]))
+        self.homography = homography
+
+        # Re-project every corner (also the lost ones) so the grid stays complete
+        inverse = np.linalg.inv(homography)
+        self._corners = cv2.perspectiveTransform(self._lattice_corners.reshape(-1, 1, 2), inverse)
+        self.square_data = self._label_squares(inverse)
+        return True
+
+    def _label_squares(self, inverse):
+        rows, cols = self._shape
+        u, v = np.meshgrid(np.arange(cols), np.arange(rows))
+        lattice_centers = np.stack([u, v], axis=-1).reshape(-1, 1, 2).astype(np.float32)
+        centers = cv2.perspectiveTransform(lattice_centers, inverse).reshape(rows, cols, 2)
+        board = [row for row in np.rint(centers).astype(int)]
+        return print_chessboard_labels(board, clock_side=self.clock_side, final_sq_list=[])
+
+
+def draw_overlay(frame, square_data, redetected, fps, fen=None):
+    """Draws square centers, status and FEN onto a frame in place."""
+    for square_name, center in square_data or []:
+        cv2.circle(frame, center, 3, (0, 0, 255), -1)
+        cv2.putText(frame, square_name, (center[0] - 10, center[1] - 6),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 0, 255), 1)
+    status = "DETECT" if redetected else "TRACK"
+    cv2.putText(frame, f"{status}  {fps:.1f} fps", (10, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+    if fen:
+        cv2.putText(frame, fen.split(' ')[0], (10, frame.shape[0] - 15),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+
+
+def main():
+    from ultralytics import YOLO
+    from piece_square import assign_pieces_to_squares, get_fen_from_board_state
+    from postprocess import piece_detections
+
+    parser = argparse.ArgumentParser(description="Live board tracking from a camera or video file.")
+    parser.add_argument("--source", default="0", help="camera index or video path")
+    parser.add_argument("--board-model", default=BOARD_MODEL_PATH)
+    parser.add_argument("--piece-model", default=None,
+                        help=f"also read the position every frame (e.g. {PIECE_MODEL_PATH})")
+    parser.add_argument("--max-error", type=float, default=2.0)
+    parser.add_argument("--clock-side", default="right_w")
+    args = parser.parse_args()
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        print(f"Cannot open {args.source}")
+        return
+
+    tracker = BoardTracker(YOLO(args.board_model), max_error=args.max_error, clock_side=args.clock_side)
+    piece_model = YOLO(args.piece_model) if args.piece_model else None
+
+    print("Press R to re-detect the board, ESC to exit.")
+    frames, start = 0, time.perf_counter()
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+
+        square_data, redetected = tracker.update(frame)
+        fen = None
+        if piece_model is not None and square_data:
+            piece_data = piece_detections(piece_model(frame, verbose=False)[0], piece_model.names, 0.5)
+            fen = get_fen_from_board_state(assign_pieces_to_squares(square_data, piece_data))
+
+        frames += 1
+        fps = frames / (time.perf_counter() - start)
+        draw_overlay(frame, square_data, redetected, fps, fen)
+        cv2.imshow("Live board", frame)
+
+        key = cv2.waitKey(1) & 0xFF
+        if key == 27:
+            break
+        if key in (ord('r'), ord('R')):
+            tracker.reset()
+
+    cap.release()
+    cv2.destroyAllWindows()
+    print(f"{frames} frames, board model ran {tracker.detections} times")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+Request instrumentation: timing spans, counters and a Prometheus text
+exposition for the /metrics endpoint. Self-contained, so the server doesn't
+need prometheus_client.
+
+Wrap a pipeline stage in span("stage") to record it in the stage histogram
+and in the current request's timings (sent back as a Server-Timing header).
+Work handed to a thread pool keeps the request's timings if it is submitted
+with submit(pool, fn, ...).
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 24, 32, 40, 48, 56, 63, 64, 72, 96, 128)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._function = None
+
+    def set_function(self, function):
+        """function() returns {label values tuple: value} (or a number when there are no labels)."""
+        self._function = function
+
+    def _current(self, values):
+        """Stored values plus whatever the scrape-time function reports."""
+        if self._function is not None:
+            current = self._function()
+            values.update(current if isinstance(current, dict) else {(): current})
+        return values
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self):
+        return []
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {} if self.labelnames else {(): 0}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+                for key, value in sorted(self._current(values).items())]
+
+
+class Gauge(Metric):
+    """A value that is set directly, or read from a callback at scrape time."""
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+                for key, value in sorted(self._current(values).items()) if value is not None]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [per-bucket counts (+Inf last), sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        lines = []
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "chess_stage_seconds", "Time spent in each pipeline stage.", ("stage",)))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "chess_request_seconds", "End-to-end request handling time.", ("endpoint", "status")))
+REQUESTS = REGISTRY.register(Counter(
+    "chess_requests_total", "Requests handled.", ("endpoint", "status")))
+SQUARES_PER_FRAME = REGISTRY.register(Histogram(
+    "chess_squares_detected", "Square detections kept per frame (top 64).", buckets=COUNT_BUCKETS))
+PIECES_PER_FRAME = REGISTRY.register(Histogram(
+    "chess_pieces_detected", "Piece detections above the confidence threshold per frame.", buckets=COUNT_BUCKETS))
+SQUARE_COUNT_MISMATCH = REGISTRY.register(Counter(
+    "chess_square_count_mismatch_total", "Frames where the board model did not find exactly 64 squares."))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "chess_model_queue_depth", "Images waiting in a model's batching queue.", ("model",)))
+MEAN_BATCH_SIZE = REGISTRY.register(Gauge(
+    "chess_model_mean_batch_size", "Mean images per forward pass since start.", ("model",)))
+MODEL_LOAD_SECONDS = REGISTRY.register(Gauge(
+    "chess_model_load_seconds", "Time taken to load and to warm up each model.", ("model", "phase")))
+STAGE_BUSY_SECONDS = REGISTRY.register(Counter(
+    "chess_stage_busy_seconds_total", "Worker time spent busy, per pipeline stage and model.", ("stage",)))
+STAGE_WORKERS = REGISTRY.register(Gauge(
+    "chess_stage_workers", "Worker threads per pipeline stage and model.", ("stage",)))
+STAGE_UTILIZATION = REGISTRY.register(Gauge(
+    "chess_stage_utilization", "Busy fraction of each stage's workers since start.", ("stage",)))
+STAGE_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "chess_stage_queue_depth", "Items waiting for each pipeline stage.", ("stage",)))
+FRAME_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "chess_frame_cache_lookups_total", "Near-duplicate frame cache lookups.", ("endpoint", "result")))
+PROCESS_MEMORY = REGISTRY.register(Gauge(
+    "chess_process_memory_bytes", "Memory of this server process: rss, pss and uss (unique).", ("kind",)))
+
+# smaps_rollup field -> process_memory() key; USS is the private pages, clean and dirty
+SMAPS_FIELDS = {'Rss': 'rss', 'Pss': 'pss', 'Private_Clean': 'uss', 'Private_Dirty': 'uss'}
+
+
+
+def process_memory(pid="self"):
+    """
+    Memory of a process from /proc/<pid>/smaps_rollup (Linux 4.14+).
+
+    Returns:
+        {'rss': ..., 'pss': ..., 'uss': ...} in bytes, or None where it can't
+        be read. PSS splits shared pages between the processes sharing them;
+        USS counts only the pages no other process maps, i.e. what the process
+        costs on top of the ones it shares with.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    memory = dict.fromkeys(('rss', 'pss', 'uss'), 0)
+    for line in lines:
+        field, _, value = line.partition(":")
+        if field in SMAPS_FIELDS:
+            memory[SMAPS_FIELDS[field]] += int(value.split()[0]) * 1024
+    return memory
+
+
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def start_request_timings():
+    """Starts collecting span timings for the current request; returns the dict they go into."""
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+@contextmanager
+def span(stage):
+    """Times a block as one pipeline stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+def submit(pool, fn, *args, **kwargs):
+    """pool.submit that carries the caller's request timings into the worker thread."""
+    return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def server_timing_header(timings):
+    """Formats span timings as a Server-Timing header value (milliseconds)."""
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
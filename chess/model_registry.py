@@ -0,0 +1,465 @@
+"""
+Model registry: loads the board and piece models through PyTorch, ONNX Runtime
+or OpenVINO, exporting (and optionally INT8-quantizing) them on first use.
+
+Exported files sit next to the .pt weights:
+    best.onnx / best_int8.onnx
+    best_openvino_model/ / best_int8_openvino_model/
+
+INT8 post-training quantization is calibrated on the photos in testimage/
+and king_queen/. Check a backend against the .pt models before switching the
+server over:
+    python model_registry.py export --backend onnx --int8
+    python model_registry.py parity --backend onnx --int8 --out parity_onnx_int8.json
+"""
+import argparse
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from postprocess import boxes_to_arrays, piece_detections
+
+BACKENDS = ('torch', 'onnx', 'openvino')
+
+BOARD_MODEL_PATH = r"E:\CHESS_OTB\chess\boardfinder.v3i.yolov11\runs\detect\train\weights\best.pt"
+PIECE_MODEL_PATH = r"E:\CHESS_OTB\otbv5_finetune2\weights\best.pt"
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CALIBRATION_DIRS = (os.path.join(HERE, "..", "testimage"), os.path.join(HERE, "..", "king_queen"))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+IMGSZ = 640
+RETRY_SECONDS = 5.0       # wait after a failed model load before trying again
+MAX_RETRY_SECONDS = 300.0 # the wait doubles with every further failure, up to this
+
+
+def exported_path(pt_path, backend, int8=False):
+    """Where the exported model for a backend lives (the .pt itself for torch)."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+    stem = os.path.splitext(pt_path)[0]
+    if backend == 'onnx':
+        return stem + ('_int8.onnx' if int8 else '.onnx')
+    if backend == 'openvino':
+        return stem + ('_int8_openvino_model' if int8 else '_openvino_model')
+    return pt_path
+
+
+def list_images(dirs):
+    """Sorted image paths from a list of directories."""
+    paths = []
+    for directory in dirs:
+        if not os.path.isdir(directory):
+            print(f"Skipping missing image directory {directory}")
+            continue
+        paths.extend(sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                            if name.lower().endswith(IMAGE_EXTENSIONS)))
+    return paths
+
+
+def letterbox(image, imgsz=IMGSZ):
+    """BGR image -> (1, 3, imgsz, imgsz) float32 RGB tensor, padded like YOLO's preprocessing."""
+    height, width = image.shape[:2]
+    scale = imgsz / max(height, width)
+    new_w, new_h = int(round(width * scale)), int(round(height * scale))
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    top, left = (imgsz - new_h) // 2, (imgsz - new_w) // 2
+    canvas[top:top + new_h, left:left + new_w] = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    return np.ascontiguousarray(canvas[:, :, ::-1].transpose(2, 0, 1)[None], dtype=np.float32) / 255.0
+
+
+def _head_nodes(graph):
+    """Names of the nodes in the detection head (the last /model.N/ block), kept in float."""
+    indices = [int(m.group(1)) for m in (re.match(r"/model\.(\d+)/", node.name) for node in graph.node) if m]
+    if not indices:
+        return []
+    prefix = f"/model.{max(indices)}/"
+    return [node.name for node in graph.node if node.name.startswith(prefix)]
+
+
+def quantize_onnx(onnx_path, out_path, image_paths, imgsz=IMGSZ, exclude_head=True):
+    """
+    Static INT8 quantization (QDQ, per-channel weights) of an exported ONNX model.
+
+    Args:
+        image_paths: Calibration photos; activations ranges are taken from them
+        exclude_head: Keep the box/class regression head in float, which is
+            where INT8 costs the most accuracy
+    """
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    model = onnx.load(onnx_path)
+    input_name = model.graph.input[0].name
+    nodes_to_exclude = _head_nodes(model.graph) if exclude_head else []
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self._paths = iter(image_paths)
+
+        def get_next(self):
+            for path in self._paths:
+                image = cv2.imread(path)
+                if image is not None:
+                    return {input_name: letterbox(image, imgsz)}
+            return None
+
+    quantize_static(onnx_path, out_path, Reader(),
+                    quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                    nodes_to_exclude=nodes_to_exclude)
+    return out_path
+
+
+def _calibration_yaml(dirs, names):
+    """Minimal dataset yaml pointing at the calibration photos, for OpenVINO/NNCF INT8 export."""
+    import yaml
+    dirs = [os.path.abspath(d) for d in dirs if os.path.isdir(d)]
+    data = {'path': os.path.dirname(dirs[0]), 'train': dirs, 'val': dirs,
+            'names': dict(names) if isinstance(names, dict) else dict(enumerate(names))}
+    handle, path = tempfile.mkstemp(suffix=".yaml")
+    with os.fdopen(handle, 'w') as f:
+        yaml.safe_dump(data, f)
+    return path
+
+
+def export_model(pt_path, backend, int8=False, calibration_dirs=CALIBRATION_DIRS, imgsz=IMGSZ):
+    """
+    Exports a .pt model for a backend and returns the exported path.
+
+    Models are exported with dynamic batch size so the micro-batching
+    scheduler can still send several images per call.
+    """
+    from ultralytics import YOLO
+
+    if backend == 'torch':
+        return pt_path
+    target = exported_path(pt_path, backend, int8)
+    model = YOLO(pt_path)
+
+    if backend == 'openvino':
+        data = _calibration_yaml(calibration_dirs, model.names) if int8 else None
+        return model.export(format='openvino', imgsz=imgsz, dynamic=True, int8=int8, data=data)
+
+    onnx_path = model.export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+    if not int8:
+        return onnx_path
+    images = list_images(calibration_dirs)
+    if not images:
+        raise FileNotFoundError("No calibration images found for INT8 quantization")
+    return quantize_onnx(onnx_path, target, images, imgsz)
+
+
+def load_model(pt_path, backend='torch', int8=False, export_missing=True, task=None):
+    """
+    Loads a model through the given backend. The result behaves like the
+    ultralytics YOLO object the rest of the code expects (call it, read .names).
+
+    Args:
+        pt_path: Path of the original .pt weights
+        backend: 'torch', 'onnx' or 'openvino'
+        int8: Use the INT8-quantized export
+        export_missing: Export the model if the backend's file doesn't exist yet
+    """
+    from ultralytics import YOLO
+
+    path = exported_path(pt_path, backend, int8)
+    if backend != 'torch' and not os.path.exists(path):
+        if not export_missing:
+            raise FileNotFoundError(f"No {backend} export at {path}")
+        print(f"Exporting {pt_path} for {backend}{' (INT8)' if int8 else ''}...")
+        path = export_model(pt_path, backend, int8)
+    return YOLO(path, task=task)
+
+
+def freeze_for_inference(model):
+    """
+    Puts a loaded torch model in eval mode with gradients off for every
+    parameter, so nothing writes to the weights again. Exported (ONNX,
+    OpenVINO) models have no torch module and are returned unchanged.
+    """
+    module = getattr(model, 'model', None)
+    if hasattr(module, 'parameters'):
+        module.eval()
+        for parameter in module.parameters():
+            parameter.requires_grad_(False)
+    return model
+
+
+def warm_up(model, imgsz=IMGSZ):
+    """One inference on a blank frame so the first real request doesn't pay for graph setup."""
+    model(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), verbose=False)
+
+
+class LazyModel:
+    """
+    Stands in for a model until it is needed, then loads it once (thread-safe)
+    and optionally warms it up. Calling it and reading .names work like on
+    the loaded model, so it can be handed to BatchingScheduler directly.
+
+    A failed load is retried by the next load() once retry_seconds have
+    passed, doubling the wait after each further failure up to
+    max_retry_seconds; until then load() raises the last error straight away.
+
+    Args:
+        loader: Callable returning the loaded model
+        name: Label used in logs and the /ready status
+        warmup: Run warm_up after loading
+        retry_seconds: Wait after the first failed load before trying again
+        max_retry_seconds: Longest wait between retries
+    """
+
+    def __init__(self, loader, name="model", warmup=True, imgsz=IMGSZ,
+                 retry_seconds=RETRY_SECONDS, max_retry_seconds=MAX_RETRY_SECONDS):
+        self._loader = loader
+        self.name = name
+        self.warmup = warmup
+        self.imgsz = imgsz
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self._model = None
+        self._error = None
+        self.failures = 0
+        self._retry_at = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self._model is not None
+
+    @property
+    def names(self):
+        return self.load().names
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+    def retry_in(self):
+        """Seconds until a failed load may be retried (0 when due), or None if nothing failed."""
+        if self._error is None:
+            return None
+        return max(0.0, self._retry_at - time.monotonic())
+
+    def load(self):
+        """Returns the model, loading and warming it up first if needed."""
+        with self._lock:
+            if self._error is not None and self.retry_in() == 0:
+                print(f"Retrying {self.name} model load (attempt {self.failures + 1})")
+                self._error = None
+            if self._model is None and self._error is None:
+                try:
+                    start = time.perf_counter()
+                    model = self._loader()
+                    self.load_seconds = time.perf_counter() - start
+                    if self.warmup:
+                        start = time.perf_counter()
+                        warm_up(model, self.imgsz)
+                        self.warmup_seconds = time.perf_counter() - start
+                    self._model = model
+                    print(f"{self.name} model ready (load {self.load_seconds:.1f} s"
+                          f"{f', warmup {self.warmup_seconds:.1f} s' if self.warmup else ''})")
+                except Exception as e:
+                    self._error = e
+                    self.failures += 1
+                    wait = min(self.retry_seconds * 2 ** (self.failures - 1), self.max_retry_seconds)
+                    self._retry_at = time.monotonic() + wait
+                    print(f"Error loading {self.name} model: {e} (retrying in {wait:.0f} s)")
+            if self._error is not None:
+                raise RuntimeError(f"{self.name} model failed to load: {self._error}")
+            return self._model
+
+    def load_in_background(self):
+        """
+        Starts loading on a daemon thread and returns the thread. Does nothing
+        while a load is running or the model is ready; after a failure, starts
+        the retry once it is due.
+        """
+        with self._lock:
+            running = self._thread is not None and self._thread.is_alive()
+            if self._model is None and not running and self.retry_in() in (None, 0):
+                self._thread = threading.Thread(target=self._load_quietly, name=f"{self.name}-loader", daemon=True)
+                self._thread.start()
+            return self._thread
+
+    def _load_quietly(self):
+        try:
+            self.load()
+        except RuntimeError:
+            pass  # already reported; status() shows it
+
+    def status(self):
+        """Loading state for the readiness endpoint."""
+        if self._model is not None:
+            state = 'ready'
+        elif self._error is not None:
+            state = 'failed'
+        elif self._thread is not None or self._lock.locked():
+            state = 'loading'
+        else:
+            state = 'not_loaded'
+        status = {'state': state, 'load_seconds': self.load_seconds, 'warmup_seconds': self.warmup_seconds}
+        if self.failures:
+            status['failures'] = self.failures
+        error, retry_at = self._error, self._retry_at
+        if error is not None:
+            status['error'] = str(error)
+            status['retry_in_seconds'] = round(max(0.0, retry_at - time.monotonic()), 1)
+        return status
+
+
+def box_iou(a, b):
+    """Pairwise IoU between (N, 4) and (M, 4) xyxy arrays."""
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+    area_a = (a[:, 2:] - a[:, :2]).prod(axis=1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def compare_detections(ref_result, test_result, iou_threshold=0.5):
+    """
+    Greedily matches the test model's boxes to the reference boxes.
+
+    Returns:
+        Dict with ref/test box counts, matched pairs, their IoUs and how many
+        of the matched pairs agree on the class
+    """
+    ref_xyxy, _, ref_cls = boxes_to_arrays(ref_result.boxes)
+    test_xyxy, _, test_cls = boxes_to_arrays(test_result.boxes)
+    stats = {'ref_boxes': len(ref_xyxy), 'test_boxes': len(test_xyxy), 'matched': 0,
+             'iou_sum': 0.0, 'class_agree': 0}
+    if not len(ref_xyxy) or not len(test_xyxy):
+        return stats
+
+    iou = box_iou(ref_xyxy, test_xyxy)
+    while True:
+        i, j = np.unravel_index(np.argmax(iou), iou.shape)
+        if iou[i, j] < iou_threshold:
+            break
+        stats['matched'] += 1
+        stats['iou_sum'] += float(iou[i, j])
+        stats['class_agree'] += int(ref_cls[i] == test_cls[j])
+        iou[i, :] = -1
+        iou[:, j] = -1
+    return stats
+
+
+def fen_for(board_model, piece_model, image):
+    """Full pipeline FEN for one image, or None if the board could not be read."""
+    from testing import get_board
+    from piece_square import assign_pieces_to_squares, get_fen_from_board_state
+
+    try:
+        square_data, _ = get_board(board_model, image)
+    except (ValueError, IndexError):
+        return None
+    result = piece_model(image, verbose=False)[0]
+    piece_data = piece_detections(result, piece_model.names, 0.5)
+    return get_fen_from_board_state(assign_pieces_to_squares(square_data, piece_data))
+
+
+def _timed(model, image):
+    start = time.perf_counter()
+    result = model(image, verbose=False)[0]
+    return result, (time.perf_counter() - start) * 1000
+
+
+def parity_report(backend, int8=False, image_dirs=CALIBRATION_DIRS,
+                  board_path=BOARD_MODEL_PATH, piece_path=PIECE_MODEL_PATH, warmup=2):
+    """
+    Compares a backend against the .pt models on every image in image_dirs.
+
+    Returns:
+        Dict with, per model, box recall, mean IoU and class agreement of the
+        matched boxes plus median latencies and speedup, and the share of
+        images where the final FEN is identical
+    """
+    images = [(path, cv2.imread(path)) for path in list_images(image_dirs)]
+    images = [(path, image) for path, image in images if image is not None]
+    if not images:
+        raise FileNotFoundError("No images to compare on")
+
+    reference = {'board': load_model(board_path), 'piece': load_model(piece_path)}
+    candidate = {'board': load_model(board_path, backend, int8), 'piece': load_model(piece_path, backend, int8)}
+
+    report = {'backend': backend, 'int8': int8, 'images': len(images)}
+    for name in ('board', 'piece'):
+        ref_model, test_model = reference[name], candidate[name]
+        for _ in range(warmup):
+            ref_model(images[0][1], verbose=False)
+            test_model(images[0][1], verbose=False)
+
+        totals = {'ref_boxes': 0, 'test_boxes': 0, 'matched': 0, 'iou_sum': 0.0, 'class_agree': 0}
+        ref_ms, test_ms = [], []
+        for _, image in images:
+            ref_result, ms = _timed(ref_model, image)
+            ref_ms.append(ms)
+            test_result, ms = _timed(test_model, image)
+            test_ms.append(ms)
+            for key, value in compare_detections(ref_result, test_result).items():
+                totals[key] += value
+
+        matched = totals['matched']
+        report[name] = {
+            'box_recall': matched / totals['ref_boxes'] if totals['ref_boxes'] else 1.0,
+            'extra_boxes': totals['test_boxes'] - matched,
+            'mean_iou': totals['iou_sum'] / matched if matched else 0.0,
+            'class_agreement': totals['class_agree'] / matched if matched else 0.0,
+            'latency_ms': {'torch': float(np.median(ref_ms)), backend: float(np.median(test_ms))},
+            'speedup': float(np.median(ref_ms) / np.median(test_ms)),
+        }
+
+    mismatches = []
+    for path, image in images:
+        ref_fen = fen_for(reference['board'], reference['piece'], image)
+        test_fen = fen_for(candidate['board'], candidate['piece'], image)
+        if ref_fen != test_fen:
+            mismatches.append({'image': os.path.basename(path), 'torch': ref_fen, backend: test_fen})
+    report['fen_agreement'] = 1 - len(mismatches) / len(images)
+    report['fen_mismatches'] = mismatches
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export models to CPU backends and check parity.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for command in ("export", "parity"):
+        p = sub.add_parser(command)
+        p.add_argument("--backend", choices=BACKENDS[1:], default="onnx")
+        p.add_argument("--int8", action="store_true", help="INT8 post-training quantization")
+        p.add_argument("--board-model", default=BOARD_MODEL_PATH)
+        p.add_argument("--piece-model", default=PIECE_MODEL_PATH)
+    sub.choices["parity"].add_argument("--images", nargs="+", default=list(CALIBRATION_DIRS))
+    sub.choices["parity"].add_argument("--out", default=None, help="write the report as JSON")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        for pt_path in (args.board_model, args.piece_model):
+            print(f"{pt_path} -> {export_model(pt_path, args.backend, args.int8)}")
+        return
+
+    report = parity_report(args.backend, args.int8, args.images, args.board_model, args.piece_model)
+    for name in ('board', 'piece'):
+        r = report[name]
+        print(f"{name:5s} recall {r['box_recall']:.3f}  IoU {r['mean_iou']:.3f}  "
+              f"class {r['class_agreement']:.3f}  torch {r['latency_ms']['torch']:.1f} ms  "
+              f"{args.backend} {r['latency_ms'][args.backend]:.1f} ms  ({r['speedup']:.2f}x)")
+    print(f"FEN agreement {report['fen_agreement']:.3f} over {report['images']} images")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Several boards in one frame, e.g. an overhead camera over a row of tables.
+
+Square detections are grouped into boards by how close they sit to each
+other, every group gets its own lattice fit (see lattice.py), and boards keep
+the same id from frame to frame by matching their positions with the
+previous frame's.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+from testing import label_detections_with_fit
+
+MAX_BOARDS = 6
+MIN_SQUARES = 24        # a group with fewer square detections isn't treated as a board
+LINK_DISTANCE = 1.6     # detections closer than this many square spacings belong to one board
+LATTICE_TOLERANCE = 0.3  # squares; detections further off a fitted lattice belong to another board
+MAX_BOARD_SHIFT = 0.5   # board widths a board may move between frames and keep its id
+
+
+def cluster_squares(detections, link_distance=LINK_DISTANCE, min_squares=MIN_SQUARES):
+    """
+    Groups square detections into boards.
+
+    Args:
+        detections: [(conf, (x, y), class_name), ...] from square_detections()
+
+    Returns:
+        List of detection lists, one per group of at least min_squares
+    """
+    if len(detections) < min_squares:
+        return []
+    centers = np.array([center for _, center, _ in detections], dtype=np.float64)
+    gaps = np.linalg.norm(centers[:, None, :] - centers[None, :, :], axis=2)
+    np.fill_diagonal(gaps, np.inf)
+
+    # Each detection's nearest neighbour is about one square away on its own
+    # board, whatever the board's size in the image
+    spacing = gaps.min(axis=1)
+    linked = gaps < link_distance * np.minimum(spacing[:, None], spacing[None, :])
+    count, labels = connected_components(csr_matrix(linked), directed=False)
+
+    groups = [[detections[i] for i in np.flatnonzero(labels == label)] for label in range(count)]
+    return [group for group in groups if len(group) >= min_squares]
+
+
+def _on_lattice(fit, detections, tolerance=LATTICE_TOLERANCE):
+    """Mask of the detections that land on one of the fitted board's squares."""
+    q = fit.image_to_lattice([center for _, center, _ in detections])
+    cells = np.rint(q)
+    rows, cols = fit.detected.shape
+    on_board = ((cells[:, 0] >= 0) & (cells[:, 0] < cols) &
+                (cells[:, 1] >= 0) & (cells[:, 1] < rows))
+    return on_board & (np.linalg.norm(q - cells, axis=1) < tolerance)
+
+
+def find_boards(detections, max_boards=MAX_BOARDS, min_squares=MIN_SQUARES, clock_side="right_w"):
+    """
+    Finds every board in one frame's square detections.
+
+    A group that holds two boards touching each other is split by fitting one
+    board and fitting again on the detections it left over.
+
+    Returns:
+        [(square_data, fit), ...] left to right; square_data as get_squares() returns
+    """
+    boards = []
+    pending = cluster_squares(detections, min_squares=min_squares)
+    while pending and len(boards) < max_boards:
+        group = pending.pop()
+        try:
+            square_data, fit = label_detections_with_fit(group, clock_side)
+        except (ValueError, IndexError):
+            continue
+        if fit is None or fit.inliers < min_squares:
+            continue
+        boards.append((square_data, fit))
+
+        leftover = [det for det, on in zip(group, _on_lattice(fit, group)) if not on]
+        if len(leftover) >= min_squares:
+            pending.extend(cluster_squares(leftover, min_squares=min_squares))
+
+    boards.sort(key=lambda board: board[1].centers[..., 0].mean())
+    return boards
+
+
+class BoardIds:
+    """
+    Thread-safe per-session board ids. Each frame's boards are matched to the
+    boards the session has seen (nearest region centers, min-cost); boards that
+    moved more than MAX_BOARD_SHIFT of their width get a new id.
+
+    Args:
+        max_sessions: Maximum number of sessions kept; least recently used go first
+        ttl: Seconds a session's boards are remembered after its last frame
+    """
+
+    def __init__(self, max_sessions=128, ttl=30 * 60):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()  # session_id -> (expires_at, {board_id: (center, width)}, next_id)
+        self._lock = threading.Lock()
+
+    def match(self, session_id, regions):
+        """
+        Args:
+            regions: (x0, y0, x1, y1) box per board in this frame
+
+        Returns:
+            Board id per region, e.g. 'board-1'
+        """
+        centers = np.array([((x0 + x1) / 2, (y0 + y1) / 2) for x0, y0, x1, y1 in regions], dtype=np.float64)
+        widths = [max(x1 - x0, 1) for x0, _, x1, _ in regions]
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            known, next_id = ({}, 1) if entry is None or entry[0] < now else entry[1:]
+
+            ids = [None] * len(regions)
+            if known and len(regions):
+                known_ids = list(known)
+                known_centers = np.array([known[board_id][0] for board_id in known_ids])
+                known_widths = np.array([known[board_id][1] for board_id in known_ids], dtype=np.float64)
+                shift = np.linalg.norm(known_centers[:, None, :] - centers[None, :, :], axis=2) / known_widths[:, None]
+                for i, j in zip(*linear_sum_assignment(shift)):
+                    if shift[i, j] <= MAX_BOARD_SHIFT:
+                        ids[j] = known_ids[i]
+
+            for j in range(len(regions)):
+                if ids[j] is None:
+                    ids[j] = f"board-{next_id}"
+                    next_id += 1
+                known[ids[j]] = (centers[j], widths[j])
+
+            self._sessions[session_id] = (now + self.ttl, known, next_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return ids
@@ -1,5 +1,6 @@
 from ultralytics import YOLO
 import cv2
+from postprocess import piece_detections
 
 # Paths
 MODEL_PATH = r"E:\CHESS_OTB\otbv5_finetune2\weights\best.pt"
@@ -16,19 +17,10 @@ results = model(IMAGE_PATH)  # can pass the path directly
 final_list = []
 # Process results
 for result in results:
-    square_detections = []
-    for box in result.boxes: 
-        conf = float(box.conf[0]) 
-        cls_id = int(box.cls[0]) 
-        class_name = model.names[cls_id]  
-        x1, y1, x2, y2 = box.xyxy[0].tolist()
-        
-        # Correct center calculation
-        center_x = int((x1 + x2) // 2)
-        center_y = int(y2 - (y2 - y1) // 4 )
-        center = (center_x, center_y)
-        
-        square_detections.append((center, class_name, conf))
+    # Anchors are computed for every box at once (lower quarter of the box)
+    square_detections = piece_detections(result, model.names, with_conf=True)
+    for center, class_name, conf in square_detections:
+        center_x, center_y = center
         
         # Draw center point and label
         cv2.circle(image, center, 5, (0, 0, 255), -1)
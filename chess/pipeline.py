@@ -0,0 +1,156 @@
+"""
+Request pipeline stages.
+
+Each CPU-heavy step of a request (decode, annotate/encode) runs on its own
+Stage: a fixed set of worker threads behind a bounded queue. Handler threads
+hand work to a stage and wait for it, so decoding of one request overlaps
+with inference and encoding of others, while the worker counts cap how many
+cores each step can take. When a stage's queue is full, submit() blocks;
+a burst then backs up into the handler threads instead of piling up work.
+The models have their own stage-like workers (scheduler.BatchingScheduler).
+
+Stages and schedulers keep busy-time counters; /metrics exposes them as
+per-stage utilisation.
+"""
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+
+import cv2
+
+_stages = weakref.WeakSet()
+
+
+class Stage:
+    """
+    Worker threads with a bounded queue in front of them. submit() has the
+    same signature as ThreadPoolExecutor.submit, so metrics.submit() works
+    with a Stage too.
+
+    Args:
+        name: Stage name for thread names and metrics
+        workers: Number of worker threads
+        max_queue: Items that may wait before submit() blocks (0 for no limit)
+
+    The threads start on first use, so configure() can still change the
+    sizes after the stage was created. A forked child starts them afresh.
+    """
+
+    def __init__(self, name, workers=2, max_queue=32):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.started_at = None
+        self._queue = None
+        self._threads = []
+        self._lock = threading.Lock()
+        _stages.add(self)
+
+    def configure(self, workers, max_queue):
+        """Sets the worker count and queue bound; only before the stage has started."""
+        with self._lock:
+            if self._queue is not None:
+                raise RuntimeError(f"Stage {self.name} is already running")
+            self.workers, self.max_queue = workers, max_queue
+
+    def start(self):
+        with self._lock:
+            if self._queue is not None:
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self.started_at = time.monotonic()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, fn, *args, **kwargs):
+        """Queues fn(*args, **kwargs), blocking while the queue is full; returns a Future."""
+        if self._queue is None:
+            self.start()
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def __call__(self, fn, *args, **kwargs):
+        """Runs fn on the stage and waits for the result."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def utilization(self):
+        """Fraction of the workers' time spent busy since the stage started."""
+        if self.started_at is None:
+            return 0.0
+        elapsed = (time.monotonic() - self.started_at) * self.workers
+        with self._lock:
+            return self.busy_seconds / elapsed if elapsed > 0 else 0.0
+
+    def close(self):
+        """Stops the workers after the work already queued."""
+        if self._queue is None:
+            return
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _after_fork(self):
+        """In a forked child: drops the parent's (threadless) worker state."""
+        self._lock = threading.Lock()
+        self._queue, self._threads, self.started_at = None, [], None
+        self.items, self.busy_seconds = 0, 0.0
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finally:
+                with self._lock:
+                    self.items += 1
+                    self.busy_seconds += time.perf_counter() - start
+
+
+def _reset_after_fork():
+    for stage in list(_stages):
+        stage._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def configure_threads(torch_threads=0, opencv_threads=0):
+    """
+    Caps the intra-op threads each library uses per call, so stages running
+    side by side don't oversubscribe the cores. 0 leaves a library's default.
+    """
+    if opencv_threads:
+        cv2.setNumThreads(opencv_threads)
+    if torch_threads:
+        # OpenMP-based runtimes (ONNX Runtime, OpenVINO CPU) read this when they start
+        os.environ.setdefault("OMP_NUM_THREADS", str(torch_threads))
+        try:
+            import torch
+            torch.set_num_threads(torch_threads)
+        except ImportError:
+            pass
@@ -0,0 +1,107 @@
+import numpy as np
+
+
+def _to_numpy(values):
+    """Converts a torch tensor (any device) or array-like to a NumPy array."""
+    if hasattr(values, "cpu"):
+        values = values.cpu()
+    if hasattr(values, "numpy"):
+        return values.numpy()
+    return np.asarray(values)
+
+
+def boxes_to_arrays(boxes):
+    """
+    Pulls every box out of an ultralytics Boxes object in one shot.
+
+    Returns:
+        (xyxy, conf, cls) as float32 (N, 4), float32 (N,) and int64 (N,) arrays
+    """
+    xyxy = _to_numpy(boxes.xyxy).astype(np.float32, copy=False).reshape(-1, 4)
+    conf = _to_numpy(boxes.conf).astype(np.float32, copy=False).reshape(-1)
+    cls = _to_numpy(boxes.cls).astype(np.int64).reshape(-1)
+    return xyxy, conf, cls
+
+
+def class_ids_for(names, class_names):
+    """Returns the model class ids whose names are in class_names."""
+    if isinstance(class_names, str):
+        class_names = [class_names]
+    wanted = set(class_names)
+    return [cls_id for cls_id, name in names.items() if name in wanted]
+
+
+def filter_boxes(xyxy, conf, cls, class_ids=None, conf_threshold=None, top_k=None):
+    """
+    Applies class filtering, a confidence threshold and top-k with array ops.
+
+    Args:
+        class_ids: Keep only these class ids (None keeps every class)
+        conf_threshold: Keep boxes with conf strictly above this value
+        top_k: Keep the k most confident boxes, sorted by descending confidence
+
+    Returns:
+        Filtered (xyxy, conf, cls)
+    """
+    keep = np.ones(len(conf), dtype=bool)
+    if class_ids is not None:
+        keep &= np.isin(cls, class_ids)
+    if conf_threshold is not None:
+        keep &= conf > conf_threshold
+    xyxy, conf, cls = xyxy[keep], conf[keep], cls[keep]
+
+    if top_k is not None:
+        order = np.argsort(-conf, kind="stable")[:top_k]
+        xyxy, conf, cls = xyxy[order], conf[order], cls[order]
+    return xyxy, conf, cls
+
+
+def box_centers(xyxy):
+    """Integer box centers, (N, 2)."""
+    centers = np.empty((len(xyxy), 2), dtype=np.int64)
+    centers[:, 0] = (xyxy[:, 0] + xyxy[:, 2]) // 2
+    centers[:, 1] = (xyxy[:, 1] + xyxy[:, 3]) // 2
+    return centers
+
+
+def piece_anchors(xyxy):
+    """
+    Integer piece anchors, (N, 2): horizontally centered, a quarter of the box
+    height up from the bottom edge, which is roughly where the piece stands.
+    """
+    anchors = np.empty((len(xyxy), 2), dtype=np.int64)
+    anchors[:, 0] = (xyxy[:, 0] + xyxy[:, 2]) // 2
+    anchors[:, 1] = xyxy[:, 3] - (xyxy[:, 3] - xyxy[:, 1]) // 4
+    return anchors
+
+
+def square_detections(result, names, target_class="square", top_k=None):
+    """
+    Square detections for one image's YOLO result, most confident first.
+
+    Returns:
+        [(conf, (x, y), class_name), ...] like testing.detect_squares
+    """
+    xyxy, conf, cls = boxes_to_arrays(result.boxes)
+    xyxy, conf, cls = filter_boxes(xyxy, conf, cls,
+                                   class_ids=class_ids_for(names, target_class),
+                                   top_k=top_k if top_k is not None else len(conf))
+    centers = box_centers(xyxy).tolist()
+    return [(score, (x, y), target_class) for score, (x, y) in zip(conf.tolist(), centers)]
+
+
+def piece_detections(result, names, conf_threshold=None, with_conf=False):
+    """
+    Piece detections for one image's YOLO result.
+
+    Returns:
+        [((x, y), piece_type), ...], or [((x, y), piece_type, conf), ...] with with_conf
+    """
+    xyxy, conf, cls = boxes_to_arrays(result.boxes)
+    xyxy, conf, cls = filter_boxes(xyxy, conf, cls, conf_threshold=conf_threshold)
+    anchors = piece_anchors(xyxy).tolist()
+    piece_types = [names[cls_id] for cls_id in cls.tolist()]
+    if with_conf:
+        return [((x, y), piece_type, score)
+                for (x, y), piece_type, score in zip(anchors, piece_types, conf.tolist())]
+    return [((x, y), piece_type) for (x, y), piece_type in zip(anchors, piece_types)]
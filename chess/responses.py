@@ -0,0 +1,170 @@
+"""
+Response modes for the image endpoints.
+
+    image    annotated JPEG at the decoded size, base64 in the JSON (the original behaviour)
+    json     no picture at all, just squares / board state / FEN
+    preview  annotated thumbnail (longest side PREVIEW_MAX_SIDE), base64 in the JSON
+    overlay  no picture; the JSON gets an 'overlay' block with the geometry to draw
+    binary   multipart/mixed: the JSON part followed by the annotated JPEG as raw bytes
+
+Annotating and encoding run on the ENCODE_POOL stage (see pipeline.py) so they
+can overlap with the rest of the request (FEN generation, board view update,
+JSON building) and with other requests.
+"""
+import base64
+import json
+import uuid
+
+import cv2
+from flask import Response, jsonify
+
+from metrics import span, submit
+from pipeline import Stage
+
+RESPONSE_MODES = ('image', 'json', 'preview', 'overlay', 'binary')
+DEFAULT_RESPONSE_MODE = 'image'
+IMAGE_MODES = ('image', 'preview', 'binary')
+
+PREVIEW_MAX_SIDE = 640
+JPEG_QUALITY = 95              # cv2.imencode default
+PREVIEW_JPEG_QUALITY = 75
+
+ENCODE_POOL = Stage("encode", workers=2, max_queue=32)  # sized by the server's config
+
+
+def get_response_mode(form, args=None):
+    """
+    Reads the response mode from the 'response' form field (or query string).
+
+    Raises:
+        ValueError: For an unknown mode
+    """
+    mode = form.get('response') or (args.get('response') if args is not None else None) or DEFAULT_RESPONSE_MODE
+    mode = mode.lower()
+    if mode not in RESPONSE_MODES:
+        raise ValueError(f"response must be one of {', '.join(RESPONSE_MODES)}")
+    return mode
+
+
+def draw_squares(image, square_data, scale=1.0):
+    """Draws square centers and names onto the image in place."""
+    for square_name, center in square_data:
+        x, y = int(center[0] * scale), int(center[1] * scale)
+        cv2.circle(image, (x, y), 5, (0, 0, 255), -1)  # Red dot for square center
+        cv2.putText(image, square_name, (x - 10, y - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)  # Red text for square name
+
+
+def draw_pieces(image, piece_data, scale=1.0):
+    """Draws piece anchors and types onto the image in place."""
+    for center, piece_type, *_ in piece_data:
+        x, y = int(center[0] * scale), int(center[1] * scale)
+        cv2.circle(image, (x, y), 5, (0, 255, 0), -1)
+        cv2.putText(image, piece_type, (x - 20, y - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
+
+
+def render_annotated(image, square_data=(), piece_data=(), max_side=None, quality=JPEG_QUALITY,
+                     image_scale=1.0):
+    """
+    Draws squares and pieces and JPEG-encodes the result.
+
+    With max_side the image is shrunk first and the overlay drawn at the
+    reduced size, so a thumbnail never touches the full-resolution pixels
+    beyond the one resize. The caller's image is left untouched.
+
+    Args:
+        image_scale: Original pixels per pixel of image; square and piece
+            coordinates are in original pixels
+
+    Returns:
+        JPEG bytes
+    """
+    with span('encode'):
+        return _render_annotated(image, square_data, piece_data, max_side, quality, image_scale)
+
+
+def _render_annotated(image, square_data, piece_data, max_side, quality, image_scale):
+    height, width = image.shape[:2]
+    scale = 1.0
+    if max_side and max(height, width) > max_side:
+        scale = max_side / max(height, width)
+        canvas = cv2.resize(image, (int(round(width * scale)), int(round(height * scale))),
+                            interpolation=cv2.INTER_AREA)
+    else:
+        canvas = image.copy()
+
+    draw_squares(canvas, square_data, scale / image_scale)
+    draw_pieces(canvas, piece_data, scale / image_scale)
+    ok, buffer = cv2.imencode('.jpg', canvas, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode annotated image")
+    return buffer.tobytes()
+
+
+def start_render(mode, image, square_data=(), piece_data=(), image_scale=1.0):
+    """
+    Starts annotating/encoding in the background for modes that return a picture.
+
+    Returns:
+        Future resolving to JPEG bytes, or None when the mode has no picture
+    """
+    if mode not in IMAGE_MODES:
+        return None
+    if mode == 'preview':
+        return submit(ENCODE_POOL, render_annotated, image, list(square_data), list(piece_data),
+                      PREVIEW_MAX_SIDE, PREVIEW_JPEG_QUALITY, image_scale)
+    return submit(ENCODE_POOL, render_annotated, image, list(square_data), list(piece_data),
+                  None, JPEG_QUALITY, image_scale)
+
+
+def overlay_geometry(image_size, square_data=(), piece_data=()):
+    """Geometry a client needs to draw the overlay itself, in original image pixels."""
+    width, height = image_size
+    return {
+        'image_size': {'width': int(width), 'height': int(height)},
+        'squares': [{"square": square_name, "center": {"x": int(center[0]), "y": int(center[1])}}
+                    for square_name, center in square_data],
+        'pieces': [{"piece": piece_type, "center": {"x": int(center[0]), "y": int(center[1])}}
+                   for center, piece_type, *_ in piece_data],
+    }
+
+
+def build_response(mode, payload, render_future=None, image_size=None, square_data=(), piece_data=()):
+    """
+    Finishes a response for the given mode.
+
+    Args:
+        payload: JSON-serialisable dict with everything except the picture
+        render_future: Future from start_render, for modes that return a picture
+        image_size: (width, height), needed for overlay mode
+    """
+    if mode == 'overlay':
+        payload['overlay'] = overlay_geometry(image_size, square_data, piece_data)
+        return jsonify(payload)
+    if render_future is None:
+        return jsonify(payload)
+
+    jpeg = render_future.result()
+    if mode == 'binary':
+        return multipart_response(payload, jpeg)
+
+    payload['image'] = 'data:image/jpeg;base64,' + base64.b64encode(jpeg).decode('utf-8')
+    return jsonify(payload)
+
+
+def multipart_response(payload, jpeg):
+    """multipart/mixed with an application/json part and an image/jpeg part."""
+    boundary = uuid.uuid4().hex
+    body = b"".join([
+        f"--{boundary}\r\n".encode(),
+        b"Content-Type: application/json\r\n\r\n",
+        json.dumps(payload).encode('utf-8'),
+        f"\r\n--{boundary}\r\n".encode(),
+        b"Content-Type: image/jpeg\r\n",
+        b'Content-Disposition: inline; filename="annotated.jpg"\r\n',
+        f"Content-Length: {len(jpeg)}\r\n\r\n".encode(),
+        jpeg,
+        f"\r\n--{boundary}--\r\n".encode(),
+    ])
+    return Response(body, content_type=f"multipart/mixed; boundary={boundary}")
@@ -0,0 +1,118 @@
+"""
+Board regions of interest: the part of a frame a board's pieces can be in,
+worked out from its square grid, so the piece model can look at that instead
+of the whole frame.
+
+A region much larger than the model input is split into overlapping tiles.
+Every tile owns a core rectangle (the cores partition the region) and only
+keeps the pieces anchored inside its core; the overlap is wide enough that the
+tile owning a piece always sees all of it.
+"""
+import math
+
+import numpy as np
+
+TOP_MARGIN = 1.5    # squares above the top row of centers: tall pieces stick up out of their square
+SIDE_MARGIN = 0.75  # squares around the other sides
+TILE_MARGIN = 2.0   # squares of overlap around each tile's core
+
+
+def board_region(squares, image_size, top_margin=TOP_MARGIN, side_margin=SIDE_MARGIN, rows=8, cols=8,
+                 scale=1.0):
+    """
+    Pixel box around a board's square centers, grown by the margins and
+    clipped to the image.
+
+    Args:
+        squares: [(square_name, (x, y)), ...] for one board
+        image_size: (width, height) of the image the box is for
+        top_margin, side_margin: In squares (the board's mean square size)
+        scale: Square-center pixels per image pixel, e.g. original-image
+            centers on a reduced decode (see ingest.py)
+
+    Returns:
+        (x0, y0, x1, y1) integer box, x1/y1 exclusive
+    """
+    centers = np.array([center for _, center in squares], dtype=np.float64).reshape(-1, 2) / scale
+    (x_min, y_min), (x_max, y_max) = centers.min(axis=0), centers.max(axis=0)
+    square_w = (x_max - x_min) / max(cols - 1, 1)
+    square_h = (y_max - y_min) / max(rows - 1, 1)
+
+    width, height = image_size
+    x0 = int(max(0, np.floor(x_min - side_margin * square_w)))
+    x1 = int(min(width, np.ceil(x_max + side_margin * square_w)))
+    y0 = int(max(0, np.floor(y_min - top_margin * square_h)))
+    y1 = int(min(height, np.ceil(y_max + side_margin * square_h)))
+    return x0, y0, x1, y1
+
+
+def crop(image, region):
+    """View of the image inside a (x0, y0, x1, y1) region."""
+    x0, y0, x1, y1 = region
+    return image[y0:y1, x0:x1]
+
+
+def offset_pieces(piece_data, offset):
+    """Moves [((x, y), piece_type[, conf])] from crop to image pixels."""
+    dx, dy = offset
+    return [((x + dx, y + dy), *rest) for (x, y), *rest in piece_data]
+
+
+class Tile:
+    """One piece-model input: the box to crop and the core whose pieces it keeps."""
+    __slots__ = ("box", "core")
+
+    def __init__(self, box, core):
+        self.box = box
+        self.core = core
+
+
+def tile_region(region, max_side, square_px=None, margin=TILE_MARGIN):
+    """
+    Splits a region into the fewest tiles whose cores are at most max_side
+    pixels on a side (a single tile if the region already fits).
+
+    Args:
+        region: (x0, y0, x1, y1) box
+        max_side: Largest core side, e.g. a small multiple of the model's imgsz
+        square_px: Board square size in pixels; estimated from the region
+            (a board_region with the default margins) when not given
+        margin: Overlap around each core, in squares
+
+    Returns:
+        List of Tile
+    """
+    x0, y0, x1, y1 = region
+    width, height = x1 - x0, y1 - y0
+    nx, ny = max(1, math.ceil(width / max_side)), max(1, math.ceil(height / max_side))
+    if nx == 1 and ny == 1:
+        return [Tile(region, region)]
+
+    if square_px is None:
+        square_px = width / (8 + 2 * SIDE_MARGIN)
+    pad = int(math.ceil(margin * square_px))
+    xs = np.linspace(x0, x1, nx + 1).round().astype(int)
+    ys = np.linspace(y0, y1, ny + 1).round().astype(int)
+
+    tiles = []
+    for i in range(ny):
+        for j in range(nx):
+            core = (int(xs[j]), int(ys[i]), int(xs[j + 1]), int(ys[i + 1]))
+            box = (max(x0, core[0] - pad), max(y0, core[1] - pad), min(x1, core[2] + pad), min(y1, core[3] + pad))
+            tiles.append(Tile(box, core))
+    return tiles
+
+
+def merge_tiles(tiles, piece_lists):
+    """
+    Combines per-tile piece lists (in tile pixels) into one list in image
+    pixels, keeping each piece only from the tile whose core holds its anchor.
+    """
+    merged = []
+    for tile, piece_data in zip(tiles, piece_lists):
+        cx0, cy0, cx1, cy1 = tile.core
+        for piece in offset_pieces(piece_data, tile.box[:2]):
+            x, y = piece[0]
+            if len(tiles) == 1 or (cx0 <= x < cx1 and cy0 <= y < cy1):
+                merged.append(piece)
+    return merged
@@ -0,0 +1,173 @@
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+
+_schedulers = weakref.WeakSet()
+
+
+class BatchingScheduler:
+    """
+    Dynamic micro-batching in front of one model.
+
+    Request handlers submit single images; a dedicated worker thread takes the
+    first waiting request, keeps collecting whatever else arrives within
+    window_ms (up to max_batch images) and runs them as one batched forward
+    pass. Each caller gets its own result back through a Future.
+
+    Calling the scheduler works like calling the YOLO model itself (one image
+    or a list in, a list of Results out), and .names is passed through, so it
+    can be handed to get_squares / get_board / detect_pieces unchanged.
+
+    Args:
+        model: Callable taking a list of images plus keyword arguments
+        max_batch: Largest batch sent to the model
+        window_ms: How long to wait for more requests after the first one
+        max_queue: Images that may wait before submit() blocks (0 for no limit)
+
+    The worker thread starts on the first submit(), and again in a forked
+    child (threads don't survive fork), so a scheduler can be created before
+    a preload-and-fork launcher forks its workers (see serve.py).
+    """
+
+    workers = 1  # one forward pass at a time
+
+    def __init__(self, model, max_batch=8, window_ms=10, name="model", max_queue=0):
+        self.model = model
+        self.max_batch = max_batch
+        self.window = window_ms / 1000.0
+        self.name = name
+        self.max_queue = max_queue
+
+        self.batches = 0
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.started_at = None
+        self._stopping = False
+        self._queue = None
+        self._worker = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        _schedulers.add(self)
+
+    def start(self):
+        with self._lock:
+            if self._worker is not None:
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self.started_at = time.monotonic()
+            self._worker = threading.Thread(target=self._run, name=f"{self.name}-batcher", daemon=True)
+            self._worker.start()
+
+    def _after_fork(self):
+        """In a forked child: drops the parent's (threadless) worker state."""
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._queue = self._worker = self.started_at = None
+        self._stopping = False
+        self.batches = self.items = 0
+        self.busy_seconds = 0.0
+
+    @property
+    def names(self):
+        return self.model.names
+
+    def submit(self, image, **kwargs):
+        """Queues one image (blocking while the queue is full); the Future resolves to that image's Results."""
+        if self._worker is None:
+            self.start()
+        future = Future()
+        self._queue.put((image, kwargs, future))
+        return future
+
+    def __call__(self, source, **kwargs):
+        """Blocking, model-compatible call: returns one Results per image."""
+        images = source if isinstance(source, (list, tuple)) else [source]
+        futures = [self.submit(image, **kwargs) for image in images]
+        return [future.result() for future in futures]
+
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def mean_batch_size(self):
+        with self._stats_lock:
+            return self.items / self.batches if self.batches else 0.0
+
+    def utilization(self):
+        """Fraction of the time since start spent in forward passes."""
+        if self.started_at is None:
+            return 0.0
+        elapsed = time.monotonic() - self.started_at
+        with self._stats_lock:
+            return self.busy_seconds / elapsed if elapsed > 0 else 0.0
+
+    def close(self):
+        """Stops the worker after the requests already queued."""
+        if self._worker is None:
+            return
+        self._queue.put(None)
+        self._worker.join()
+
+    def _collect(self, first):
+        """Gathers requests arriving within the window after the first one."""
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._stopping = True  # finish this batch, then stop
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+
+            # Requests with different inference arguments can't share a forward pass
+            groups = {}
+            for image, kwargs, future in self._collect(first):
+                if future.set_running_or_notify_cancel():
+                    key = repr(sorted(kwargs.items()))
+                    groups.setdefault(key, (kwargs, []))[1].append((image, future))
+
+            for kwargs, items in groups.values():
+                images = [image for image, _ in items]
+                start = time.perf_counter()
+                try:
+                    results = self.model(images, **kwargs)
+                except Exception as e:
+                    for _, future in items:
+                        future.set_exception(e)
+                    continue
+                finally:
+                    with self._stats_lock:
+                        self.busy_seconds += time.perf_counter() - start
+
+                with self._stats_lock:
+                    self.batches += 1
+                    self.items += len(items)
+                for (_, future), result in zip(items, results):
+                    future.set_result(result)
+
+            if self._stopping:
+                return
+
+
+def _reset_after_fork():
+    for scheduler in list(_schedulers):
+        scheduler._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
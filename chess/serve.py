@@ -0,0 +1,223 @@
+"""
+Multi-process production launcher (Linux/macOS): loads and warms the models
+once, then forks worker processes that share the weights copy-on-write.
+
+    python serve.py --workers 8
+
+The parent imports the server with the models unloaded, loads and warms both
+of them (the warmup also fuses the layers, so the fused weights are shared
+too), switches them to inference-only, moves every Python object it has into
+the permanent GC generation (gc.freeze), so the collector in a worker never
+writes to the parent's pages, and only then forks. Until a worker writes to a
+page, the page stays shared with the parent and every other worker, so each
+extra worker costs its own request state, not another copy of the models.
+
+All workers accept on one listening socket and the kernel spreads connections
+between them. Each worker keeps its own calibrations, frame cache and
+/metrics: a session whose request lands on a worker that hasn't seen it yet is
+calibrated from that frame. The parent restarts workers that die and prints
+every process's RSS, PSS and USS (unique memory) from
+/proc/<pid>/smaps_rollup.
+
+Only the torch backend is preloaded: ONNX Runtime and OpenVINO start their own
+thread pools when a model loads, and those threads would not exist in a forked
+child, so with those backends every worker loads its own models after the fork.
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+import cv2
+
+from metrics import process_memory
+from model_registry import freeze_for_inference
+from pipeline import configure_threads
+
+FIRST_REPORT_SECONDS = 10.0  # memory report after the workers have started (and the first requests come in)
+REPORT_INTERVAL = 300.0      # seconds between memory reports; 0 for only the first one
+MIN_UPTIME = 5.0             # a worker that dies sooner than this isn't restarted: something is wrong
+MIB = 1024 * 1024
+
+
+def default_workers():
+    return max(1, (os.cpu_count() or 1) // 2)
+
+
+def preload_models(models):
+    """
+    Loads, warms up and freezes the models in the parent, keeping torch and
+    OpenCV single-threaded meanwhile: an OpenMP or OpenCV thread pool started
+    before fork() would be missing its threads in every worker.
+    """
+    cv2.setNumThreads(1)
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+    for model in models.values():
+        model.warmup = True
+        freeze_for_inference(model.load())
+
+
+def listen(host, port, backlog=128):
+    """Listening socket inherited by every worker."""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(server, sock, torch_threads, opencv_threads, preloaded):
+    """Serves the app on the shared socket in a forked worker; never returns normally."""
+    from werkzeug.serving import make_server
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    gc.enable()
+    configure_threads(torch_threads, opencv_threads)
+    if not preloaded:
+        server.start_loading_models()
+
+    host, port = sock.getsockname()[:2]
+    httpd = make_server(host, port, server.app, threaded=True, fd=sock.fileno())
+    print(f"Worker {os.getpid()} serving on http://{host}:{port}")
+    httpd.serve_forever()
+
+
+def memory_report(parent, workers):
+    """Prints RSS/PSS/USS per process and what the whole group takes."""
+    rows = [("parent", parent)] + [(f"worker {slot}", pid) for pid, (slot, _) in sorted(workers.items())]
+    usage = [(label, pid, process_memory(pid)) for label, pid in rows]
+    if any(memory is None for _, _, memory in usage):
+        print("Memory report needs /proc/<pid>/smaps_rollup (Linux 4.14+)")
+        return
+
+    print(f"{'process':<10} {'pid':>7} {'RSS MiB':>9} {'PSS MiB':>9} {'USS MiB':>9}")
+    for label, pid, memory in usage:
+        print(f"{label:<10} {pid:>7} {memory['rss'] / MIB:>9.1f} {memory['pss'] / MIB:>9.1f} "
+              f"{memory['uss'] / MIB:>9.1f}")
+    worker_uss = [memory['uss'] for _, _, memory in usage[1:]]
+    total = sum(memory['pss'] for _, _, memory in usage)
+    if worker_uss:
+        print(f"{len(worker_uss)} workers, {sum(worker_uss) / len(worker_uss) / MIB:.1f} MiB unique each; "
+              f"{total / MIB:.1f} MiB in total (sum of PSS)")
+
+
+def stop_workers(workers):
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in list(workers):
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+    workers.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: config 'workers', else one per two cores)")
+    parser.add_argument("--host", default=None)
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--report-interval", type=float, default=REPORT_INTERVAL,
+                        help="seconds between memory reports (0: report once)")
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        raise SystemExit("serve.py needs fork() (Linux or macOS); run server.py instead")
+
+    # The launcher does the loading, before any thread exists; the workers have no window
+    os.environ["CHESS_PRELOAD"] = "lazy"
+    os.environ["CHESS_HEADLESS"] = "1"
+    gc.disable()  # no collections while loading: they would only dirty pages the workers will share
+    import server
+
+    config = server.CONFIG
+    count = args.workers or config['workers'] or default_workers()
+    torch_threads = config['torch_threads'] or max(1, (os.cpu_count() or 1) // count)
+    opencv_threads = config['opencv_threads'] or 1
+    preloaded = config['model_backend'] == 'torch'
+
+    if preloaded:
+        start = time.perf_counter()
+        try:
+            preload_models(server.MODELS)
+        except RuntimeError as e:
+            raise SystemExit(str(e))
+        print(f"Models loaded and frozen in {time.perf_counter() - start:.1f} s")
+    else:
+        print(f"{config['model_backend']} models are loaded by each worker after the fork")
+
+    sock = listen(args.host or config['host'], args.port or config['port'])
+    gc.collect()
+    gc.freeze()
+
+    stopping = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    workers = {}  # pid -> (slot, started_at)
+
+    def spawn(slot):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                run_worker(server, sock, torch_threads, opencv_threads, preloaded)
+                code = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                os._exit(code)
+        workers[pid] = (slot, time.monotonic())
+
+    print(f"Starting {count} workers, {torch_threads} torch threads each")
+    for slot in range(count):
+        spawn(slot)
+
+    next_report = time.monotonic() + FIRST_REPORT_SECONDS
+    try:
+        while not stopping:
+            time.sleep(0.5)
+            while workers:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+                if pid == 0:
+                    break
+                slot, started_at = workers.pop(pid)
+                print(f"Worker {slot} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}")
+                if stopping:
+                    continue
+                if time.monotonic() - started_at < MIN_UPTIME:
+                    print(f"Worker {slot} died within {MIN_UPTIME:.0f} s of starting; shutting down")
+                    stopping = True
+                else:
+                    spawn(slot)
+            if not stopping and next_report is not None and time.monotonic() >= next_report:
+                memory_report(os.getpid(), workers)
+                next_report = time.monotonic() + args.report_interval if args.report_interval > 0 else None
+    finally:
+        stop_workers(workers)
+        sock.close()
+
+
+if __name__ == "__main__":
+    main()
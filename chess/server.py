@@ -1,34 +1,362 @@
-import os, io, base64, threading
-from flask import Flask, request, send_file, jsonify
-import cv2
-import numpy as np
-from testing import get_squares
+import os, io, threading, time, uuid, zipfile
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request, send_file, jsonify, Response, g
+from testing import label_detections_with_fit
 from piece_square import assign_pieces_to_squares
-from ultralytics import YOLO
+from square_lookup import SquareLookup
 import json
 from piece_square import get_fen_from_board_state
-import tkinter as tk
-from fen_to_board import ChessboardApp
+from calibration import CalibrationStore
+from postprocess import piece_detections, square_detections
+from incremental import update_position
+from square_classifier import classify_board
+from scheduler import BatchingScheduler
+from model_registry import load_model, LazyModel
+from responses import get_response_mode, start_render, build_response, ENCODE_POOL
+from ingest import decode_upload, decode_buffer, squares_to_original, pieces_to_original, homography_to_original
+from config import load_config
+from pipeline import Stage, configure_threads
+from frame_cache import FrameCache, CachedResult
+from multiboard import find_boards, BoardIds, MAX_BOARDS
+from roi import board_region, crop, tile_region, merge_tiles
+from metrics import (REGISTRY, REQUEST_SECONDS, REQUESTS, SQUARES_PER_FRAME, PIECES_PER_FRAME,
+                     SQUARE_COUNT_MISMATCH, QUEUE_DEPTH, MEAN_BATCH_SIZE, MODEL_LOAD_SECONDS, FRAME_CACHE_LOOKUPS,
+                     STAGE_BUSY_SECONDS, STAGE_WORKERS, STAGE_UTILIZATION, STAGE_QUEUE_DEPTH,
+                     PROCESS_MEMORY, process_memory, span, submit, start_request_timings, server_timing_header)
 
-# Global variables for the board visualization
+# Model paths, backend, thresholds and server options (see config.py)
+CONFIG = load_config()
+HEADLESS = CONFIG['headless']
+
+# Global variables for the board visualization (unused when headless)
 board_app = None
 board_root = None
-import time
 
 app = Flask(__name__)
-SQUARE_DATA = []
+
+# Square grids from /detect, keyed by client/board session id
+CALIBRATIONS = CalibrationStore(max_entries=128, ttl=30 * 60)
+DEFAULT_SESSION_ID = "default"
+
+# Results for recently seen frames, reused when a client resubmits (almost) the
+# same photo: retries after a timeout, double taps, a board that hasn't changed
+FRAME_CACHE = (FrameCache(CONFIG['frame_cache_entries'], CONFIG['frame_cache_ttl'],
+                          CONFIG['frame_cache_max_change'])
+               if CONFIG['frame_cache_entries'] > 0 else None)
+
+# /multi-analyze: board ids per session, kept stable from frame to frame
+BOARD_IDS = BoardIds(max_sessions=128, ttl=30 * 60)
+
+# Worker threads for running the board and piece models side by side
+INFERENCE_POOL = ThreadPoolExecutor(max_workers=CONFIG['inference_workers'], thread_name_prefix="inference")
+PIECE_CONF_THRESHOLD = CONFIG['piece_conf_threshold']
+
+# Piece model input size; with a known square grid it only sees the board
+# region, split into tiles when that is much larger than its input (see roi.py)
+PIECE_IMGSZ = CONFIG['piece_imgsz']
+PIECE_ROI = CONFIG['piece_roi']
+PIECE_TILE_SIDE = int(PIECE_IMGSZ * CONFIG['piece_tile_scale'])
+
+# /batch-analyze: images per forward pass, and which zip members count as images
+DEFAULT_BATCH_SIZE = 8
+MAX_BATCH_SIZE = 32
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+# Micro-batching: requests arriving within this window share one forward pass
+BATCH_WINDOW_MS = CONFIG['batch_window_ms']
+MAX_BATCH = CONFIG['max_batch']
+
+# Pipeline stages: decode and annotate/encode run on their own worker threads
+# behind bounded queues, so they overlap with the models' forward passes across
+# requests; intra-op threads are capped so the stages don't fight over cores
+STAGE_QUEUE_SIZE = CONFIG['stage_queue_size']
+configure_threads(CONFIG['torch_threads'], CONFIG['opencv_threads'])
+DECODE_STAGE = Stage("decode", CONFIG['decode_workers'], STAGE_QUEUE_SIZE)
+ENCODE_POOL.configure(CONFIG['encode_workers'], STAGE_QUEUE_SIZE)
 
 # Model paths
-BOARD_MODEL_PATH = os.path.abspath(r"E:\CHESS_OTB\chess\boardfinder.v3i.yolov11\runs\detect\train\weights\best.pt")
-PIECE_MODEL_PATH = os.path.abspath(r"E:\CHESS_OTB\otbv5_finetune2\weights\best.pt")
+BOARD_MODEL_PATH = os.path.abspath(CONFIG['board_model_path'])
+PIECE_MODEL_PATH = os.path.abspath(CONFIG['piece_model_path'])
+
+# Inference backend for the board and piece models: 'torch', 'onnx' or 'openvino'
+# (exported next to the .pt files on first use; see model_registry.py)
+MODEL_BACKEND = CONFIG['model_backend']
+MODEL_INT8 = CONFIG['model_int8']
+
+# Optional 13-class per-square classifier (see square_classifier.py), loaded on first use
+SQUARE_CLASSIFIER_PATH = os.path.abspath(CONFIG['square_classifier_path'])
+square_classifier = None
+square_classifier_lock = threading.Lock()
+
+
+def open_model(path):
+    """Loads one detection model through the configured backend and device."""
+    model = load_model(path, MODEL_BACKEND, MODEL_INT8)
+    if CONFIG['device'] and MODEL_BACKEND == 'torch':
+        model.to(CONFIG['device'])
+    return model
+
+
+# Models load on first use, in the background or right here depending on
+# CONFIG['preload']; /ready reports when both are loaded and warmed up
+board_model = LazyModel(lambda: open_model(BOARD_MODEL_PATH), name="board", warmup=CONFIG['warmup'])
+piece_model = LazyModel(lambda: open_model(PIECE_MODEL_PATH), name="piece", warmup=CONFIG['warmup'])
+MODELS = {'board': board_model, 'piece': piece_model}
+
+# Every handler goes through these, so concurrent requests share forward passes
+board_scheduler = BatchingScheduler(board_model, MAX_BATCH, BATCH_WINDOW_MS, name="board", max_queue=STAGE_QUEUE_SIZE)
+piece_scheduler = BatchingScheduler(piece_model, MAX_BATCH, BATCH_WINDOW_MS, name="piece", max_queue=STAGE_QUEUE_SIZE)
+
+
+def start_loading_models():
+    """Starts (or, for preload=eager, finishes) loading the models per CONFIG['preload']."""
+    for model in MODELS.values():
+        if CONFIG['preload'] == 'eager':
+            try:
+                model.load()
+            except RuntimeError:
+                pass  # reported by LazyModel; /ready shows the failure
+        else:
+            model.load_in_background()
+
+
+if CONFIG['preload'] != 'lazy':
+    start_loading_models()
+
+# Scrape-time gauges for /metrics
+SCHEDULERS = {'board': board_scheduler, 'piece': piece_scheduler}
+QUEUE_DEPTH.set_function(lambda: {(name, ): s.queue_depth() for name, s in SCHEDULERS.items()})
+MEAN_BATCH_SIZE.set_function(lambda: {(name, ): s.mean_batch_size() for name, s in SCHEDULERS.items()})
+MODEL_LOAD_SECONDS.set_function(lambda: {
+    (name, phase): seconds
+    for name, model in MODELS.items()
+    for phase, seconds in (('load', model.load_seconds), ('warmup', model.warmup_seconds))})
+STAGES = {'decode': DECODE_STAGE, 'board_model': board_scheduler, 'piece_model': piece_scheduler,
+          'encode': ENCODE_POOL}
+STAGE_BUSY_SECONDS.set_function(lambda: {(name, ): s.busy_seconds for name, s in STAGES.items()})
+STAGE_WORKERS.set_function(lambda: {(name, ): s.workers for name, s in STAGES.items()})
+STAGE_UTILIZATION.set_function(lambda: {(name, ): s.utilization() for name, s in STAGES.items()})
+STAGE_QUEUE_DEPTH.set_function(lambda: {(name, ): s.queue_depth() for name, s in STAGES.items()})
+PROCESS_MEMORY.set_function(lambda: {(kind, ): value for kind, value in (process_memory() or {}).items()})
+
+
+def get_session_id():
+    """Reads the session id from the form field or X-Session-ID header."""
+    return (request.form.get('session_id')
+            or request.headers.get('X-Session-ID')
+            or DEFAULT_SESSION_ID)
+
+
+def read_image(file):
+    """
+    Decodes an uploaded image on the decode stage, through the shared
+    ingestion path (see ingest.py), and records its size and decode time for
+    the response headers.
+
+    Returns:
+        DecodedImage; .image is None if the upload could not be decoded
+    """
+    upload = submit(DECODE_STAGE, timed_decode, decode_upload, file).result()
+    g.ingest = upload
+    return upload
+
+
+def timed_decode(decode, data):
+    with span('decode'):
+        return decode(data)
+
+
+def lookup_frame(scope, upload, calibration):
+    """
+    Looks a decoded frame up in the frame cache.
+
+    Args:
+        scope: (endpoint, session id, ...) the result must have been cached under
+        calibration: The session's current calibration; results computed
+            against any other calibration don't count
+
+    Returns:
+        CachedResult or None; always None when the cache is off or the client
+        sent cache=0, and a miss when there is no fitted grid to compare on
+    """
+    if FRAME_CACHE is None or request.values.get('cache') == '0':
+        return None
+    signature = frame_signature(upload, calibration) if calibration is not None else None
+    cached = FRAME_CACHE.get(scope, signature, frame_size(upload), calibration) if signature is not None else None
+    g.frame_cache = 'hit' if cached is not None else 'miss'
+    FRAME_CACHE_LOOKUPS.inc(endpoint=scope[0], result=g.frame_cache)
+    return cached
+
+
+def remember_frame(scope, upload, result):
+    """Caches a result under the frame's board signature for the calibration it was computed with."""
+    if FRAME_CACHE is None or request.values.get('cache') == '0':
+        return
+    signature = frame_signature(upload, result.calibration)
+    if signature is not None:
+        FRAME_CACHE.put(scope, signature, frame_size(upload), result)
+
+
+def frame_signature(upload, calibration):
+    """The frame's board signature under a calibration, computed once per request and calibration."""
+    cached = g.get('frame_signature')
+    if cached is not None and cached[0] is calibration:
+        return cached[1]
+    with span('frame_signature'):
+        signature = FRAME_CACHE.signature(upload.image, calibration, upload.scale)
+    g.frame_signature = (calibration, signature)
+    return signature
+
+
+def frame_size(upload):
+    return upload.original_size, upload.image.shape[:2]
+
+
+def calibrate(session_id, image, scale=1.0):
+    """
+    Runs the board model on an image and caches the square grid for the session.
+
+    Args:
+        scale: Original pixels per pixel of image; the cached grid and
+            homography are always in original-image pixels
+    """
+    square_data, fit = find_squares_batch([image])[0]
+    height, width = image.shape[:2]
+    homography = fit.homography if fit is not None else None
+    return CALIBRATIONS.put(session_id, squares_to_original(square_data, scale),
+                            homography_to_original(homography, scale),
+                            image_size=(int(round(width * scale)), int(round(height * scale))))
+
+
+def find_squares_batch(images, expected_squares=64):
+    """
+    Runs the board model over a list of images in one pass and fits each
+    image's square grid (like testing.get_board, with each step timed).
+
+    Returns:
+        One (square_data, fit) per image
+    """
+    with span('board_inference'):
+        results = board_scheduler(list(images))
+
+    boards = []
+    for result in results:
+        detections = square_detections(result, board_scheduler.names, "square", top_k=expected_squares)
+        SQUARES_PER_FRAME.observe(len(detections))
+        if len(detections) != expected_squares:
+            SQUARE_COUNT_MISMATCH.inc()
+        with span('lattice'):
+            boards.append(label_detections_with_fit(detections))
+    return boards
+
+
+def get_square_classifier():
+    """Loads the per-square crop classifier the first time it is needed."""
+    global square_classifier
+    with square_classifier_lock:
+        if square_classifier is None:
+            if not os.path.exists(SQUARE_CLASSIFIER_PATH):
+                raise FileNotFoundError(f"No square classifier at {SQUARE_CLASSIFIER_PATH}")
+            square_classifier = load_model(SQUARE_CLASSIFIER_PATH, task='classify')
+        return square_classifier
+
+
+def detect_pieces(image, conf_threshold=PIECE_CONF_THRESHOLD, scale=1.0, squares=None):
+    """
+    Runs the piece model on an image.
+
+    Args:
+        squares: The board's square grid in original-image pixels; when given
+            (and piece_roi is on) only the board region is looked at
+
+    Returns:
+        List of ((x, y), piece_type, conf) tuples, anchored in the lower
+        quarter of each box, in original-image pixels
+    """
+    if squares is None or not PIECE_ROI:
+        return pieces_to_original(detect_pieces_batch([image], conf_threshold)[0], scale)
+    height, width = image.shape[:2]
+    region = board_region(squares, (width, height), scale=scale)
+    return pieces_to_original(detect_pieces_in_regions(image, [region], conf_threshold)[0], scale)
+
+
+def detect_pieces_in_regions(image, regions, conf_threshold=PIECE_CONF_THRESHOLD):
+    """
+    Runs the piece model on board regions instead of the whole image, tiling
+    regions much larger than its input; every tile of every region goes
+    through in one batch.
+
+    Returns:
+        One piece list per region, in image pixels
+    """
+    plans = [tile_region(region, PIECE_TILE_SIDE) for region in regions]
+    tiles = [tile for plan in plans for tile in plan]
+    piece_lists = iter(detect_pieces_batch([crop(image, tile.box) for tile in tiles], conf_threshold))
+    return [merge_tiles(plan, [next(piece_lists) for _ in plan]) for plan in plans]
+
+
+def detect_pieces_batch(images, conf_threshold=PIECE_CONF_THRESHOLD):
+    """Runs the piece model once over a list of images; returns one piece list per image."""
+    with span('piece_inference'):
+        results = piece_scheduler(list(images), imgsz=PIECE_IMGSZ)
+        piece_lists = [piece_detections(result, piece_scheduler.names, conf_threshold, with_conf=True)
+                       for result in results]
+    for piece_data in piece_lists:
+        PIECES_PER_FRAME.observe(len(piece_data))
+    return piece_lists
+
+
+def update_board_view(fen):
+    """Queues a FEN update on the Tkinter board window, creating it if needed."""
+    if HEADLESS:
+        return
+    try:
+        global board_app, board_root
+        if board_app is None or not board_root or not board_root.winfo_exists():
+            # Initialize Tkinter window if not exists
+            import tkinter as tk
+            from fen_to_board import ChessboardApp
+            board_root = tk.Tk()
+            board_app = ChessboardApp(board_root)
+            print("Created new board visualization window")
+
+        # Hand the FEN to the viewer's queue; its Tk timer draws the latest one
+        board_app.submit_fen(fen)
+        print(f"FEN update queued successfully: {fen}")
+    except Exception as e:
+        print(f"Error updating board visualization: {e}")
+
+@app.before_request
+def before_request():
+    """Assigns a request id (the client's X-Request-ID if it sent a sane one) and starts timing."""
+    request_id = request.headers.get('X-Request-ID', '')
+    if not (0 < len(request_id) <= 64 and request_id.replace('-', '').isalnum()):
+        request_id = uuid.uuid4().hex[:16]
+    g.request_id = request_id
+    g.request_start = time.perf_counter()
+    g.timings = start_request_timings()
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus text exposition of the stage histograms, counters and gauges."""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """
+    Readiness probe: 200 once both models are loaded and warmed up, 503 while
+    they are loading (or failed). Starts loading if nothing has asked yet, and
+    retries a failed load once its backoff has passed.
+    """
+    if not all(model.ready for model in MODELS.values()):
+        for model in MODELS.values():
+            model.load_in_background()
+    models = {name: model.status() for name, model in MODELS.items()}
+    is_ready = all(model.ready for model in MODELS.values())
+    return jsonify({'ready': is_ready, 'backend': MODEL_BACKEND, 'models': models}), 200 if is_ready else 503
 
-# Pre-load models
-try:
-    board_model = YOLO(BOARD_MODEL_PATH)
-    piece_model = YOLO(PIECE_MODEL_PATH)
-    print(f"Models loaded successfully from:\n{BOARD_MODEL_PATH}\n{PIECE_MODEL_PATH}")
-except Exception as e:
-    print(f"Error loading models: {e}")
 
 @app.route("/detect", methods=["POST"])
 def detect():
@@ -36,163 +364,491 @@ def detect():
         return jsonify({"error": "No image file provided"}), 400
     
     file = request.files['image']
-    
     try:
-        
-        # Read image from in-memory buffer
-        in_memory_file = io.BytesIO()
-        file.save(in_memory_file)
-        in_memory_file.seek(0)
-        file_bytes = np.frombuffer(in_memory_file.read(), np.uint8)
-        image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+        mode = get_response_mode(request.form, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        # Decode straight from the upload buffer, reduced in size for large photos
+        upload = read_image(file)
+        image = upload.image
 
         if image is None:
             return jsonify({"error": "Could not decode image"}), 400
 
-        # Get squares from the image data using the pre-loaded model
-        global SQUARE_DATA
-        square_data = get_squares(board_model, image)
-        SQUARE_DATA = square_data
-
-        # Annotate image with squares
-        for square_name, center in square_data:
-            # Draw circle at square center
-            cv2.circle(image, center, 5, (0, 0, 255), -1)  # Red dot for square center
-            # Draw square name
-            cv2.putText(image, square_name, (center[0] - 10, center[1] - 10),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)  # Red text for square name
-        
-        # Encode the annotated image to a buffer
-        _, buffer = cv2.imencode('.jpg', image)
-        
+        # Get squares from the image data and cache them for this session
+        session_id = get_session_id()
+        calibration = calibrate(session_id, image, upload.scale)
+        square_data = calibration.squares
+
+        # Annotate and encode in the background, only if this mode returns a picture
+        render_future = start_render(mode, image, square_data, image_scale=upload.scale)
+
         # Convert square data to JSON-serializable format
-        json_square_data = []
-        for square_name, center in square_data:
-            json_square_data.append({
-                "square": square_name,
-                "center": {"x": int(center[0]), "y": int(center[1])}
-            })
+        json_square_data = calibration.squares_to_json()
 
         # Save to JSON file
         output_file = "detected_square.json"
         with open(output_file, 'w') as f:
             json.dump(json_square_data, f, indent=2)
 
-        # Prepare the response with both image and square data
+        # Prepare the response with the square data (and the image, depending on the mode)
         response_data = {
+            'session_id': session_id,
             'squares': json_square_data,
-            'image': 'data:image/jpeg;base64,' + base64.b64encode(buffer).decode('utf-8')
         }
-        
-        return jsonify(response_data)
+
+        return build_response(mode, response_data, render_future, calibration.image_size, square_data)
 
     except Exception as e:
-        app.logger.error(f"Error during detection: {e}")
+        app.logger.error(f"[{g.request_id}] Error during detection: {e}")
         return jsonify({"error": "An internal server error occurred"}), 500
 
 @app.route("/piece-detect", methods=["POST"])
 def piece_detect():
-    global SQUARE_DATA  # Declare global at the start of the function
-    
     if 'image' not in request.files:
         return jsonify({"error": "No image file provided"}), 400
     
     file = request.files['image']
     try:
-        # Read image from in-memory buffer
-        in_memory_file = io.BytesIO()
-        file.save(in_memory_file)
-        in_memory_file.seek(0)
-        file_bytes = np.frombuffer(in_memory_file.read(), np.uint8)
-        image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+        mode = get_response_mode(request.form, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        # Decode straight from the upload buffer, reduced in size for large photos
+        upload = read_image(file)
+        image = upload.image
 
         if image is None:
             return jsonify({"error": "Could not decode image"}), 400
 
-        # Detect pieces using the pre-loaded model
-        results = piece_model(image)
-
-        # Extract piece data
-        piece_data = []
-        for result in results:
-            for box in result.boxes:
-                conf = float(box.conf[0])
-                cls_id = int(box.cls[0])
-                if conf > 0.5:  # Confidence threshold
-                    x1, y1, x2, y2 = map(int, box.xyxy[0])
-                    center_x = int((x1 + x2) // 2)
-                    center_y = int(y2 - (y2 - y1) // 4)
-                    piece_type = piece_model.names[cls_id]
-                    piece_data.append(((center_x, center_y), piece_type))
-                    
-                    # Draw detection on image
-                    cv2.circle(image, (center_x, center_y), 5, (0, 255, 0), -1)
-                    cv2.putText(image, piece_type, (center_x - 20, center_y - 10),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
-        # Get piece positions on the board
-        board_state = assign_pieces_to_squares(SQUARE_DATA, piece_data)
-        fen = get_fen_from_board_state(board_state)
+        # Use the session's cached square grid; only run the board model when
+        # there is no calibration yet or the client asks for a fresh one
+        session_id = get_session_id()
+        calibration = CALIBRATIONS.get(session_id)
+        recalibrate = calibration is None or request.form.get('recalibrate') == '1'
+
+        # Same photo as a moment ago, against the same grid: answer from the cache
+        scope = ('/piece-detect', session_id, request.form.get('mode'))
+        cached = lookup_frame(scope, upload, None if recalibrate else calibration)
+        if cached is not None:
+            render_future = start_render(mode, image, piece_data=cached.piece_data, image_scale=upload.scale)
+            return build_response(mode, dict(cached.payload), render_future, upload.original_size,
+                                  piece_data=cached.piece_data)
+
+        if recalibrate:
+            calibration = calibrate(session_id, image, upload.scale)
+
+        if request.form.get('mode') == 'crops':
+            # Classify 64 rectified square crops in one batch instead of running the detector
+            if calibration.homography is None:
+                return jsonify({"error": "Crop mode needs a fitted board grid; retake the calibration photo"}), 422
+            try:
+                classifier = get_square_classifier()
+            except FileNotFoundError as e:
+                return jsonify({"error": str(e)}), 501
+            with span('crop_classifier'):
+                board_state = classify_board(classifier, image, calibration, scale=upload.scale)
+            piece_data = [(center, board_state[name]) for name, center in calibration.squares if board_state[name]]
+        else:
+            # Detect pieces using the pre-loaded model
+            piece_data = detect_pieces(image, scale=upload.scale, squares=calibration.squares)
+
+            # Get piece positions on the board
+            with span('assign'):
+                board_state = assign_pieces_to_squares(calibration.squares, piece_data, calibration.lookup)
+        render_future = start_render(mode, image, piece_data=piece_data, image_scale=upload.scale)
+        with span('fen'):
+            fen = get_fen_from_board_state(board_state)
         print(f"Generated FEN: {fen}")
 
         # Update the board visualization with the new FEN
-        try:
-            global board_app, board_root
-            if board_app is None or not board_root or not board_root.winfo_exists():
-                # Initialize Tkinter window if not exists
-                board_root = tk.Tk()
-                board_app = ChessboardApp(board_root)
-                print("Created new board visualization window")
-            
-            # Queue the FEN update in the main thread
-            board_root.after(0, lambda: board_app.load_fen(fen))
-            print(f"FEN update queued successfully: {fen}")
-        except Exception as e:
-            print(f"Error updating board visualization: {e}")
+        update_board_view(fen)
+
+        # Return the board state (and the image, depending on the mode)
+        response = {
+            'session_id': session_id,
+            'board_state': board_state.to_list(),
+            'fen_string': fen,
+        }
+        remember_frame(scope, upload, CachedResult(dict(response), None, piece_data, calibration))
+
+        return build_response(mode, response, render_future, upload.original_size, piece_data=piece_data)
 
-        # Encode the annotated image to a buffer
-        _, buffer = cv2.imencode('.jpg', image)
+    except Exception as e:
+        app.logger.error(f"[{g.request_id}] Error during piece detection: {e}")
+        return jsonify({"error": "An internal server error occurred"}), 500
+
+
+@app.route("/analyze", methods=["POST"])
+def analyze():
+    """
+    Single round trip: decodes the upload once, runs the board and piece models
+    concurrently and returns squares, board state and FEN together.
+    """
+    if 'image' not in request.files:
+        return jsonify({"error": "No image file provided"}), 400
+
+    file = request.files['image']
+    try:
+        mode = get_response_mode(request.form, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        # Decode straight from the upload buffer, reduced in size for large photos
+        upload = read_image(file)
+        image = upload.image
+
+        if image is None:
+            return jsonify({"error": "Could not decode image"}), 400
+
+        # Same photo as a moment ago, and the grid it produced is still the
+        # session's calibration: answer from the cache
+        session_id = get_session_id()
+        scope = ('/analyze', session_id)
+        cached = lookup_frame(scope, upload, CALIBRATIONS.get(session_id))
+        if cached is not None:
+            render_future = start_render(mode, image, cached.square_data, cached.piece_data, upload.scale)
+            return build_response(mode, dict(cached.payload), render_future, cached.calibration.image_size,
+                                  cached.square_data, cached.piece_data)
+
+        # Run both models side by side on the same decoded frame
+        calibration_future = submit(INFERENCE_POOL, calibrate, session_id, image, upload.scale)
+        pieces_future = submit(INFERENCE_POOL, detect_pieces, image, PIECE_CONF_THRESHOLD, upload.scale)
+        calibration = calibration_future.result()
+        piece_data = pieces_future.result()
+
+        # Annotate once with both squares and pieces, off the request thread
+        render_future = start_render(mode, image, calibration.squares, piece_data, upload.scale)
+
+        with span('assign'):
+            board_state = assign_pieces_to_squares(calibration.squares, piece_data, calibration.lookup)
+        with span('fen'):
+            fen = get_fen_from_board_state(board_state)
+        print(f"Generated FEN: {fen}")
+        update_board_view(fen)
 
-        # Return both the image and the board state
         response = {
-            'board_state': board_state,
+            'session_id': session_id,
+            'squares': calibration.squares_to_json(),
+            'board_state': board_state.to_list(),
             'fen_string': fen,
-            'image': 'data:image/jpeg;base64,' + base64.b64encode(buffer).decode('utf-8')
         }
+        remember_frame(scope, upload,
+                       CachedResult(dict(response), calibration.squares, piece_data, calibration))
+        return build_response(mode, response, render_future, calibration.image_size,
+                              calibration.squares, piece_data)
+
+    except Exception as e:
+        app.logger.error(f"[{g.request_id}] Error during analysis: {e}")
+        return jsonify({"error": "An internal server error occurred"}), 500
 
-        # Return the response as JSON
-        return jsonify(response)
+@app.route("/multi-analyze", methods=["POST"])
+def multi_analyze():
+    """
+    Several boards in one photo: groups the square detections into boards,
+    fits each board's grid, runs the piece model once over all the board crops
+    and returns a FEN per board under an id that stays the same across frames.
+    """
+    if 'image' not in request.files:
+        return jsonify({"error": "No image file provided"}), 400
+
+    file = request.files['image']
+    try:
+        mode = get_response_mode(request.form, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        # Decode straight from the upload buffer, reduced in size for large photos
+        upload = read_image(file)
+        image = upload.image
+
+        if image is None:
+            return jsonify({"error": "Could not decode image"}), 400
+
+        # Every square of every board, not just the 64 best
+        with span('board_inference'):
+            result = board_scheduler([image], max_det=(MAX_BOARDS + 1) * 64)[0]
+        detections = square_detections(result, board_scheduler.names, "square")
+        SQUARES_PER_FRAME.observe(len(detections))
+        with span('lattice'):
+            boards = find_boards(detections)
+        if not boards:
+            return jsonify({"error": "No board found; make sure whole boards are in the picture"}), 422
+
+        # One batched piece pass over the board crops
+        height, width = image.shape[:2]
+        regions = [board_region(square_data, (width, height)) for square_data, _ in boards]
+        piece_lists = detect_pieces_in_regions(image, regions)
+
+        session_id = get_session_id()
+        original_regions = [tuple(int(round(v * upload.scale)) for v in region) for region in regions]
+        board_ids = BOARD_IDS.match(session_id, original_regions)
+
+        results, all_squares, all_pieces = [], [], []
+        for board_id, region, (square_data, fit), piece_data in zip(board_ids, original_regions, boards, piece_lists):
+            square_data = squares_to_original(square_data, upload.scale)
+            piece_data = pieces_to_original(piece_data, upload.scale)
+            lookup = SquareLookup(square_data, homography_to_original(fit.homography, upload.scale))
+            with span('assign'):
+                board_state = assign_pieces_to_squares(square_data, piece_data, lookup)
+            with span('fen'):
+                fen = get_fen_from_board_state(board_state)
+            results.append({
+                'board_id': board_id,
+                'region': dict(zip(('x0', 'y0', 'x1', 'y1'), region)),
+                'squares': [
+                    {"square": square_name, "center": {"x": int(center[0]), "y": int(center[1])}}
+                    for square_name, center in square_data
+                ],
+                'board_state': board_state.to_list(),
+                'fen_string': fen,
+            })
+            all_squares.extend(square_data)
+            all_pieces.extend(piece_data)
+        print(f"Generated {len(results)} FENs: " + ", ".join(f"{r['board_id']} {r['fen_string']}" for r in results))
+
+        render_future = start_render(mode, image, all_squares, all_pieces, upload.scale)
+        response = {'session_id': session_id, 'boards': results}
+        return build_response(mode, response, render_future, upload.original_size, all_squares, all_pieces)
 
     except Exception as e:
-        app.logger.error(f"Error during piece detection: {e}")
+        app.logger.error(f"[{g.request_id}] Error during multi-board analysis: {e}")
         return jsonify({"error": "An internal server error occurred"}), 500
 
 
+def collect_uploaded_images():
+    """
+    Collects every uploaded image from repeated 'images' fields and/or a zip
+    in 'archive'. Only the encoded uploads are kept; zip members are
+    decompressed one at a time while the response streams.
+
+    Returns:
+        (images, archive): images is a list of (name, read) pairs where read()
+        returns the encoded bytes; archive is the open ZipFile (or None),
+        which the caller closes once every image has been read
+
+    Raises:
+        zipfile.BadZipFile: The archive is not a zip file
+    """
+    images = [(file.filename, (lambda data=file.read(): data)) for file in request.files.getlist('images')]
+    archive = None
+    upload = request.files.get('archive')
+    if upload is not None:
+        archive = zipfile.ZipFile(io.BytesIO(upload.read()))
+        images.extend((info.filename, (lambda info=info: archive.read(info)))
+                      for info in archive.infolist()
+                      if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS))
+    return images, archive
+
+
+def iter_batches(items, batch_size):
+    """Groups an iterable into lists of at most batch_size items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def analyze_batch(batch):
+    """
+    Decodes one batch of uploads and runs both models over it in batched passes.
+    Yields one result dict per image; decode failures are reported first.
+    """
+    # Decode the whole batch side by side on the decode stage
+    decoding = [(name, submit(DECODE_STAGE, timed_decode, decode_buffer, read())) for name, read in batch]
+
+    names, images, scales = [], [], []
+    for name, future in decoding:
+        upload = future.result()
+        if upload.image is None:
+            yield {'name': name, 'error': 'Could not decode image'}
+            continue
+        names.append(name)
+        images.append(upload.image)
+        scales.append(upload.scale)
+
+    if not images:
+        return
+
+    squares_future = submit(INFERENCE_POOL, find_squares_batch, images)
+    pieces_future = submit(INFERENCE_POOL, detect_pieces_batch, images)
+    try:
+        boards = squares_future.result()
+        piece_lists = pieces_future.result()
+    except Exception as e:
+        app.logger.error(f"Error during batch inference: {e}")
+        for name in names:
+            yield {'name': name, 'error': 'Could not analyse image'}
+        return
+
+    for name, scale, (square_data, fit), piece_data in zip(names, scales, boards, piece_lists):
+        try:
+            square_data = squares_to_original(square_data, scale)
+            piece_data = pieces_to_original(piece_data, scale)
+            homography = homography_to_original(fit.homography if fit is not None else None, scale)
+            with span('assign'):
+                board_state = assign_pieces_to_squares(square_data, piece_data,
+                                                       SquareLookup(square_data, homography))
+            with span('fen'):
+                fen = get_fen_from_board_state(board_state)
+            yield {
+                'name': name,
+                'squares': [
+                    {"square": square_name, "center": {"x": int(center[0]), "y": int(center[1])}}
+                    for square_name, center in square_data
+                ],
+                'board_state': board_state.to_list(),
+                'fen_string': fen,
+            }
+        except Exception as e:
+            app.logger.error(f"Error analysing {name}: {e}")
+            yield {'name': name, 'error': 'Could not analyse image'}
+
+
+@app.route("/position-update", methods=["POST"])
+def position_update():
+    """
+    Live-game update: compares the new photo with the session's last rectified
+    board and only re-classifies squares whose pixels changed. Returns the new
+    FEN plus the inferred move.
+    """
+    if 'image' not in request.files:
+        return jsonify({"error": "No image file provided"}), 400
+
+    file = request.files['image']
+    try:
+        # Decode straight from the upload buffer, reduced in size for large photos
+        upload = read_image(file)
+        image = upload.image
+
+        if image is None:
+            return jsonify({"error": "Could not decode image"}), 400
+
+        session_id = get_session_id()
+        calibration = CALIBRATIONS.get(session_id)
+        if calibration is None or request.form.get('recalibrate') == '1':
+            calibration = calibrate(session_id, image, upload.scale)
+        if calibration.homography is None:
+            return jsonify({"error": "Board grid could not be fitted; retake the calibration photo"}), 422
+
+        with span('position_update'):
+            update = update_position(piece_scheduler, image, calibration,
+                                     lambda frame: detect_pieces(frame, scale=upload.scale, squares=calibration.squares),
+                                     scale=upload.scale)
+        fen = update['fen_string']
+        print(f"Generated FEN: {fen} (move: {update['move']})")
+        update_board_view(fen)
+
+        return jsonify({
+            'session_id': session_id,
+            'board_state': update['board_state'].to_list(),
+            'fen_string': fen,
+            'move': update['move'],
+            'changed_squares': update['changed_squares'],
+            'full_pass': update['full_pass'],
+        })
+
+    except Exception as e:
+        app.logger.error(f"[{g.request_id}] Error during position update: {e}")
+        return jsonify({"error": "An internal server error occurred"}), 500
+
+
+@app.route("/batch-analyze", methods=["POST"])
+def batch_analyze():
+    """
+    Analyses many photos in one request and streams one JSON line per image
+    (application/x-ndjson) as each batch finishes.
+    """
+    if 'images' not in request.files and 'archive' not in request.files:
+        return jsonify({"error": "No images or archive provided"}), 400
+
+    try:
+        batch_size = int(request.form.get('batch_size', DEFAULT_BATCH_SIZE))
+    except ValueError:
+        return jsonify({"error": "batch_size must be an integer"}), 400
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+
+    try:
+        uploads, archive = collect_uploaded_images()
+    except zipfile.BadZipFile:
+        return jsonify({"error": "archive is not a valid zip file"}), 400
+
+    def generate():
+        try:
+            for batch in iter_batches(uploads, batch_size):
+                for item in analyze_batch(batch):
+                    yield json.dumps(item) + "\n"
+        except Exception as e:
+            app.logger.error(f"Error during batch analysis: {e}")
+            yield json.dumps({"error": "An internal server error occurred"}) + "\n"
+        finally:
+            if archive is not None:
+                archive.close()  # only now: the last batch reads its members while streaming
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
 
 # Enable CORS
 @app.after_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, X-Session-ID, X-Request-ID, X-Timing')
     response.headers.add('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+
+    # Request id, timing and per-stage breakdown
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    if endpoint != "/metrics" and 'request_start' in g:
+        status = str(response.status_code)
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint, status=status)
+        REQUESTS.inc(endpoint=endpoint, status=status)
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+        response.headers.add('Access-Control-Expose-Headers', 'X-Request-ID, Server-Timing')
+    if g.get('timings') and (CONFIG['timing_header'] or request.headers.get('X-Timing') == '1'):
+        response.headers['Server-Timing'] = server_timing_header(g.timings)
+
+    # Ingestion stats for the uploaded image, if there was one
+    upload = g.get('ingest')
+    if upload is not None:
+        response.headers['X-Upload-Bytes'] = str(upload.num_bytes)
+        response.headers['X-Decode-Time-Ms'] = f"{upload.decode_ms:.1f}"
+        response.headers['X-Decode-Scale'] = f"{upload.scale:.3f}"
+        response.headers.add('Access-Control-Expose-Headers', 'X-Upload-Bytes, X-Decode-Time-Ms, X-Decode-Scale')
+    if 'frame_cache' in g:
+        response.headers['X-Frame-Cache'] = g.frame_cache
+        response.headers.add('Access-Control-Expose-Headers', 'X-Frame-Cache')
     return response
 
 if __name__ == "__main__":
-    # Initialize the board visualization window in a separate thread
-    def run_board_window():
-        global board_root, board_app
-        board_root = tk.Tk()
-        board_app = ChessboardApp(board_root)
-        board_root.mainloop()
-
-    print("Starting board visualization thread...")
-    board_thread = threading.Thread(target=run_board_window, name="BoardThread")
-    board_thread.daemon = True  # Make thread exit when main program exits
-    board_thread.start()
-
-    # Give the board window time to initialize
-    import time
-    time.sleep(1)
-    
-    # Start the Flask app
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    if not HEADLESS:
+        import tkinter as tk
+        from fen_to_board import ChessboardApp
+
+        window_ready = threading.Event()
+
+        # Initialize the board visualization window in a separate thread
+        def run_board_window():
+            global board_root, board_app
+            board_root = tk.Tk()
+            board_app = ChessboardApp(board_root)
+            window_ready.set()
+            board_root.mainloop()
+
+        print("Starting board visualization thread...")
+        board_thread = threading.Thread(target=run_board_window, name="BoardThread")
+        board_thread.daemon = True  # Make thread exit when main program exits
+        board_thread.start()
+        window_ready.wait(timeout=5)
+
+    # Start the Flask app; the reloader would import this module (and load the models) twice
+    app.run(host=CONFIG['host'], port=CONFIG['port'], debug=CONFIG['debug'], use_reloader=False)
 
@@ -0,0 +1,217 @@
+"""
+Per-square piece classifier: warps the board top-down with the calibration
+homography, cuts one crop per square and classifies all 64 in one batch.
+
+Build the training set from the otb.v4i.yolov11 piece labels and train a small
+13-class model (12 pieces + Empty). The crops are cut exactly like at
+inference -- board model, lattice fit, top-down warp -- so the board model is
+needed for the build too:
+    python square_classifier.py build --dataset ../otb.v4i.yolov11 --out square_crops
+    python square_classifier.py train --data square_crops --epochs 30
+"""
+import argparse
+import os
+
+import cv2
+import numpy as np
+
+from board_state import BoardState, PIECE_TYPES
+from model_registry import BOARD_MODEL_PATH, load_model
+from postprocess import piece_anchors
+from square_lookup import SquareLookup
+from testing import get_board
+
+EMPTY_CLASS = 'Empty'
+CLASSES = [piece_type for piece_type in PIECE_TYPES[1:13]] + [EMPTY_CLASS]
+
+SQUARE_PX = 64      # side of one square in the rectified board
+TOP_EXTRA = 0.5     # extra height above each square, in squares, for tall pieces
+
+
+def crop_size(square_px=SQUARE_PX, top_extra=TOP_EXTRA):
+    """Crops are square: the square plus top_extra above and top_extra / 2 on each side."""
+    return int(round(square_px * (1 + top_extra)))
+
+
+def square_crops(image, homography, square_px=SQUARE_PX, top_extra=TOP_EXTRA, rows=8, cols=8):
+    """
+    Cuts one fixed-size crop per square from a top-down warp of the board.
+
+    Args:
+        homography: Image -> lattice homography (LatticeFit.homography)
+
+    Returns:
+        (rows * cols, size, size, 3) uint8 array in lattice order (row by row),
+        the same order get_squares lists the squares in
+    """
+    size = crop_size(square_px, top_extra)
+    pad_x = int(round(square_px * top_extra / 2))
+    pad_y = int(round(square_px * top_extra))
+
+    # Lattice (col, row) centers land on padded pixel coordinates
+    to_pixels = np.array([[square_px, 0, square_px / 2 + pad_x],
+                          [0, square_px, square_px / 2 + pad_y],
+                          [0, 0, 1]], dtype=np.float64)
+    canvas = (cols * square_px + 2 * pad_x, rows * square_px + pad_y)
+    board = cv2.warpPerspective(image, to_pixels @ homography, canvas,
+                                flags=cv2.INTER_AREA, borderMode=cv2.BORDER_REPLICATE)
+
+    crops = np.empty((rows * cols, size, size, 3), dtype=np.uint8)
+    for row in range(rows):
+        for col in range(cols):
+            x0, y0 = col * square_px, row * square_px
+            crops[row * cols + col] = board[y0:y0 + size, x0:x0 + size]
+    return crops
+
+
+def classify_crops(model, crops, square_px=SQUARE_PX, top_extra=TOP_EXTRA):
+    """
+    Classifies every crop in a single batched call.
+
+    Returns:
+        List of (class_name, confidence)
+    """
+    results = model(list(crops), imgsz=crop_size(square_px, top_extra), verbose=False)
+    labels = []
+    for result in results:
+        top1 = int(result.probs.top1)
+        labels.append((model.names[top1], float(result.probs.top1conf)))
+    return labels
+
+
+def classify_board(model, image, calibration, square_px=SQUARE_PX, top_extra=TOP_EXTRA, scale=1.0):
+    """
+    Reads the position from one photo of a calibrated board.
+
+    Args:
+        model: Ultralytics classification model trained on CLASSES
+        calibration: Calibration with a homography
+        scale: Calibration pixels per pixel of image (reduced-size decoding)
+
+    Returns:
+        BoardState
+    """
+    if calibration.homography is None:
+        raise ValueError("Crop classification needs a calibration with a homography")
+
+    crops = square_crops(image, calibration.homography_for(scale), square_px, top_extra)
+    board_state = BoardState()
+    for (square_name, _), (label, _) in zip(calibration.squares, classify_crops(model, crops, square_px, top_extra)):
+        board_state[square_name] = None if label == EMPTY_CLASS else label
+    return board_state
+
+
+def _read_labels(label_path):
+    """YOLO txt labels -> list of (cls_id, xc, yc, w, h), normalised."""
+    if not os.path.exists(label_path):
+        return []
+    with open(label_path) as f:
+        rows = [line.split() for line in f if line.strip()]
+    return [(int(r[0]), *map(float, r[1:5])) for r in rows]
+
+
+def label_squares(square_data, homography, labels, names, image_size):
+    """
+    Class of every square from the YOLO piece labels of one image: each box
+    goes on a square through SquareLookup, like the detector pipeline places
+    pieces, and squares without a piece are Empty.
+
+    Returns:
+        List of class names in square_data order; None for a square whose
+        piece isn't one of CLASSES
+    """
+    width, height = image_size
+    xyxy = np.array([[(xc - w / 2) * width, (yc - h / 2) * height, (xc + w / 2) * width, (yc + h / 2) * height]
+                     for _, xc, yc, w, h in labels], dtype=np.float64).reshape(-1, 4)
+    pieces = [((x, y), names[cls_id]) for (x, y), (cls_id, *_) in zip(piece_anchors(xyxy).tolist(), labels)]
+    board_state = SquareLookup(square_data, homography).assign(pieces)
+
+    classes = []
+    for square_name, _ in square_data:
+        piece_type = board_state[square_name]
+        class_name = EMPTY_CLASS if piece_type is None else piece_type
+        classes.append(class_name if class_name in CLASSES else None)
+    return classes
+
+
+def build_square_dataset(board_model, dataset_dir, out_dir, names, splits=(("train", "train"), ("valid", "val")),
+                         square_px=SQUARE_PX, top_extra=TOP_EXTRA):
+    """
+    Turns the otb.v4i.yolov11 piece boxes into square crops in the
+    ImageFolder layout ultralytics classification training expects.
+
+    Every image goes through the same path as classify_board: the board model
+    and lattice fit give the homography, square_crops cuts all 64 crops from
+    the top-down warp, and each crop is labelled with the piece the YOLO boxes
+    put on that square, or Empty. Images without a lattice fit are skipped.
+
+    Args:
+        board_model: Square detection model (see get_board)
+        names: Piece class names of the YOLO dataset, by class id
+    """
+    counts = {}
+    for src_split, dst_split in splits:
+        image_dir = os.path.join(dataset_dir, src_split, "images")
+        label_dir = os.path.join(dataset_dir, src_split, "labels")
+        if not os.path.isdir(image_dir):
+            print(f"Skipping missing split {image_dir}")
+            continue
+        for class_name in CLASSES:
+            os.makedirs(os.path.join(out_dir, dst_split, class_name), exist_ok=True)
+
+        skipped = 0
+        for filename in sorted(os.listdir(image_dir)):
+            stem = os.path.splitext(filename)[0]
+            image = cv2.imread(os.path.join(image_dir, filename))
+            if image is None:
+                continue
+            try:
+                square_data, fit = get_board(board_model, image)
+            except (ValueError, IndexError):
+                fit = None
+            if fit is None or len(square_data) != 64:
+                skipped += 1
+                continue
+
+            labels = _read_labels(os.path.join(label_dir, stem + ".txt"))
+            classes = label_squares(square_data, fit.homography, labels, names, image.shape[1::-1])
+            crops = square_crops(image, fit.homography, square_px, top_extra)
+            for (square_name, _), class_name, crop in zip(square_data, classes, crops):
+                if class_name is None:
+                    continue
+                cv2.imwrite(os.path.join(out_dir, dst_split, class_name, f"{stem}_{square_name}.jpg"), crop)
+                counts[class_name] = counts.get(class_name, 0) + 1
+        if skipped:
+            print(f"{src_split}: skipped {skipped} images without a lattice fit")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-square crop classifier tools.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="build a crop dataset from YOLO piece labels")
+    build.add_argument("--dataset", default=os.path.join("..", "otb.v4i.yolov11"))
+    build.add_argument("--out", default="square_crops")
+    build.add_argument("--board-model", default=BOARD_MODEL_PATH)
+
+    train = sub.add_parser("train", help="train a small classification model on the crops")
+    train.add_argument("--data", default="square_crops")
+    train.add_argument("--model", default="yolo11n-cls.pt")
+    train.add_argument("--epochs", type=int, default=30)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        import yaml
+        with open(os.path.join(args.dataset, "data.yaml")) as f:
+            names = yaml.safe_load(f)["names"]
+        counts = build_square_dataset(load_model(args.board_model), args.dataset, args.out, names)
+        for class_name in CLASSES:
+            print(f"{class_name:12s} {counts.get(class_name, 0)}")
+    else:
+        from ultralytics import YOLO
+        YOLO(args.model).train(data=args.data, imgsz=crop_size(), epochs=args.epochs)
+
+
+if __name__ == "__main__":
+    main()
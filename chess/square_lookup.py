@@ -0,0 +1,126 @@
+"""
+Piece-to-square lookup for one square grid, built once per calibration.
+
+With a lattice fit, a piece anchor goes through the image -> lattice
+homography and rounds to its square in O(1); without one, the nearest square
+center wins (what the old KD-tree query did). Every piece of a frame is looked
+up at once. When several pieces land on one square, the clash is settled by a
+min-cost assignment over the nearby squares, where moving a confident piece
+costs more than moving a doubtful one, instead of the last piece overwriting
+the others.
+"""
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from board_state import SQUARE_INDEX, PIECE_CODES, UNKNOWN, BoardState
+
+MAX_SHIFT = 0.75   # squares a clashing piece may move off its nearest square; further and it is dropped
+_BLOCKED = 1e6     # assignment cost for moves that are not allowed
+
+
+class SquareLookup:
+    """
+    Args:
+        squares: [(square_name, (x, y)), ...] as produced by get_squares()
+        homography: Optional 3x3 image -> lattice homography for the same
+            pixels as the square centers; used when squares is the full
+            rows x cols grid in lattice order
+    """
+    __slots__ = ("indices", "centers", "homography", "lattice", "pitch", "rows", "cols")
+
+    def __init__(self, squares, homography=None, rows=8, cols=8):
+        self.indices = np.array([SQUARE_INDEX[name.upper()] for name, _ in squares], dtype=np.int64)
+        self.centers = np.array([center for _, center in squares], dtype=np.float64).reshape(-1, 2)
+        self.rows, self.cols = rows, cols
+
+        if homography is not None and len(squares) == rows * cols:
+            # Lattice coordinates: square (row r, col c) is centered on (c, r), one unit apart
+            self.homography = np.asarray(homography, dtype=np.float64)
+            col_idx, row_idx = np.meshgrid(np.arange(cols), np.arange(rows))
+            self.lattice = np.stack([col_idx.ravel(), row_idx.ravel()], axis=1).astype(np.float64)
+            self.pitch = 1.0
+        else:
+            self.homography = None
+            self.lattice = self.centers
+            self.pitch = _median_spacing(self.centers)
+
+    def project(self, points):
+        """Maps (N, 2) image points into the space square distances are measured in."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if self.homography is None:
+            return points
+        mapped = points @ self.homography[:, :2].T + self.homography[:, 2]
+        return mapped[:, :2] / mapped[:, 2:3]
+
+    def distances(self, points):
+        """(N, number of squares) distances from each point to each square center, in squares."""
+        projected = self.project(points)
+        return np.linalg.norm(projected[:, None, :] - self.lattice[None, :, :], axis=2) / self.pitch
+
+    def nearest(self, points):
+        """Position in the squares list of the square each point falls on (or is closest to)."""
+        if self.homography is None:
+            return np.argmin(self.distances(points), axis=1)
+        projected = self.project(points)
+        col = np.clip(np.rint(projected[:, 0]), 0, self.cols - 1).astype(np.int64)
+        row = np.clip(np.rint(projected[:, 1]), 0, self.rows - 1).astype(np.int64)
+        return row * self.cols + col
+
+    def assign(self, pieces):
+        """
+        Places pieces on the board.
+
+        Args:
+            pieces: List of ((x, y), piece_type) or ((x, y), piece_type, conf)
+                tuples; pieces without a confidence count as 1.0
+
+        Returns:
+            BoardState
+        """
+        codes = np.zeros(64, dtype=np.uint8)
+        if not pieces or not len(self.indices):
+            return BoardState(codes)
+
+        points = np.array([piece[0] for piece in pieces], dtype=np.float64)
+        piece_codes = np.array([PIECE_CODES.get(piece[1], UNKNOWN) for piece in pieces], dtype=np.uint8)
+        slots = self.nearest(points)
+
+        if len(np.unique(slots)) < len(slots):
+            conf = np.array([piece[2] if len(piece) > 2 else 1.0 for piece in pieces], dtype=np.float64)
+            slots = self._resolve(points, conf, slots)
+
+        placed = slots >= 0
+        codes[self.indices[slots[placed]]] = piece_codes[placed]
+        return BoardState(codes)
+
+    def _resolve(self, points, conf, slots):
+        """
+        Min-cost assignment of pieces to distinct squares. A piece costs
+        conf * (extra distance from its nearest square) to move, or
+        conf * MAX_SHIFT to drop.
+
+        Returns:
+            Square position per piece, -1 for dropped pieces
+        """
+        n = len(points)
+        distances = self.distances(points)
+        extra = distances - distances[np.arange(n), slots][:, None]
+        move_cost = np.where(extra <= MAX_SHIFT, conf[:, None] * np.maximum(extra, 0.0), _BLOCKED)
+
+        drop_cost = np.full((n, n), _BLOCKED)
+        np.fill_diagonal(drop_cost, conf * MAX_SHIFT)
+
+        piece_idx, column = linear_sum_assignment(np.hstack([move_cost, drop_cost]))
+        resolved = np.full(n, -1, dtype=np.int64)
+        on_board = column < len(self.indices)
+        resolved[piece_idx[on_board]] = column[on_board]
+        return resolved
+
+
+def _median_spacing(centers):
+    """Median distance from each center to its nearest neighbour (1.0 if there are fewer than two)."""
+    if len(centers) < 2:
+        return 1.0
+    gaps = np.linalg.norm(centers[:, None, :] - centers[None, :, :], axis=2)
+    np.fill_diagonal(gaps, np.inf)
+    return max(float(np.median(gaps.min(axis=1))), 1.0)
@@ -2,6 +2,8 @@ from ultralytics import YOLO
 import cv2 
 import os 
 import numpy as np
+from postprocess import square_detections
+from testing import order_squares_to_chessboard
 
 # Configuration
 MODEL_PATH = r"E:\CHESS_OTB\chess\boardfinder.v3i.yolov11\runs\detect\train\weights\best.pt"
@@ -22,22 +24,8 @@ def main():
     # Run inference 
     results = model([IMAGE_PATH]) 
     
-    # Process results
-    square_detections = []
-    for result in results: 
-        for box in result.boxes: 
-            conf = float(box.conf[0]) 
-            cls_id = int(box.cls[0]) 
-            class_name = model.names[cls_id] 
-
-            if class_name == TARGET_CLASS: 
-                x1, y1, x2, y2 = box.xyxy[0].tolist()
-                center = (int((x1 + x2) // 2), int((y1 + y2) // 2))
-                square_detections.append((conf, center, class_name))
-
-    # Sort and select top detections
-    square_detections.sort(reverse=True, key=lambda x: x[0])
-    top_squares = square_detections[:EXPECTED_SQUARES]
+    # Process results (vectorized: class filter + top-k in one pass)
+    top_squares = square_detections(results[0], model.names, TARGET_CLASS, top_k=EXPECTED_SQUARES)
 
     # Visualize results
     count = 0
@@ -72,30 +60,6 @@ def main():
     print_chessboard_labels(board ,clock_side)
 
 
-
-def order_squares_to_chessboard(sq_list, rows=8, cols=8):
-    """
-    Takes a list of (x, y) centers and sorts them into chessboard order (A1-H8).
-    Returns a 2D list where board[0][0] = A1, board[0][1] = B1, ..., board[7][7] = H8.
-    """
-    if len(sq_list) != rows * cols:
-        print(f"Warning: Expected {rows * cols} squares, but got {len(sq_list)}")
-    # Convert to numpy array for easier manipulation
-    centers = np.array(sq_list)
-    # Step 1: Sort by Y-coordinate (rows)
-    y_sorted = centers[np.argsort(centers[:, 1])]
-    # Step 2: Split into rows and sort each row by X-coordinate (left to right)
-    
-    board = []
-    for i in range(rows):
-        row_start = i * cols
-        row_end = (i + 1) * cols
-        row = y_sorted[row_start:row_end]
-        row = row[np.argsort(row[:, 0])]  # Sort row by X-coordinate
-        board.append(row)
-    # Step 3: Reverse row order (chessboard starts at bottom-left)
-    
-    return board
 def print_chessboard_labels(board , clock_side):
     """
     Prints the board with chess notation (A1-H8).
@@ -0,0 +1,246 @@
+"""
+Speed/accuracy sweep over inference settings against ground-truth FENs.
+
+The truth file is JSON mapping image paths (relative to the file) to FENs.
+Start one from what the current settings produce, then fix it by hand:
+    python sweep.py template --images ../testimage ../king_queen --out truth.json
+
+Sweep every combination and print the Pareto front (latency vs. accuracy):
+    python sweep.py run --truth truth.json --imgsz 320 480 640 --conf 0.25 0.4 0.5 \
+        --iou 0.5 0.7 --max-det 64 300 --out sweep.json
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from board_state import BoardState
+from config import load_config
+from model_registry import list_images, load_model
+from piece_square import assign_pieces_to_squares
+from postprocess import piece_detections
+from roi import board_region, crop, tile_region, merge_tiles
+from testing import get_board
+
+
+def load_truth(path):
+    """Returns [(image_path, placement codes)] from a truth file."""
+    with open(path) as f:
+        truth = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    return [(os.path.join(base, image_path), BoardState.from_fen(fen).codes)
+            for image_path, fen in sorted(truth.items())]
+
+
+class _Configured:
+    """Calls a model with fixed keyword arguments; keeps .names."""
+
+    def __init__(self, model, **kwargs):
+        self.model, self.kwargs = model, kwargs
+
+    @property
+    def names(self):
+        return self.model.names
+
+    def __call__(self, source, **kwargs):
+        return self.model(source, **{**self.kwargs, **kwargs})
+
+
+def model_label(path):
+    """Short name for a weights file: the training run directory (.../<run>/weights/best.pt)."""
+    parent = os.path.dirname(os.path.abspath(path))
+    if os.path.basename(parent) == 'weights':
+        parent = os.path.dirname(parent)
+    return os.path.basename(parent)
+
+
+def read_board(board_model, image, imgsz):
+    """Labelled squares for one image at a board-model input size, or None."""
+    try:
+        square_data, _ = get_board(_Configured(board_model, imgsz=imgsz, verbose=False), image)
+        return square_data
+    except (ValueError, IndexError):
+        return None
+
+
+def detect_on_board(piece_model, image, square_data, tile_scale, **kwargs):
+    """Piece detections from the board region only, tiled like the server does (see roi.py)."""
+    height, width = image.shape[:2]
+    tiles = tile_region(board_region(square_data, (width, height)), int(kwargs['imgsz'] * tile_scale))
+    results = piece_model([crop(image, tile.box) for tile in tiles], verbose=False, **kwargs)
+    return merge_tiles(tiles, [piece_detections(result, piece_model.names, kwargs['conf']) for result in results])
+
+
+def evaluate(piece_model, images, boards, truth_codes, imgsz, conf, iou, max_det, roi_tile_scale=None):
+    """
+    Runs the piece model with one setting over every image; with
+    roi_tile_scale it only looks at each image's board region.
+
+    Returns:
+        Dict with square_accuracy, fen_accuracy and median piece latency
+    """
+    piece_model(images[0], imgsz=imgsz, conf=conf, iou=iou, max_det=max_det, verbose=False)  # warm up
+
+    correct_squares, correct_fens, latencies = 0, 0, []
+    for image, square_data, codes in zip(images, boards, truth_codes):
+        start = time.perf_counter()
+        if roi_tile_scale and square_data is not None:
+            piece_data = detect_on_board(piece_model, image, square_data, roi_tile_scale,
+                                         imgsz=imgsz, conf=conf, iou=iou, max_det=max_det)
+        else:
+            result = piece_model(image, imgsz=imgsz, conf=conf, iou=iou, max_det=max_det, verbose=False)[0]
+            piece_data = piece_detections(result, piece_model.names, conf)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if square_data is None:
+            continue
+        predicted = assign_pieces_to_squares(square_data, piece_data).codes
+        matches = int((predicted == codes).sum())
+        correct_squares += matches
+        correct_fens += matches == 64
+
+    return {
+        'square_accuracy': correct_squares / (64 * len(images)),
+        'fen_accuracy': correct_fens / len(images),
+        'piece_ms': float(np.median(latencies)),
+    }
+
+
+def pareto_front(results):
+    """Indices of results not beaten on latency, FEN accuracy and square accuracy at once."""
+    front = []
+    for i, a in enumerate(results):
+        dominated = any(
+            b['latency_ms'] <= a['latency_ms'] and b['fen_accuracy'] >= a['fen_accuracy']
+            and b['square_accuracy'] >= a['square_accuracy']
+            and (b['latency_ms'] < a['latency_ms'] or b['fen_accuracy'] > a['fen_accuracy']
+                 or b['square_accuracy'] > a['square_accuracy'])
+            for j, b in enumerate(results) if j != i)
+        if not dominated:
+            front.append(i)
+    return front
+
+
+def run_sweep(args):
+    config = load_config()
+    truth = load_truth(args.truth)
+    images = [cv2.imread(path) for path, _ in truth]
+    missing = [path for (path, _), image in zip(truth, images) if image is None]
+    if missing:
+        raise SystemExit(f"Could not read {', '.join(missing)}")
+    truth_codes = [codes for _, codes in truth]
+
+    board_paths = args.board_models or [config['board_model_path']]
+    piece_paths = args.piece_models or [config['piece_model_path']]
+    backend = args.backend or config['model_backend']
+
+    results = []
+    for board_path in board_paths:
+        board_model = load_model(board_path, backend, args.int8)
+        for board_imgsz in args.board_imgsz:
+            # Board settings don't depend on the piece settings: read the grids once
+            read_board(board_model, images[0], board_imgsz)  # warm up
+            start = time.perf_counter()
+            boards = [read_board(board_model, image, board_imgsz) for image in images]
+            board_ms = (time.perf_counter() - start) * 1000 / len(images)
+
+            for piece_path in piece_paths:
+                piece_model = load_model(piece_path, backend, args.int8)
+                for imgsz, conf, iou, max_det in itertools.product(args.imgsz, args.conf, args.iou, args.max_det):
+                    scores = evaluate(piece_model, images, boards, truth_codes, imgsz, conf, iou, max_det,
+                                      args.roi_tile_scale)
+                    result = {
+                        'board_model': board_path, 'board_imgsz': board_imgsz, 'roi_tile_scale': args.roi_tile_scale,
+                        'piece_model': piece_path, 'imgsz': imgsz, 'conf': conf, 'iou': iou, 'max_det': max_det,
+                        'board_ms': board_ms, **scores,
+                        'latency_ms': board_ms + scores['piece_ms'],
+                        'board_failures': sum(1 for board in boards if board is None),
+                    }
+                    results.append(result)
+                    print(f"{model_label(piece_path)[:18]:18s} "
+                          f"board {board_imgsz:4d}  imgsz {imgsz:4d}  conf {conf:.2f}  iou {iou:.2f}  "
+                          f"max_det {max_det:4d}  squares {scores['square_accuracy']:.4f}  "
+                          f"FEN {scores['fen_accuracy']:.3f}  {result['latency_ms']:7.1f} ms")
+
+    front = pareto_front(results)
+    for i in front:
+        results[i]['pareto'] = True
+    return results, front
+
+
+def write_template(args):
+    """Writes a truth file from the current models' FENs, for correcting by hand."""
+    from piece_square import get_fen_from_board_state
+
+    config = load_config()
+    board_model = load_model(config['board_model_path'], config['model_backend'], config['model_int8'])
+    piece_model = load_model(config['piece_model_path'], config['model_backend'], config['model_int8'])
+    base = os.path.dirname(os.path.abspath(args.out))
+
+    truth = {}
+    for path in list_images(args.images):
+        image = cv2.imread(path)
+        square_data = read_board(board_model, image, 640) if image is not None else None
+        if square_data is None:
+            print(f"No board found in {path}; add it by hand")
+            continue
+        piece_data = piece_detections(piece_model(image, verbose=False)[0], piece_model.names,
+                                      config['piece_conf_threshold'])
+        fen = get_fen_from_board_state(assign_pieces_to_squares(square_data, piece_data))
+        truth[os.path.relpath(path, base).replace(os.sep, '/')] = fen.split(' ')[0]
+    with open(args.out, 'w') as f:
+        json.dump(truth, f, indent=2)
+    print(f"Wrote {len(truth)} FENs to {args.out}; check every one before sweeping against it")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="sweep settings against a truth file")
+    run.add_argument("--truth", required=True, help="JSON {image path: FEN}")
+    run.add_argument("--imgsz", nargs="+", type=int, default=[320, 480, 640])
+    run.add_argument("--conf", nargs="+", type=float, default=[0.25, 0.4, 0.5])
+    run.add_argument("--iou", nargs="+", type=float, default=[0.7])
+    run.add_argument("--max-det", nargs="+", type=int, default=[300])
+    run.add_argument("--board-imgsz", nargs="+", type=int, default=[640])
+    run.add_argument("--piece-models", nargs="+", default=None, help="piece model variants (.pt paths)")
+    run.add_argument("--board-models", nargs="+", default=None, help="board model variants (.pt paths)")
+    run.add_argument("--backend", default=None, help="torch, onnx or openvino (default: server config)")
+    run.add_argument("--int8", action="store_true")
+    run.add_argument("--roi-tile-scale", type=float, default=None,
+                     help="run the piece model on the board region only, tiled above this many times imgsz")
+    run.add_argument("--out", default="sweep.json")
+
+    template = sub.add_parser("template", help="write a truth file from the current models' output")
+    template.add_argument("--images", nargs="+", required=True)
+    template.add_argument("--out", default="truth.json")
+    args = parser.parse_args()
+
+    if args.command == "template":
+        write_template(args)
+        return
+
+    results, front = run_sweep(args)
+    print("\nPareto front (cheapest first):")
+    for i in sorted(front, key=lambda i: results[i]['latency_ms']):
+        r = results[i]
+        print(f"  board {r['board_imgsz']:4d}  imgsz {r['imgsz']:4d}  conf {r['conf']:.2f}  iou {r['iou']:.2f}  "
+              f"max_det {r['max_det']:4d}  squares {r['square_accuracy']:.4f}  FEN {r['fen_accuracy']:.3f}  "
+              f"{r['latency_ms']:7.1f} ms  {model_label(r['piece_model'])}")
+
+    best_fen = max(r['fen_accuracy'] for r in results)
+    cheapest = min((r for r in results if r['fen_accuracy'] == best_fen), key=lambda r: r['latency_ms'])
+    print(f"\nCheapest setting at the best FEN accuracy ({best_fen:.3f}): board imgsz {cheapest['board_imgsz']}, "
+          f"imgsz {cheapest['imgsz']}, conf {cheapest['conf']}, iou {cheapest['iou']}, max_det {cheapest['max_det']}")
+
+    with open(args.out, 'w') as f:
+        json.dump({'results': results, 'pareto_front': front}, f, indent=2)
+    print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,33 +2,62 @@ from ultralytics import YOLO
 import cv2
 import numpy as np
 import json
+from postprocess import square_detections, piece_detections
+from lattice import fit_lattice
 def detect_squares(model, image_input, target_class="square", expected_squares=64):
     """Detects squares in a chessboard image using a pre-loaded model."""
     
     results = model(image_input)
     
-    square_detections = []
+    detections = []
     for result in results:
-        for box in result.boxes: 
-            conf = float(box.conf[0]) 
-            cls_id = int(box.cls[0]) 
-            class_name = model.names[cls_id] 
-
-            if class_name == target_class: 
-                x1, y1, x2, y2 = box.xyxy[0].tolist()
-                center = (int((x1 + x2) // 2), int((y1 + y2) // 2))
-                square_detections.append((conf, center, class_name))
+        detections.extend(squares_from_result(model, result, target_class))
 
     # Sort and select top detections
-    square_detections.sort(reverse=True, key=lambda x: x[0])
-    top_squares = square_detections[:expected_squares]
+    detections.sort(reverse=True, key=lambda x: x[0])
+    top_squares = detections[:expected_squares]
     return top_squares
 
 
+def squares_from_result(model, result, target_class="square"):
+    """Returns [(conf, center, class_name), ...] for one image's YOLO result."""
+    return square_detections(result, model.names, target_class)
+
+
 def order_squares_to_chessboard(sq_list = detect_squares, rows=8, cols=8):
     """
     Takes a list of (x, y) centers and sorts them into chessboard order (A1-H8).
     Returns a 2D list where board[0][0] = A1, board[0][1] = B1, ..., board[7][7] = H8.
+
+    The centers are fitted to an 8x8 lattice with a homography (see lattice.py),
+    so tilted boards, missing squares and stray detections are handled; squares
+    that were not detected are filled in from the fit.
+    """
+    board, _ = fit_chessboard(sq_list, rows, cols)
+    return board
+
+
+def fit_chessboard(sq_list, rows=8, cols=8):
+    """
+    Same as order_squares_to_chessboard, but also returns the LatticeFit
+    (homography, residual, detected mask), or None when the old sort-by-Y
+    ordering had to be used.
+    """
+    try:
+        fit = fit_lattice(sq_list, rows, cols)
+    except ValueError as e:
+        print(f"Warning: Lattice fit failed ({e}), sorting squares by Y instead")
+        return sort_squares_by_rows(sq_list, rows, cols), None
+
+    if fit.inliers != rows * cols:
+        print(f"Warning: Matched {fit.inliers} of {rows * cols} squares "
+              f"({fit.outliers} rejected), inferred the rest from the lattice fit")
+    return fit.board_rows(), fit
+
+
+def sort_squares_by_rows(sq_list, rows=8, cols=8):
+    """
+    Sort-by-Y ordering: only correct for a frontal board with all 64 squares.
     """
     if len(sq_list) != rows * cols:
         print(f"Warning: Expected {rows * cols} squares, but got {len(sq_list)}")
@@ -76,15 +105,33 @@ def get_squares(model, image_input, target_class="square",
     3. print chessboard-style labels
     4. return the same list produced by print_chessboard_labels
     """
+    square_data, _ = get_board(model, image_input, target_class, expected_squares, clock_side)
+    return square_data
+
+
+def get_board(model, image_input, target_class="square",
+              expected_squares=64, clock_side="right_w"):
+    """
+    Like get_squares, but also returns the LatticeFit (or None) so callers can
+    keep the homography.
+    """
     detections = detect_squares(model, image_input, target_class, expected_squares)
     # detections = [(conf, (x, y), class_name), ...]
+    return label_detections_with_fit(detections, clock_side)
+
 
+def label_detections_with_fit(detections, clock_side="right_w"):
+    """
+    Orders top square detections into a grid and labels them A1-H8.
+    Returns (square_data, LatticeFit or None).
+    """
     centers = np.array([center for _, center, _ in detections])
-    board = order_squares_to_chessboard(centers)
+    board, fit = fit_chessboard(centers)
 
     # 3. Print and capture the final list
-    final_list = print_chessboard_labels(board, clock_side=clock_side)
-    return final_list
+    # Pass a fresh list: the default argument is shared between calls
+    final_list = print_chessboard_labels(board, clock_side=clock_side, final_sq_list=[])
+    return final_list, fit
 
 
 
@@ -107,16 +154,8 @@ def get_pieces(model, image_path):
     
     results = model(image)
     
-    square_detections = []
+    piece_data = []
     for result in results:
-        for box in result.boxes: 
-            conf = float(box.conf[0]) 
-            cls_id = int(box.cls[0]) 
-            class_name = model.names[cls_id]  
-            x1, y1, x2, y2 = box.xyxy[0].tolist()
-
-            center_x = int((x1 + x2) // 2)
-            center_y = int(y2 - (y2 - y1) // 4)
-            square_detections.append(((center_x, center_y), class_name))
+        piece_data.extend(piece_detections(result, model.names))
     
-    return square_detections
+    return piece_data
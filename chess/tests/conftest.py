@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The server modules import each other as top-level modules from chess/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# No board window and no model loading at import; tests stub the model calls
+os.environ.setdefault("CHESS_HEADLESS", "1")
+os.environ.setdefault("CHESS_PRELOAD", "lazy")
@@ -0,0 +1,47 @@
+import io
+import json
+import zipfile
+
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip("ultralytics")
+import server  # noqa: E402
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Stand-ins for the batched model calls: no squares, no pieces
+    monkeypatch.setattr(server, "find_squares_batch", lambda images: [([], None) for _ in images])
+    monkeypatch.setattr(server, "detect_pieces_batch", lambda images: [[] for _ in images])
+    return server.app.test_client()
+
+
+def make_zip(count):
+    data = cv2.imencode(".png", np.full((32, 32, 3), 127, np.uint8))[1].tobytes()
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        for i in range(count):
+            zf.writestr(f"{i}.png", data)
+    buffer.seek(0)
+    return buffer
+
+
+def stream_lines(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+@pytest.mark.parametrize("count, batch_size", [(10, 4), (3, 4)])
+def test_archive_with_partial_last_batch(client, count, batch_size):
+    response = client.post("/batch-analyze", data={"archive": (make_zip(count), "photos.zip"),
+                                                  "batch_size": str(batch_size)})
+    assert response.status_code == 200
+    lines = stream_lines(response)
+    assert [line.get("name") for line in lines] == [f"{i}.png" for i in range(count)]
+    assert all("error" not in line for line in lines)
+
+
+def test_invalid_archive_is_rejected(client):
+    response = client.post("/batch-analyze", data={"archive": (io.BytesIO(b"not a zip"), "photos.zip")})
+    assert response.status_code == 400
@@ -0,0 +1,81 @@
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip("ultralytics")
+from calibration import Calibration  # noqa: E402
+from frame_cache import CachedResult, FrameCache  # noqa: E402
+
+SQUARE = 50
+ORIGIN = (100, 80)  # image position of the board's top-left corner
+
+
+def board_photo(seed=0):
+    """A checkered board with some texture, 8 x SQUARE pixels square, at ORIGIN."""
+    rng = np.random.default_rng(seed)
+    image = np.full((600, 800, 3), 90, np.uint8)
+    for row in range(8):
+        for col in range(8):
+            x, y = ORIGIN[0] + col * SQUARE, ORIGIN[1] + row * SQUARE
+            image[y:y + SQUARE, x:x + SQUARE] = 200 if (row + col) % 2 == 0 else 120
+    noise = rng.integers(-6, 7, image.shape)
+    return np.clip(image.astype(int) + noise, 0, 255).astype(np.uint8)
+
+
+def add_piece(image, row, col, color=30):
+    center = (ORIGIN[0] + col * SQUARE + SQUARE // 2, ORIGIN[1] + row * SQUARE + SQUARE // 2)
+    cv2.circle(image, center, SQUARE // 3, (color, color, color), -1)
+    return image
+
+
+@pytest.fixture
+def calibration():
+    # Image -> lattice: square (row r, col c) is centered on (c, r)
+    homography = np.array([[1 / SQUARE, 0, -(ORIGIN[0] + SQUARE / 2) / SQUARE],
+                           [0, 1 / SQUARE, -(ORIGIN[1] + SQUARE / 2) / SQUARE],
+                           [0, 0, 1]])
+    squares = [(f"{'ABCDEFGH'[col]}{8 - row}",
+                (ORIGIN[0] + col * SQUARE + SQUARE / 2, ORIGIN[1] + row * SQUARE + SQUARE / 2))
+               for row in range(8) for col in range(8)]
+    return Calibration("session", squares, homography, (800, 600))
+
+
+def cached_frame(cache, calibration, image):
+    result = CachedResult({'fen_string': 'before'}, None, [], calibration)
+    cache.put('scope', cache.signature(image, calibration), image.shape, result)
+    return result
+
+
+def test_resubmitted_photo_hits(calibration):
+    cache = FrameCache()
+    before = add_piece(board_photo(), 6, 4)
+    result = cached_frame(cache, calibration, before)
+
+    again = board_photo(seed=1)  # same board, different sensor noise
+    add_piece(again, 6, 4)
+    again = cv2.imdecode(cv2.imencode(".jpg", again, [cv2.IMWRITE_JPEG_QUALITY, 80])[1], cv2.IMREAD_COLOR)
+    assert cache.get('scope', cache.signature(again, calibration), again.shape, calibration) is result
+
+
+@pytest.mark.parametrize("change", ["move", "capture_color", "new_piece"])
+def test_one_square_change_misses(calibration, change):
+    cache = FrameCache()
+    before = add_piece(board_photo(), 6, 4)
+    cached_frame(cache, calibration, before)
+
+    after = board_photo(seed=1)
+    if change == "move":
+        add_piece(after, 4, 4)            # e2-e4
+    elif change == "capture_color":
+        add_piece(after, 6, 4, color=235)  # same square, other piece
+    else:
+        add_piece(add_piece(after, 6, 4), 2, 2)
+    assert cache.get('scope', cache.signature(after, calibration), after.shape, calibration) is None
+
+
+def test_other_calibration_misses(calibration):
+    cache = FrameCache()
+    image = board_photo()
+    cached_frame(cache, calibration, image)
+    other = Calibration("session", calibration.squares, calibration.homography, (800, 600))
+    assert cache.get('scope', cache.signature(image, other), image.shape, other) is None
@@ -0,0 +1,72 @@
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip("ultralytics")
+from incremental import classify_squares  # noqa: E402
+
+SQUARE = 50
+ORIGIN = (100, 80)
+PIECE_COLOR = (0, 0, 220)
+
+
+class Boxes:
+    def __init__(self, xyxy):
+        self.xyxy = np.array(xyxy, dtype=np.float32).reshape(-1, 4)
+        self.conf = np.full(len(self.xyxy), 0.9, dtype=np.float32)
+        self.cls = np.zeros(len(self.xyxy))
+
+
+class Result:
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+
+class BlobDetector:
+    """Stand-in piece model: one box per blob of piece color, as a detector would see it in the crop."""
+    names = {0: 'BlackPawn'}
+
+    def __call__(self, crops, **kwargs):
+        results = []
+        for crop in crops:
+            mask = cv2.inRange(crop, PIECE_COLOR, PIECE_COLOR)
+            count, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+            results.append(Result(Boxes([(x, y, x + w, y + h) for x, y, w, h, _ in stats[1:count]])))
+        return results
+
+
+def to_image(col, row):
+    return ORIGIN[0] + (col + 0.5) * SQUARE, ORIGIN[1] + (row + 0.5) * SQUARE
+
+
+def draw_pawn(image, row, col):
+    """A piece standing on its square and reaching well into the square above, as seen from a low camera."""
+    x0, y0 = to_image(col - 0.3, row - 0.9)
+    x1, y1 = to_image(col + 0.3, row + 0.35)
+    cv2.rectangle(image, (int(x0), int(y0)), (int(x1), int(y1)), PIECE_COLOR, -1)
+
+
+@pytest.fixture
+def homography():
+    # Image -> lattice: square (row r, col c) is centered on (c, r)
+    return np.array([[1 / SQUARE, 0, -(ORIGIN[0] + SQUARE / 2) / SQUARE],
+                     [0, 1 / SQUARE, -(ORIGIN[1] + SQUARE / 2) / SQUARE],
+                     [0, 0, 1]])
+
+
+def test_pawn_push_empties_the_square_it_left(homography):
+    # ...f7 and g7 pawns, g7-g6 played: the changed cells are g7 (row 1) and g6 (row 2)
+    image = np.full((600, 800, 3), 160, np.uint8)
+    draw_pawn(image, 1, 5)
+    draw_pawn(image, 2, 6)
+
+    assert classify_squares(BlobDetector(), image, homography, [(1, 6), (2, 6)]) == [None, 'BlackPawn']
+
+
+def test_piece_at_the_image_border_is_kept(homography):
+    image = np.full((600, 800, 3), 160, np.uint8)
+    draw_pawn(image, 0, 0)
+    cropped = image[ORIGIN[1] - 20:, ORIGIN[0]:]  # board's top-left square touches the image corner
+    shift = np.array([[1, 0, ORIGIN[0]], [0, 1, ORIGIN[1] - 20], [0, 0, 1]])
+
+    assert classify_squares(BlobDetector(), cropped, homography @ shift, [(0, 0)]) == ['BlackPawn']
@@ -0,0 +1,63 @@
+import cv2
+import numpy as np
+import pytest
+
+from lattice import fit_lattice
+
+
+def board_centers(angle=10.0, perspective=0.15, missing=(), spurious=0, seed=0):
+    """Image-space square centers of a turned, slightly foreshortened board, plus their (col, row) cells."""
+    rng = np.random.default_rng(seed)
+    cols, rows = np.meshgrid(np.arange(8), np.arange(8))
+    cells = np.stack([cols.ravel(), rows.ravel()], axis=1).astype(np.float32)
+    cells = np.delete(cells, list(missing), axis=0)
+
+    a = np.deg2rad(angle)
+    rotation = np.array([[np.cos(a), -np.sin(a)], [np.sin(a), np.cos(a)]])
+    lattice_corners = np.float32([[0, 0], [7, 0], [7, 7], [0, 7]])
+    image_corners = (lattice_corners - 3.5) @ rotation.T * 60 + [400, 300]
+    image_corners[0] += [perspective * 60, 0]
+    image_corners[1] -= [perspective * 60, 0]
+    homography = cv2.getPerspectiveTransform(lattice_corners, np.float32(image_corners))
+
+    centers = cv2.perspectiveTransform(cells.reshape(-1, 1, 2), homography).reshape(-1, 2)
+    centers += rng.normal(0, 1.0, centers.shape)
+    if spurious:
+        centers = np.vstack([centers, rng.uniform(0, 800, (spurious, 2))])
+    return centers, cells
+
+
+def labelled_correctly(fit, centers, cells):
+    """Every real center lands on its own cell, up to the board's eight symmetries."""
+    found = np.rint(fit.image_to_lattice(centers[:len(cells)]))
+    for turns in range(4):
+        for flip in (False, True):
+            expected = cells.copy()
+            if flip:
+                expected[:, 0] = 7 - expected[:, 0]
+            for _ in range(turns):
+                expected = np.stack([7 - expected[:, 1], expected[:, 0]], axis=1)
+            if (found == expected).all():
+                return True
+    return False
+
+
+@pytest.mark.parametrize("kwargs", [
+    {},
+    {"spurious": 3},
+    {"missing": (3, 17, 30, 44, 60)},
+    {"missing": (0, 7, 56, 63, 20)},
+    {"angle": 0, "perspective": 0, "missing": range(56, 64)},
+    {"angle": 45},
+])
+def test_labels(kwargs):
+    centers, cells = board_centers(**kwargs)
+    assert labelled_correctly(fit_lattice(centers), centers, cells)
+
+
+@pytest.mark.parametrize("angle", [40, 45, 50])
+def test_diagonal_board_missing_an_edge_row_is_rejected(angle):
+    centers, _ = board_centers(angle=angle, missing=range(56, 64))
+    with pytest.raises(ValueError):
+        fit_lattice(centers)
+
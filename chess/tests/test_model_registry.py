@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+from model_registry import LazyModel
+
+
+class FlakyLoader:
+    """Fails the first `failures` loads, then returns a stand-in model."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise OSError("weights not mounted yet")
+        return object()
+
+
+def test_failed_load_is_retried_after_backoff():
+    loader = FlakyLoader(failures=1)
+    model = LazyModel(loader, name="board", warmup=False, retry_seconds=0.2)
+
+    with pytest.raises(RuntimeError):
+        model.load()
+    assert model.status()['state'] == 'failed'
+
+    # Within the backoff the stored error is raised without touching the loader
+    with pytest.raises(RuntimeError):
+        model.load()
+    assert loader.calls == 1
+
+    time.sleep(0.25)
+    assert model.load() is not None
+    assert loader.calls == 2
+    assert model.status()['state'] == 'ready'
+
+
+def test_backoff_doubles_up_to_the_limit():
+    model = LazyModel(FlakyLoader(failures=10), warmup=False, retry_seconds=0.05, max_retry_seconds=0.1)
+    waits = []
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            model.load()
+        waits.append(model.retry_in())
+        time.sleep(model.retry_in())
+    assert model.status()['failures'] == 3
+    assert waits[0] <= 0.05 and 0.05 < waits[2] <= 0.1
+
+
+def test_background_load_retries_once_due():
+    loader = FlakyLoader(failures=1)
+    model = LazyModel(loader, warmup=False, retry_seconds=0.1)
+    model.load_in_background().join()
+    assert model.status()['state'] == 'failed'
+
+    model.load_in_background().join()  # not due yet: the finished thread is returned as is
+    assert loader.calls == 1
+
+    time.sleep(0.15)
+    model.load_in_background().join()
+    assert model.ready and loader.calls == 2
@@ -0,0 +1,74 @@
+import os
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip("ultralytics")
+import square_classifier  # noqa: E402
+from square_classifier import CLASSES, EMPTY_CLASS, build_square_dataset, square_crops  # noqa: E402
+
+SQUARE = 40
+ORIGIN = (120, 60)  # image position of the board's top-left corner
+NAMES = ['WhitePawn', 'BlackKing']
+
+
+def lattice_board():
+    """Square data in lattice order and the image -> lattice homography of a flat board at ORIGIN."""
+    squares = [(f"{'ABCDEFGH'[col]}{8 - row}",
+                (ORIGIN[0] + (col + 0.5) * SQUARE, ORIGIN[1] + (row + 0.5) * SQUARE))
+               for row in range(8) for col in range(8)]
+    homography = np.array([[1 / SQUARE, 0, -ORIGIN[0] / SQUARE - 0.5],
+                           [0, 1 / SQUARE, -ORIGIN[1] / SQUARE - 0.5],
+                           [0, 0, 1]])
+    return squares, homography
+
+
+def piece_label(row, col, cls_id, width, height):
+    """YOLO label line for a piece standing on (row, col), box taller than the square."""
+    x1 = ORIGIN[0] + (col + 0.1) * SQUARE
+    x2 = ORIGIN[0] + (col + 0.9) * SQUARE
+    y2 = ORIGIN[1] + (row + 0.9) * SQUARE
+    y1 = y2 - 1.4 * SQUARE
+    return f"{cls_id} {(x1 + x2) / 2 / width} {(y1 + y2) / 2 / height} {(x2 - x1) / width} {(y2 - y1) / height}\n"
+
+
+def write_split(root, fits):
+    """One image per entry in fits, all with a white pawn on e2 and a black king on a8."""
+    os.makedirs(os.path.join(root, "train", "images"))
+    os.makedirs(os.path.join(root, "train", "labels"))
+    image = np.full((480, 560, 3), 100, np.uint8)
+    for row in range(8):
+        for col in range(8):
+            x, y = ORIGIN[0] + col * SQUARE, ORIGIN[1] + row * SQUARE
+            image[y:y + SQUARE, x:x + SQUARE] = (210, 190, 170) if (row + col) % 2 == 0 else (90, 110, 60)
+    x, y = ORIGIN[0] + 4 * SQUARE + SQUARE // 2, ORIGIN[1] + 6 * SQUARE + SQUARE // 2
+    cv2.circle(image, (x, y), SQUARE // 3, (20, 20, 20), -1)
+    height, width = image.shape[:2]
+    for i in range(len(fits)):
+        cv2.imwrite(os.path.join(root, "train", "images", f"{i}.jpg"), image)
+        with open(os.path.join(root, "train", "labels", f"{i}.txt"), "w") as f:
+            f.write(piece_label(6, 4, 0, width, height) + piece_label(0, 0, 1, width, height))
+    return image
+
+
+def test_dataset_is_cut_like_inference(tmp_path, monkeypatch):
+    squares, homography = lattice_board()
+    fits = [SimpleNamespace(homography=homography), None]  # the second image has no lattice fit
+    monkeypatch.setattr(square_classifier, "get_board", lambda model, image: (squares, fits.pop(0)))
+    image = write_split(str(tmp_path / "otb"), fits)
+
+    out = tmp_path / "crops"
+    counts = build_square_dataset(None, str(tmp_path / "otb"), str(out), NAMES, splits=(("train", "train"),))
+
+    assert counts == {'WhitePawn': 1, 'BlackKing': 1, EMPTY_CLASS: 62}
+    assert sorted(os.listdir(out / "train" / "WhitePawn")) == ["0_E2.jpg"]
+    assert sorted(os.listdir(out / "train" / "BlackKing")) == ["0_A8.jpg"]
+    assert set(os.listdir(out / "train")) == set(CLASSES)
+
+    # Same pixels as square_crops gives classify_board for that square (up to JPEG loss)
+    written = cv2.imread(str(out / "train" / "WhitePawn" / "0_E2.jpg"))
+    expected = square_crops(image, homography)[6 * 8 + 4]
+    assert written.shape == expected.shape
+    assert np.abs(written.astype(int) - expected.astype(int)).mean() < 3
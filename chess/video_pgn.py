@@ -0,0 +1,334 @@
+"""
+Offline game digitisation: recorded game video in, PGN out.
+
+The video is streamed frame by frame (never decoded into memory as a whole)
+and only stable keyframes reach the models: the picture has to stay still for
+a moment (no hand moving over the board) and the board has to differ from the
+previous keyframe. Chunks of the video are read by a process pool, one model
+copy per worker, and the positions found are stitched into moves. Writing a
+PGN needs python-chess (pip install chess): every move is checked for legality
+and written in SAN. Without it the moves are inferred square by square and
+written as a plain UCI move list (game.uci.txt), not as a PGN.
+
+    python video_pgn.py game.mp4 --out game.pgn --workers 8
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+from board_state import BoardState
+from config import load_config
+from incremental import rectify_board, square_change_scores, infer_move, CHANGE_THRESHOLD, MAX_CHANGED
+from model_registry import load_model
+from postprocess import piece_detections
+from square_lookup import SquareLookup
+from testing import get_board
+
+try:
+    import chess
+    import chess.pgn
+except ImportError:
+    chess = None
+
+SAMPLE_FPS = 4.0          # frames per second looked at; the rest are skipped without converting them
+MOTION_WIDTH = 160        # width of the gray thumbnail used for the motion measure
+MOTION_THRESHOLD = 2.0    # mean gray-level change between samples still counted as "still"
+STABLE_SECONDS = 1.0      # how long the picture must stay still before a keyframe is taken
+CHUNK_SECONDS = 120.0     # video per pool task
+START_PLACEMENT = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR"
+UCI_EXTENSION = ".uci.txt"  # move list written instead of a PGN without python-chess
+
+_models = None  # (board_model, piece_model, conf_threshold) in each worker process
+
+
+def iter_frames(path, start=0, end=None, stride=1):
+    """
+    Streams (frame_index, frame) from a video, every stride-th frame from start
+    up to (not including) end. Skipped frames are only grabbed, not retrieved.
+    """
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open {path}")
+    try:
+        if start:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        index = start
+        while end is None or index < end:
+            if not cap.grab():
+                break
+            if (index - start) % stride == 0:
+                ok, frame = cap.retrieve()
+                if not ok:
+                    break
+                yield index, frame
+            index += 1
+    finally:
+        cap.release()
+
+
+def video_info(path):
+    """Returns (frame_count, fps) for a video file."""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open {path}")
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    cap.release()
+    return frame_count, fps
+
+
+def motion_thumbnail(frame, width=MOTION_WIDTH):
+    """Small blurred gray copy of a frame for measuring motion between samples."""
+    height = max(1, int(round(frame.shape[0] * width / frame.shape[1])))
+    gray = cv2.cvtColor(cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+    return cv2.GaussianBlur(gray, (5, 5), 0)
+
+
+def keyframes(frames, fps, sample_fps=SAMPLE_FPS, motion_threshold=MOTION_THRESHOLD,
+              stable_seconds=STABLE_SECONDS):
+    """
+    Picks one frame per still period from a stream of sampled frames.
+
+    Args:
+        frames: Iterable of (frame_index, frame), sampled at about sample_fps
+        fps: Frame rate of the video, for the timestamps
+
+    Yields:
+        (frame_index, seconds, frame) once the picture has been still for
+        stable_seconds; again only after something has moved
+    """
+    needed = max(1, int(round(stable_seconds * sample_fps)))
+    previous, still = None, 0
+    for index, frame in frames:
+        thumbnail = motion_thumbnail(frame)
+        if previous is not None and float(cv2.absdiff(previous, thumbnail).mean()) < motion_threshold:
+            still += 1
+        else:
+            still = 0
+        previous = thumbnail
+        if still == needed:
+            yield index, index / fps, frame
+
+
+def _init_worker(config, threads):
+    """Pool initializer: one copy of each model per process, sharing the cores with the others."""
+    global _models
+    cv2.setNumThreads(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    board_model = load_model(config['board_model_path'], config['model_backend'], config['model_int8'])
+    piece_model = load_model(config['piece_model_path'], config['model_backend'], config['model_int8'])
+    _models = (board_model, piece_model, config['piece_conf_threshold'])
+
+
+def read_chunk(path, start, end, fps, sample_fps=SAMPLE_FPS):
+    """
+    Reads the positions from one stretch of video (runs in a pool worker).
+
+    Returns:
+        List of (frame_index, seconds, piece placement) for every keyframe
+        whose board differs from the previous one
+    """
+    board_model, piece_model, conf_threshold = _models
+    stride = max(1, int(round(fps / sample_fps)))
+
+    positions = []
+    lookup = homography = prev_board = None
+    for index, seconds, frame in keyframes(iter_frames(path, start, end, stride), fps, sample_fps):
+        if homography is not None:
+            board = rectify_board(frame, homography)
+            changed = int((square_change_scores(prev_board, board) > CHANGE_THRESHOLD).sum())
+            if changed == 0:
+                continue  # same position as the last keyframe
+            if changed > MAX_CHANGED:
+                homography = None  # camera moved (or an arm is across the board): find the grid again
+
+        if homography is None:
+            try:
+                square_data, fit = get_board(board_model, frame)
+            except (ValueError, IndexError) as e:
+                print(f"No board at {format_time(seconds)}: {e}")
+                continue
+            if fit is None:
+                continue
+            homography = fit.homography
+            lookup = SquareLookup(square_data, homography)
+            board = rectify_board(frame, homography)
+
+        result = piece_model(frame, verbose=False)[0]
+        state = lookup.assign(piece_detections(result, piece_model.names, conf_threshold, with_conf=True))
+        positions.append((index, seconds, state.placement()))
+        prev_board = board
+    return positions
+
+
+def split_video(frame_count, fps, chunk_seconds=CHUNK_SECONDS):
+    """[(start, end), ...] frame ranges of about chunk_seconds each."""
+    step = max(1, int(round(chunk_seconds * fps)))
+    return [(start, min(start + step, frame_count)) for start in range(0, frame_count, step)]
+
+
+def read_positions(path, workers=None, sample_fps=SAMPLE_FPS, chunk_seconds=CHUNK_SECONDS, config=None):
+    """
+    Reads the keyframe positions of a whole video with a process pool.
+
+    Returns:
+        List of (frame_index, seconds, placement) in video order
+    """
+    config = config or load_config()
+    workers = workers or os.cpu_count() or 1
+    frame_count, fps = video_info(path)
+    chunks = split_video(frame_count, fps, chunk_seconds)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    positions = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(config, threads)) as pool:
+        futures = [pool.submit(read_chunk, path, start, end, fps, sample_fps) for start, end in chunks]
+        for i, future in enumerate(futures):
+            positions.extend(future.result())
+            print(f"Chunk {i + 1}/{len(chunks)} done, {len(positions)} positions so far")
+    return positions
+
+
+def format_time(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def _matching_moves(board, placement, depth=2):
+    """Shortest legal move sequence (up to depth plies) that reaches placement, or None."""
+    for move in board.legal_moves:
+        board.push(move)
+        try:
+            if board.board_fen() == placement:
+                return [move]
+            if depth > 1:
+                rest = _matching_moves(board, placement, depth - 1)
+                if rest is not None:
+                    return [move] + rest
+        finally:
+            board.pop()
+    return None
+
+
+def stitch_moves(positions):
+    """
+    Turns the keyframe positions into a move list. Positions that aren't
+    reachable from the current one by a move (pieces hidden by a hand, a
+    misread square) are skipped.
+
+    Returns:
+        (start_placement, [(move, seconds), ...]); moves are UCI strings, or
+        chess.Move objects when python-chess is installed
+    """
+    if not positions:
+        return None, []
+    start = START_PLACEMENT if any(p == START_PLACEMENT for _, _, p in positions) else positions[0][2]
+    first = next(i for i, (_, _, p) in enumerate(positions) if p == start)
+
+    moves = []
+    if chess is None:
+        current = BoardState.from_fen(start)
+        for _, seconds, placement in positions[first + 1:]:
+            state = BoardState.from_fen(placement)
+            move = infer_move(current, state) if state != current else None
+            if move is not None:
+                moves.append((move, seconds))
+                current = state
+        return start, moves
+
+    board = chess.Board(f"{start} w KQkq - 0 1")
+    board.castling_rights = board.clean_castling_rights()
+    for _, seconds, placement in positions[first + 1:]:
+        if placement == board.board_fen():
+            continue
+        found = _matching_moves(board, placement)
+        if found is None and not moves:
+            board.turn = not board.turn  # the first move tells us who was to move
+            found = _matching_moves(board, placement)
+            if found is None:
+                board.turn = not board.turn
+        for move in found or []:
+            moves.append((move, seconds))
+            board.push(move)
+    return start, moves
+
+
+def write_pgn(path, start, moves, video_path):
+    """
+    Writes the game as PGN (needs python-chess); every move carries the video
+    time it was seen at as a comment.
+    """
+    if chess is None:
+        raise RuntimeError("Writing PGN needs python-chess (pip install chess)")
+    game = chess.pgn.Game()
+    game.headers["Event"] = f"Digitised from {os.path.basename(video_path)}"
+    board = chess.Board(f"{start} w KQkq - 0 1")
+    board.castling_rights = board.clean_castling_rights()
+    if moves and moves[0][0] not in board.legal_moves:
+        board.turn = chess.BLACK
+    if board.fen() != chess.STARTING_FEN:
+        game.setup(board)
+    node = game
+    for move, seconds in moves:
+        node = node.add_variation(move)
+        node.comment = format_time(seconds)
+    with open(path, 'w') as f:
+        print(game, file=f, end="\n\n")
+
+
+def write_uci(path, start, moves, video_path):
+    """
+    Writes the moves as a plain UCI list, one "<move> <time>" per line, after
+    comment lines naming the video and the starting placement. Used when
+    python-chess isn't there to check the moves and write SAN.
+    """
+    lines = [f"# Digitised from {os.path.basename(video_path)}", f"# Start {start}"]
+    lines += [f"{move} {format_time(seconds)}" for move, seconds in moves]
+    with open(path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("video")
+    parser.add_argument("--out", default=None,
+                        help=f"PGN path (default: next to the video; {UCI_EXTENSION} without python-chess)")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: one per core)")
+    parser.add_argument("--sample-fps", type=float, default=SAMPLE_FPS)
+    parser.add_argument("--chunk-seconds", type=float, default=CHUNK_SECONDS)
+    parser.add_argument("--positions", default=None, help="also write the keyframe positions as JSON")
+    args = parser.parse_args()
+
+    if chess is None:
+        if args.out and args.out.lower().endswith(".pgn"):
+            raise SystemExit("Writing PGN needs python-chess (pip install chess); "
+                             f"give --out a {UCI_EXTENSION} path for a UCI move list instead")
+        print(f"python-chess is not installed: moves are not checked for legality and are written "
+              f"as a UCI move list ({UCI_EXTENSION}), not PGN")
+
+    start_time = time.perf_counter()
+    positions = read_positions(args.video, args.workers, args.sample_fps, args.chunk_seconds)
+    start, moves = stitch_moves(positions)
+    if start is None:
+        raise SystemExit("No board positions found in the video")
+
+    out = args.out or os.path.splitext(args.video)[0] + (".pgn" if chess is not None else UCI_EXTENSION)
+    (write_pgn if chess is not None else write_uci)(out, start, moves, args.video)
+    if args.positions:
+        with open(args.positions, 'w') as f:
+            json.dump([{'frame': index, 'time': format_time(seconds), 'placement': placement}
+                       for index, seconds, placement in positions], f, indent=2)
+    print(f"{len(positions)} keyframe positions, {len(moves)} moves written to {out} "
+          f"in {time.perf_counter() - start_time:.1f} s")
+
+
+if __name__ == "__main__":
+    main()